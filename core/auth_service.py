@@ -0,0 +1,161 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from core.models import AuthCode, AuthCodeCache, Grade, Student
+
+
+class AuthServiceUnavailable(Exception):
+    pass
+
+
+def normalize(data):
+    if data['status'] == 'ok':
+        data['status'] = 'valid'
+    if data['status'] == 'disabled' or data['status'] == 'banned':
+        data['status'] = 'revoked'
+    return data
+
+
+class AuthServiceClient(object):
+    """
+    Клиент сервиса авторизации: одна сессия с пулом соединений, таймауты,
+    LRU кэш ответов check_code (и отрицательных тоже) на
+    AUTH_SERVICE_CACHE_TTL секунд, не больше AUTH_SERVICE_CACHE_SIZE кодов,
+    и предохранитель: после AUTH_SERVICE_FAILURES ошибок подряд
+    сервис AUTH_SERVICE_RETRY секунд не опрашивается
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.cache = AuthCodeCache('AUTH_SERVICE_CACHE_SIZE', 'AUTH_SERVICE_CACHE_TTL')
+        self.reset()
+
+    def reset(self):
+        self.cache.reset()
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def is_open(self):
+        if self.opened_at is None:
+            return False
+        if time.time() - self.opened_at > settings.AUTH_SERVICE_RETRY:
+            # Пропускаем пробный запрос
+            self.opened_at = None
+            return False
+        return True
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= settings.AUTH_SERVICE_FAILURES:
+                self.opened_at = time.time()
+
+    def check_code(self, code):
+        cached = self.cache.get(code)
+        if cached:
+            return dict(cached)
+        with self.lock:
+            if self.is_open():
+                raise AuthServiceUnavailable('circuit is open')
+        return self.fetch(code)
+
+    def fetch(self, code):
+        """
+        Спрашивает сервис, минуя кэш, и кладет ответ в кэш
+        """
+        try:
+            r = self.session.post(
+                settings.AUTH_SERVICE_URL,
+                data={'code': code},
+                timeout=settings.AUTH_SERVICE_TIMEOUT,
+            )
+            r.raise_for_status()
+            data = normalize(r.json())
+        except (requests.RequestException, ValueError, KeyError) as e:
+            self.failed()
+            raise AuthServiceUnavailable(e)
+
+        with self.lock:
+            self.failures = 0
+        self.cache.set(code, data)
+        return dict(data)
+
+
+client = AuthServiceClient()
+
+
+def known_data(code):
+    """
+    Последние известные данные о коде из AuthCode, если сервис недоступен
+    """
+    a = AuthCode.objects.filter(code=code).select_related(
+        'owner', 'owner__main_grade').first()
+    if not a or a.status not in (AuthCode.STATUS_VALID, AuthCode.STATUS_REVOKED,
+                                 AuthCode.STATUS_NONEXISTENT):
+        return None
+    data = {
+        'status': a.status,
+        'cross_name': a.cross_name,
+        'disabled_at': a.revoked_at,
+        'full_name': None,
+        'year': None,
+        'letter': None,
+    }
+    if a.status == AuthCode.STATUS_NONEXISTENT:
+        data['status'] = 'not_found'
+    if a.owner:
+        data['full_name'] = a.owner.name
+        data['year'] = a.owner.main_grade.graduation_year
+        data['letter'] = a.owner.main_grade.letter
+    return data
+
+
+def find_owner(data):
+    """
+    Выпускник, которому выдан код, по ответу сервиса
+    """
+    g = Grade.objects.filter(
+        graduation_year=data['year'],
+        letter=data['letter'],
+    ).first()
+    if not g:
+        return None
+    return Student.objects.filter(
+        name=data['full_name'],
+        main_grade_id=g.pk,
+    ).first()
+
+
+def apply_data(a, data, owner):
+    """
+    Переносит в AuthCode ответ сервиса. Возвращает True, если что-то
+    изменилось
+    """
+    status = data['status']
+    if status == 'not_found':
+        status = AuthCode.STATUS_NONEXISTENT
+    revoked_at = data.get('disabled_at')
+    if isinstance(revoked_at, basestring):
+        revoked_at = parse_datetime(revoked_at)
+    values = {
+        'status': status,
+        'cross_name': data.get('cross_name') or '',
+        'revoked_at': revoked_at,
+    }
+    if owner:
+        values['owner_id'] = owner.pk
+    changed = False
+    for name, value in values.items():
+        if getattr(a, name) != value:
+            setattr(a, name, value)
+            changed = True
+    return changed
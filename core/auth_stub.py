@@ -0,0 +1,73 @@
+# coding=utf-8
+"""
+Заглушка сервиса авторизации для тестов и замеров: отвечает на
+POST /api/v1/check_code по словарю кодов, с необязательной задержкой
+"""
+from __future__ import unicode_literals
+
+import json
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class AuthStubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        stub = self.server
+        stub.requests += 1
+        if stub.delay:
+            time.sleep(stub.delay)
+        length = int(self.headers.get('Content-Length') or 0)
+        form = urlparse.parse_qs(self.rfile.read(length))
+        code = form.get('code', [''])[0]
+        data = stub.codes.get(code, {'status': 'not_found'})
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AuthStubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, codes=None, delay=0, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), AuthStubHandler)
+        self.codes = codes or {}
+        self.delay = delay
+        self.requests = 0
+
+    @property
+    def url(self):
+        return 'http://%s:%s/api/v1/check_code' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def handle_error(self, request, client_address):
+        # Клиент, не дождавшись ответа, закрывает соединение
+        pass
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def valid_code(full_name, year, letter, cross_name=''):
+    return {
+        'status': 'ok',
+        'full_name': full_name,
+        'year': year,
+        'letter': letter,
+        'cross_name': cross_name,
+        'disabled_at': None,
+    }
@@ -0,0 +1,338 @@
+# coding=utf-8
+"""
+Нагрузочные замеры на синтетических данных. generate заполняет пустую
+базу детерминированно (одинаковый seed — одинаковые данные): у немногих
+популярных выпускников большая часть правок, у популярных правок
+большая часть голосов. run замеряет сценарии — страницы, запросы
+голосов, команды — и возвращает результаты для сохранения в JSON.
+Сценарии, которые пишут в базу, откатываются
+"""
+from __future__ import unicode_literals
+
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from core import canonical, page_cache, rules, suggest
+from core.importing import chunks
+from core.models import (
+    AuthCode, AuthorActivity, FeedEntry, FieldValue, Grade, SearchTerm, Student, Teachers, Vote,
+)
+from core.query_stats import QueryStats
+
+SIZES = OrderedDict([
+    ('grades', 200),
+    ('students', 50000),
+    ('facts', 500000),
+    ('votes', 2000000),
+])
+
+LETTERS = 'АБВГДЕЖЗИКЛМН'
+SYLLABLES = ['ан', 'бо', 'ва', 'ге', 'ди', 'ев', 'жу', 'зо', 'ил', 'ка', 'ло', 'ми', 'но', 'ов',
+             'па', 'ре', 'си', 'та', 'ус', 'фе', 'ха', 'це', 'чу', 'ша', 'эм', 'юн', 'як']
+WORDS = ['Москва', 'Лондон', 'Париж', 'физик', 'математик', 'программист', 'врач', 'Яндекс',
+         'МГУ', 'Google', 'кандидат наук', 'доктор наук', 'Берлин', 'учитель', 'инженер']
+TEXT_FIELDS = (
+    FieldValue.FIELD_CITY, FieldValue.FIELD_PROFESSION, FieldValue.FIELD_COMPANY,
+    FieldValue.FIELD_DEGREE, FieldValue.FIELD_NAME,
+)
+
+
+def skewed(rnd, n, power):
+    """
+    Индекс от 0 до n - 1, малые индексы выпадают чаще
+    """
+    return int(n * rnd.random() ** power)
+
+
+def name(rnd):
+    word = lambda k: ''.join(rnd.choice(SYLLABLES) for i in range(k)).capitalize()
+    return '%s %s' % (word(3), word(2))
+
+
+def fact_value(rnd, field_name, i):
+    if field_name in FieldValue.URL_FIELDS:
+        return 'https://example.com/%s/%d' % (field_name, i)
+    return '%s %d' % (rnd.choice(WORDS), i)
+
+
+def generate(sizes, seed=57, stdout=None):
+    """
+    Заполняет пустую базу: классы с учителями, выпускники, коды (у
+    большинства есть владелец), правки и голоса, затем агрегаты,
+    поисковый индекс, ленту и карточки, как после обычной работы сайта
+    """
+    rnd = random.Random(seed)
+    log = stdout and stdout.write or (lambda msg: None)
+    started = time.time()
+
+    def bulk(model, objs):
+        for batch in chunks(objs, 5000):
+            model.objects.bulk_create(batch)
+
+    years = range(1970, 2030)
+    keys = sorted(set(
+        (years[i % len(years)], LETTERS[i // len(years) % len(LETTERS)])
+        for i in range(sizes['grades'])
+    ))
+    bulk(Grade, [Grade(graduation_year=year, letter=letter) for year, letter in keys])
+    grade_ids = list(Grade.objects.order_by('pk').values_list('pk', flat=True))
+    bulk(Teachers, [
+        Teachers(grade_id=grade_id, torder=i, role='Классный руководитель', content=name(rnd))
+        for grade_id in grade_ids for i in range(2)
+    ])
+    now = timezone.now()
+    bulk(Student, [
+        Student(name=name(rnd), main_grade_id=rnd.choice(grade_ids), import_date=now)
+        for i in range(sizes['students'])
+    ])
+    student_ids = list(Student.objects.order_by('pk').values_list('pk', flat=True))
+    log('Grades and students: %.1fs' % (time.time() - started))
+
+    bulk(AuthCode, [
+        AuthCode(code='57-bench-%d' % i, status=AuthCode.STATUS_VALID, cross_name='',
+                 owner_id=rnd.random() < 0.8 and rnd.choice(student_ids) or None,
+                 trust_level=rnd.choice([0.5, 1, 1, 1, 2]))
+        for i in range(max(1, sizes['students'] // 5))
+    ])
+    code_ids = list(AuthCode.objects.order_by('pk').values_list('pk', flat=True))
+
+    # Популярные выпускники — в начале перемешанного списка
+    popular = list(student_ids)
+    rnd.shuffle(popular)
+    facts = []
+    for i in range(sizes['facts']):
+        field_name = rnd.random() < 0.8 and rnd.choice(TEXT_FIELDS) or rnd.choice(FieldValue.URL_FIELDS)
+        value = fact_value(rnd, field_name, i)
+        facts.append(FieldValue(
+            target_id=popular[skewed(rnd, len(popular), 3)],
+            author_code_id=rnd.choice(code_ids),
+            field_name=field_name,
+            field_value=value,
+            value_key=canonical.value_key(value, field_name in FieldValue.URL_FIELDS),
+        ))
+    bulk(FieldValue, facts)
+    facts = list(FieldValue.objects.order_by('pk').values_list('pk', 'author_code_id'))
+    log('Codes and facts: %.1fs' % (time.time() - started))
+
+    votes = [Vote(field_value_id=pk, author_code_id=code_id, value=Vote.VOTE_ADDED) for pk, code_id in facts]
+    # Один код голосует за правку не больше одного раза (и не за и против
+    # сразу), как требуют уникальные индексы
+    voted = set()
+    for i in range(max(0, sizes['votes'] - len(facts))):
+        pk = facts[skewed(rnd, len(facts), 2)][0]
+        value = rnd.choice([Vote.VOTE_UP] * 7 + [Vote.VOTE_DOWN] * 2 + [Vote.VOTE_TO_DEL])
+        code_id = rnd.random() < 0.9 and rnd.choice(code_ids) or None
+        if code_id:
+            key = (pk, code_id, value == Vote.VOTE_TO_DEL)
+            if key in voted:
+                code_id = None
+            voted.add(key)
+        votes.append(Vote(field_value_id=pk, value=value, author_code_id=code_id))
+        if len(votes) >= 5000:
+            bulk(Vote, votes)
+            votes = []
+    bulk(Vote, votes)
+    log('Votes: %.1fs' % (time.time() - started))
+
+    # bulk_create не вызывает save() и сигналов: досчитываем то, что
+    # сайт пишет по ходу работы
+    call_command('votes', 'update', '--bulk', stdout=StringIO())
+    for batch in chunks(Student.objects.order_by('pk'), 2000):
+        SearchTerm.objects.update_students(batch)
+    for batch in chunks(FieldValue.objects.order_by('pk'), 2000):
+        SearchTerm.objects.update_field_values(batch)
+        FeedEntry.objects.update_field_values(f.pk for f in batch)
+    for batch in chunks(student_ids, 2000):
+        AuthorActivity.objects.rebuild(batch)
+        rules.update_cards(batch)
+    page_cache.get_cache().clear()
+    log('Aggregates, search index, feed and cards: %.1fs' % (time.time() - started))
+
+
+def pick(queryset, field):
+    return queryset.values_list(field, flat=True).first()
+
+
+class Scenarios(object):
+    """
+    Сценарии по именам: каждый метод scenario_* — один запрос или одна
+    команда. Данные для запросов (популярный выпускник, класс, код)
+    выбираются один раз из сгенерированной базы
+    """
+
+    def __init__(self):
+        self.client = Client()
+        self.student = Student.objects.get(pk=pick(
+            FieldValue.objects.values('target_id').annotate(n=Count('pk')).order_by('-n'), 'target_id'))
+        self.grade = self.student.main_grade
+        self.author_id = pick(AuthCode.objects.filter(owner__isnull=False).order_by('pk'), 'owner_id')
+        self.code = pick(AuthCode.objects.order_by('pk'), 'code')
+        self.fact_id = pick(FieldValue.objects.filter(target=self.student).order_by('-vote_count'), 'pk')
+        self.tmp = tempfile.mkdtemp()
+
+    def close(self):
+        shutil.rmtree(self.tmp)
+
+    @classmethod
+    def names(cls):
+        return [n[len('scenario_'):].replace('_', '-') for n in sorted(dir(cls)) if n.startswith('scenario_')]
+
+    def get(self, name, params=None, logged_in=False, **kwargs):
+        self.client.logout()
+        if logged_in:
+            session = self.client.session
+            session['auth_code'] = self.code
+            session.save()
+        # Страницы считаются без кэша страниц
+        page_cache.get_cache().clear()
+        response = self.client.get(reverse(name, kwargs=kwargs), params or {})
+        assert response.status_code == 200, response.status_code
+        # Потоковый ответ рисуется, только пока его читают
+        response.getvalue()
+        return response
+
+    def scenario_grade_list(self):
+        self.get('grade-list')
+
+    def scenario_alphabet(self):
+        self.get('alphabet-list')
+
+    def scenario_students_year(self):
+        self.get('student-list', {'year': self.grade.graduation_year})
+
+    def scenario_students_grade(self):
+        self.get('student-list', {'grade_id': self.grade.pk})
+
+    def scenario_students_char(self):
+        self.get('student-list', {'char': self.student.name[0]})
+
+    def scenario_students_query(self):
+        self.get('student-list', {'query': self.student.name.split()[0][:4]})
+
+    def scenario_suggest(self):
+        self.get('suggest-list', {'query': self.student.name[:3], 'students': '1'})
+
+    def scenario_suggest_rebuild(self):
+        # Первый запрос процесса строит индекс подсказок
+        suggest.index.reset()
+        self.get('suggest-list', {'query': self.student.name[:3], 'students': '1'})
+
+    def scenario_student_detail(self):
+        self.get('student-detail', pk=self.student.pk)
+
+    def scenario_student_detail_logged_in(self):
+        self.get('student-detail', logged_in=True, pk=self.student.pk)
+
+    def scenario_feed(self):
+        self.get('feed')
+
+    def scenario_feed_year(self):
+        self.get('feed', {'year': self.grade.graduation_year})
+
+    def scenario_feed_author(self):
+        self.get('feed', {'author_id': self.author_id})
+
+    def scenario_vote(self):
+        session = self.client.session
+        session['auth_code'] = self.code
+        session.save()
+        with transaction.atomic():
+            response = self.client.post(reverse('field-vote', kwargs={
+                'pk': self.fact_id, 'vote_type': Vote.VOTE_DOWN}))
+            assert response.status_code in (302, 406), response.status_code
+            transaction.set_rollback(True)
+
+    def scenario_votes_update(self):
+        with transaction.atomic():
+            call_command('votes', 'update', '--bulk', stdout=StringIO())
+            transaction.set_rollback(True)
+
+    def scenario_votes_check(self):
+        call_command('votes', 'check', stdout=StringIO())
+
+    def scenario_import_db(self):
+        path = os.path.join(self.tmp, 'students.tsv')
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                for s in Student.objects.select_related('main_grade').iterator():
+                    f.write(('%s\t%s\t%s\n' % (
+                        s.name, s.main_grade.graduation_year, s.main_grade.letter)).encode('utf-8'))
+        with transaction.atomic():
+            call_command('import_db', path, stdout=StringIO())
+            transaction.set_rollback(True)
+
+    def scenario_import_alumni(self):
+        path = os.path.join(self.tmp, 'data.json')
+        if not os.path.exists(path):
+            classes = {}
+            for g in Grade.objects.prefetch_related('student_set', 'teachers'):
+                classes['%s%s' % (g.graduation_year, g.letter)] = {
+                    'year': g.graduation_year,
+                    'name': '%s %s' % (g.graduation_year, '1' + g.letter),
+                    'teachers': [{'role': t.role, 'text': t.content} for t in g.teachers.all()],
+                    'pupils': [s.name for s in g.student_set.all()],
+                }
+            with open(path, 'wb') as f:
+                json.dump(classes, f)
+        with transaction.atomic():
+            call_command('import_alumni', path, '--diff', stdout=StringIO())
+            transaction.set_rollback(True)
+
+
+def run(names=None, repeat=5, stdout=None):
+    """
+    Замеряет сценарии (по умолчанию все) repeat раз каждый; первый,
+    разогревающий, прогон не считается
+    """
+    log = stdout and stdout.write or (lambda msg: None)
+    scenarios = Scenarios()
+    results = OrderedDict()
+    try:
+        for scenario in names or Scenarios.names():
+            method = getattr(scenarios, 'scenario_' + scenario.replace('-', '_'))
+            method()
+            timings, queries = [], []
+            for i in range(repeat):
+                with QueryStats() as stats:
+                    method()
+                timings.append(stats.total_time)
+                queries.append(stats.count)
+            timings.sort()
+            results[scenario] = OrderedDict([
+                ('runs', repeat),
+                ('min', timings[0]),
+                ('median', timings[len(timings) // 2]),
+                ('max', timings[-1]),
+                ('mean', sum(timings) / len(timings)),
+                ('queries', max(queries)),
+            ])
+            log('%-28s median %8.1fms  min %8.1fms  queries %d' % (
+                scenario, timings[len(timings) // 2] * 1000, timings[0] * 1000, max(queries)))
+    finally:
+        scenarios.close()
+    return OrderedDict([
+        ('started_at', timezone.now().isoformat()),
+        ('database', connection.vendor),
+        ('python', platform.python_version()),
+        ('counts', OrderedDict([
+            ('grades', Grade.objects.count()),
+            ('students', Student.objects.count()),
+            ('facts', FieldValue.objects.count()),
+            ('votes', Vote.objects.count()),
+        ])),
+        ('scenarios', results),
+    ])
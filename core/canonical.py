@@ -0,0 +1,63 @@
+# coding=utf-8
+"""
+Ключ значения факта для поиска одинаковых значений: разные записи одной
+ссылки или одного слова дают один ключ. Ключ хранится в
+FieldValue.value_key и не показывается
+"""
+from __future__ import unicode_literals
+
+import unicodedata
+import urllib
+import urlparse
+
+from django.utils.encoding import force_text
+
+MAX_LENGTH = 255
+
+DEFAULT_PORTS = (80, 443)
+
+
+def fold_text(text):
+    """
+    Текст без различий в регистре, ё/е, записи символов Юникода и
+    пробелах: «Ёлки  Палки» и «елки палки» совпадают
+    """
+    text = unicodedata.normalize('NFKC', force_text(text)).lower().replace('ё', 'е')
+    return ' '.join(text.split())
+
+
+def canonical_url(url):
+    """
+    Ссылка без схемы, www., порта по умолчанию, якоря и завершающего /,
+    с декодированным путем: http://www.Example.com/a/ и
+    https://example.com/a дают example.com/a
+    """
+    url = force_text(url).strip()
+    if '://' not in url:
+        url = 'http://' + url
+    try:
+        parts = urlparse.urlsplit(url)
+    except ValueError:
+        # Например, незакрытая [ адреса IPv6: ссылку проверяет только
+        # форма сайта, в админке, импорте и старых данных бывает что угодно
+        return fold_text(url)
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[len('www.'):]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port not in DEFAULT_PORTS:
+        host += ':%d' % port
+    path = urllib.unquote(parts.path.encode('utf-8')).decode('utf-8', 'replace')
+    key = host + unicodedata.normalize('NFKC', path).rstrip('/')
+    if parts.query:
+        key += '?' + parts.query
+    return key
+
+
+def value_key(value, is_url=False):
+    if is_url:
+        return canonical_url(value)[:MAX_LENGTH]
+    return fold_text(value)[:MAX_LENGTH]
@@ -0,0 +1,303 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import codecs
+import hashlib
+import json
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from core import page_cache
+from core.models import Grade, Student, SearchTerm, Teachers
+from core.utils import bulk_update
+
+BATCH_SIZE = 500
+
+
+def chunks(items, size=BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def load_grades():
+    return {(g.graduation_year, g.letter): g for g in Grade.objects.all()}
+
+
+def digest(records):
+    """
+    Отпечаток набора записей класса, не зависящий от их порядка
+    """
+    return hashlib.sha1(json.dumps(sorted(records))).hexdigest()
+
+
+def grade_letter(name):
+    """
+    Буква класса из его названия в data.json, как в convert_json
+    """
+    return force_text(name.split()[1])[1]
+
+
+def iter_classes(f, chunk_size=64 * 1024):
+    """
+    Разбирает data.json (объект «ключ: класс») по одному классу, не читая
+    файл целиком. Выдает пары (ключ, класс)
+    """
+    reader = codecs.getreader('utf-8')(f)
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n{,':
+            pos += 1
+        if pos < len(buf) and buf[pos] == '}':
+            return
+        try:
+            key, end = decoder.raw_decode(buf, pos)
+            while end < len(buf) and buf[end] in ' \t\r\n:':
+                end += 1
+            value, end = decoder.raw_decode(buf, end)
+        except ValueError:
+            # Класс не поместился в буфер целиком, дочитываем
+            if eof:
+                if pos == len(buf):
+                    return
+                raise
+            chunk = reader.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        pos = end
+        yield key, value
+
+
+def transform_class(data):
+    """
+    Класс из data.json: ((год, буква), учителя (порядок, роль, имя), ученики)
+    """
+    key = (int(data['year']), grade_letter(data['name']))
+    teachers = [
+        (i, teacher['role'], teacher['text'])
+        for i, teacher in enumerate(data['teachers'])
+    ]
+    return key, teachers, list(data['pupils'])
+
+
+class Importer(object):
+    """
+    Загрузка классов, учителей и выпускников пачками. Все уже известные
+    классы, пары (имя, класс) и учителя читаются один раз в конструкторе.
+    Транзакцию открывает вызывающий.
+
+    В дифференциальном режиме (differential=True) записываются только
+    изменения: отпечатки выпускников и учителей каждого пришедшего класса
+    сравниваются с сохраненными, у известных выпускников import_date не
+    трогается, учителя вставляются, правятся и удаляются построчно.
+    Изменения копятся в changes
+    """
+
+    def __init__(self, timestamp=None, differential=False):
+        self.timestamp = timestamp or timezone.now()
+        self.differential = differential
+        self.grades = load_grades()
+        self.keys = {g.pk: key for key, g in self.grades.items()}
+        self.existing = {
+            (name, grade_id): pk
+            for name, grade_id, pk in Student.objects.values_list('name', 'main_grade_id', 'pk')
+        }
+        self.teachers = defaultdict(dict)
+        for pk, grade_id, torder, role, content in Teachers.objects.values_list(
+                'pk', 'grade_id', 'torder', 'role', 'content'):
+            self.teachers[grade_id][torder] = (pk, role, content)
+        self.seen = set()
+        self.touched = set()
+        # Области кэша страниц, которые затронул импорт (bulk-запросы
+        # не посылают сигналов)
+        self.scopes = set()
+        self.changes = []
+        self.counts = {
+            'grades': 0, 'inserted': 0,
+            'teachers_inserted': 0, 'teachers_updated': 0, 'teachers_deleted': 0,
+        }
+
+    def grade_name(self, grade_id):
+        return '%s%s' % self.keys[grade_id]
+
+    def add_grades(self, keys):
+        """
+        Создает недостающие классы одним запросом
+        """
+        new = set(keys) - set(self.grades)
+        if new:
+            Grade.objects.bulk_create(
+                Grade(graduation_year=year, letter=letter) for year, letter in sorted(new))
+            self.grades.update(load_grades())
+            self.keys = {g.pk: key for key, g in self.grades.items()}
+            self.counts['grades'] += len(new)
+            self.scopes.add(page_cache.GRADES)
+            self.changes.extend('+ grade %s%s' % key for key in sorted(new))
+
+    def add_students(self, rows):
+        """
+        Строки (имя, год выпуска, буква класса): новых выпускников вставляет,
+        уже известным одним запросом на пачку выставляет import_date
+        """
+        rows = [(name, int(year), letter) for name, year, letter in rows]
+        self.add_grades((year, letter) for name, year, letter in rows)
+        keys = [(name, self.grades[year, letter].pk) for name, year, letter in rows]
+        self.seen.update(keys)
+
+        if self.differential:
+            by_grade = defaultdict(set)
+            for name, grade_id in keys:
+                by_grade[grade_id].add(name)
+            stored = defaultdict(set)
+            for name, grade_id in self.existing:
+                if grade_id in by_grade:
+                    stored[grade_id].add(name)
+            keys = [
+                (name, grade_id) for name, grade_id in keys
+                if digest(by_grade[grade_id]) != digest(stored[grade_id])
+            ]
+
+        new, touched = {}, set()
+        for key in keys:
+            if key in self.existing:
+                touched.add(self.existing[key])
+            elif key not in new:
+                new[key] = Student(name=key[0], main_grade_id=key[1], import_date=self.timestamp)
+                self.changes.append('+ student %s %s' % (key[0], self.grade_name(key[1])))
+
+        if new:
+            last_id = Student.objects.aggregate(last_id=Max('pk'))['last_id'] or 0
+            Student.objects.bulk_create(new.values(), batch_size=BATCH_SIZE)
+            # bulk_create не вызывает save(), индексируем имена сами
+            for batch in chunks(Student.objects.filter(pk__gt=last_id).order_by('pk')):
+                SearchTerm.objects.update_students(batch)
+                for s in batch:
+                    self.existing[s.name, s.main_grade_id] = s.pk
+                    self.scopes.update(page_cache.student_scopes(
+                        s.name, s.main_grade_id, self.keys[s.main_grade_id][0]))
+            self.counts['inserted'] += len(new)
+
+        if self.differential:
+            return
+        touched -= self.touched
+        for batch in chunks(sorted(touched)):
+            Student.objects.filter(pk__in=batch).update(import_date=self.timestamp)
+        self.touched |= touched
+
+    def replace_teachers(self, rows):
+        """
+        Строки (год, буква, порядок, роль, имя): учителя каждого
+        упомянутого класса заменяются пришедшими
+        """
+        rows = [(int(year), letter, int(torder), role, name)
+                for year, letter, torder, role, name in rows]
+        self.add_grades((year, letter) for year, letter, torder, role, name in rows)
+        incoming = defaultdict(dict)
+        for year, letter, torder, role, name in rows:
+            incoming[self.grades[year, letter].pk][torder] = (role, name)
+
+        to_delete, to_update, to_insert = [], [], []
+        for grade_id, new in sorted(incoming.items()):
+            old = self.teachers[grade_id]
+            if self.differential:
+                if digest(new.items()) == digest((k, v[1:]) for k, v in old.items()):
+                    continue
+            self.scopes.update([page_cache.grade_scope(grade_id),
+                                page_cache.year_scope(self.keys[grade_id][0])])
+            if not self.differential:
+                to_delete.extend(pk for pk, role, content in old.values())
+                to_insert.extend((grade_id, torder) for torder in new)
+                self.teachers[grade_id] = {}
+                continue
+            for torder, (pk, role, content) in old.items():
+                if torder not in new:
+                    to_delete.append(pk)
+                    self.changes.append('- teacher %s %s %s' % (self.grade_name(grade_id), role, content))
+                    del self.teachers[grade_id][torder]
+                elif new[torder] != (role, content):
+                    to_update.append(Teachers(pk=pk, grade_id=grade_id, torder=torder,
+                                              role=new[torder][0], content=new[torder][1],
+                                              updated_at=timezone.now()))
+                    self.changes.append('~ teacher %s %s %s -> %s %s' % (
+                        (self.grade_name(grade_id), role, content) + new[torder]))
+                    self.teachers[grade_id][torder] = (pk,) + new[torder]
+            for torder in new:
+                if torder not in old:
+                    to_insert.append((grade_id, torder))
+                    self.changes.append('+ teacher %s %s %s' % (
+                        (self.grade_name(grade_id),) + new[torder]))
+
+        for batch in chunks(to_delete):
+            Teachers.objects.filter(pk__in=batch).delete()
+        bulk_update(to_update, ('role', 'content', 'updated_at'))
+        Teachers.objects.bulk_create([
+            Teachers(grade_id=grade_id, torder=torder,
+                     role=incoming[grade_id][torder][0], content=incoming[grade_id][torder][1])
+            for grade_id, torder in to_insert
+        ], batch_size=BATCH_SIZE)
+        self.counts['teachers_deleted'] += len(to_delete)
+        self.counts['teachers_updated'] += len(to_update)
+        self.counts['teachers_inserted'] += len(to_insert)
+
+    def add_classes(self, classes):
+        """
+        Классы в виде transform_class
+        """
+        self.add_grades(key for key, teachers, pupils in classes)
+        self.replace_teachers(
+            key + teacher for key, teachers, pupils in classes for teacher in teachers)
+        self.add_students(
+            (name,) + key for key, teachers, pupils in classes for name in pupils)
+
+    def missing(self):
+        """
+        Загруженные раньше выпускники, которых нет в новом источнике
+        """
+        students = Student.objects.filter(
+            import_date__isnull=False,
+        ).select_related('main_grade').order_by('main_grade', 'name')
+        return [s for s in students if (s.name, s.main_grade_id) not in self.seen]
+
+    def result(self):
+        counts = dict(self.counts)
+        counts['updated'] = len(self.touched)
+        counts['unchanged'] = len(self.existing) - len(self.touched) - counts['inserted']
+        return counts
+
+
+@contextmanager
+def run_import(differential=False, dry_run=False):
+    """
+    Импорт в одной транзакции. При dry_run (всегда дифференциальном)
+    изменения считаются и откатываются
+    """
+    with transaction.atomic():
+        importer = Importer(differential=differential or dry_run)
+        yield importer
+        if dry_run:
+            transaction.set_rollback(True)
+    if not dry_run:
+        page_cache.invalidate(*importer.scopes)
+
+
+def report(importer, stdout, verbosity=1):
+    """
+    Печатает изменения дифференциального импорта и выпускников,
+    пропавших из источника
+    """
+    if not importer.differential:
+        return
+    missing = importer.missing()
+    if verbosity > 0:
+        for line in importer.changes:
+            stdout.write(line)
+        for s in missing:
+            stdout.write('? missing %s %s' % (s.name, s.main_grade))
+    stdout.write('Missing from source: %d' % len(missing))
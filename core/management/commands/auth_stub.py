@@ -0,0 +1,28 @@
+# coding=utf-8
+from django.core.management.base import BaseCommand
+
+from core.auth_stub import AuthStubServer, valid_code
+from core.models import AuthCode
+
+
+class Command(BaseCommand):
+    help = 'Run auth service stub answering for known auth codes ' \
+           '(set AUTH_SERVICE_URL to its url to measure login offline)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8057)
+        parser.add_argument('--delay', type=float, default=0,
+                            help='Seconds to wait before every answer')
+
+    def handle(self, *args, **options):
+        codes = {}
+        for a in AuthCode.objects.filter(owner__isnull=False).select_related('owner__main_grade'):
+            grade = a.owner.main_grade
+            codes[a.code] = valid_code(a.owner.name, grade.graduation_year, grade.letter, a.cross_name)
+        server = AuthStubServer(codes, options['delay'], port=options['port'])
+        self.stdout.write('Serving %d codes at %s' % (len(codes), server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('Answered %d requests' % server.requests)
@@ -0,0 +1,67 @@
+# coding=utf-8
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import benchmark
+from core.models import Student
+
+
+class Command(BaseCommand):
+    help = 'Fill an empty database with synthetic data and time views and commands on it'
+    CMD_GENERATE = 'generate'
+    CMD_RUN = 'run'
+    COMMANDS = (CMD_GENERATE, CMD_RUN)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'subcommand',
+            help="""`generate' to fill an empty database with synthetic data,
+            `run' to time scenarios and write the results as JSON
+            """
+        )
+        for key, default in benchmark.SIZES.items():
+            parser.add_argument('--' + key, type=int, default=default,
+                                help='generate: number of %s' % key)
+        parser.add_argument('--scale', type=float, default=1,
+                            help='generate: multiply all sizes, e.g. 0.01 for a quick run')
+        parser.add_argument('--seed', type=int, default=57,
+                            help='generate: the same seed gives the same data')
+        parser.add_argument('--only', default='',
+                            help='run: comma separated scenarios, one of: %s' % ', '.join(
+                                benchmark.Scenarios.names()))
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='run: timed runs of each scenario after one warm-up run')
+        parser.add_argument('--output', default='',
+                            help='run: JSON file for the results, stdout by default')
+
+    def handle(self, *args, **options):
+        subcommand = options.get('subcommand')
+        if subcommand not in self.COMMANDS:
+            raise CommandError('Unknown subcommand {}. Use generate|run'.format(subcommand))
+        self.options = options
+        self.__getattribute__('run_' + subcommand)()
+
+    def run_generate(self):
+        if Student.objects.exists():
+            raise CommandError('The database is not empty. Point DATABASES to a separate '
+                               'benchmark database')
+        sizes = {key: max(1, int(self.options[key] * self.options['scale'])) for key in benchmark.SIZES}
+        self.stdout.write('Generating %(grades)d grades, %(students)d students, %(facts)d facts, '
+                          '%(votes)d votes' % sizes)
+        benchmark.generate(sizes, self.options['seed'], self.stdout)
+
+    def run_run(self):
+        names = [n for n in self.options['only'].split(',') if n]
+        unknown = set(names) - set(benchmark.Scenarios.names())
+        if unknown:
+            raise CommandError('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+        if not Student.objects.exists():
+            raise CommandError('The database is empty, run `benchmark generate\' first')
+        results = benchmark.run(names, self.options['repeat'], self.stderr)
+        data = json.dumps(results, indent=2)
+        if self.options['output']:
+            with open(self.options['output'], 'w') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
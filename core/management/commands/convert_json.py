@@ -1,7 +1,9 @@
 import json
 
 from django.core.management.base import BaseCommand
-from django.utils.encoding import force_str, force_text
+from django.utils.encoding import force_str
+
+from core.importing import grade_letter
 
 
 class Command(BaseCommand):
@@ -21,7 +23,7 @@ class Command(BaseCommand):
 
         for kla, d in data.items():
             year = str(d['year'])
-            letter = force_text(d['name'].split()[1])[1]
+            letter = grade_letter(d['name'])
             for i, teacher in enumerate(d['teachers']):
                 teachers.write(year)
                 teachers.write('\t')
@@ -0,0 +1,54 @@
+# coding=utf-8
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from core.importing import iter_classes, transform_class, run_import, report
+
+
+class Command(BaseCommand):
+    help = 'Import grades, teachers and students from sch57 data.json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file_json')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Classes written at once')
+        parser.add_argument('--diff', action='store_true', default=False,
+                            help='Write only changes, keep import_date of known students')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Report changes without saving them')
+
+    def handle(self, *args, **options):
+        # Время каждой стадии считается отдельно
+        elapsed = {'parse': 0, 'transform': 0, 'write': 0}
+        classes = 0
+        with open(options['file_json'], 'rb') as f, \
+                run_import(options['diff'], options['dry_run']) as importer:
+            parsed = iter_classes(f)
+            while True:
+                started = time.time()
+                batch = list(islice(parsed, options['batch_size']))
+                elapsed['parse'] += time.time() - started
+                if not batch:
+                    break
+
+                started = time.time()
+                batch = [transform_class(data) for key, data in batch]
+                elapsed['transform'] += time.time() - started
+
+                started = time.time()
+                importer.add_classes(batch)
+                elapsed['write'] += time.time() - started
+                classes += len(batch)
+            report(importer, self.stdout, options['verbosity'])
+
+        counts = importer.result()
+        self.stdout.write(
+            'Classes: %d, grades added: %d, teachers inserted: %d, updated: %d, deleted: %d, '
+            'students inserted: %d, updated: %d, unchanged: %d' % (
+                classes, counts['grades'], counts['teachers_inserted'], counts['teachers_updated'],
+                counts['teachers_deleted'], counts['inserted'], counts['updated'], counts['unchanged']))
+        self.stdout.write('Time: parse %.2fs, transform %.2fs, write %.2fs' % (
+            elapsed['parse'], elapsed['transform'], elapsed['write']))
+        self.stdout.write(self.style.SUCCESS('Successfully import'))
@@ -1,7 +1,6 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
 
-from core.models import Grade, Student
+from core.importing import run_import, report
 
 
 class Command(BaseCommand):
@@ -9,22 +8,20 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('file_tsv')
+        parser.add_argument('--diff', action='store_true', default=False,
+                            help='Write only changes, keep import_date of known students')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Report changes without saving them')
 
     def handle(self, *args, **options):
         with open(options['file_tsv']) as f:
-            for line in f:
-                name, year, grade = line.rstrip('\r\n').split('\t')
-                g, g_created = Grade.objects.get_or_create(
-                    graduation_year=year, letter=grade)
-                s, s_created = Student.objects.get_or_create(
-                    name=name, main_grade=g,
-                    defaults={
-                        'import_date': timezone.now(),
-                    }
-                )
-                if not s_created:
-                    s.import_date = timezone.now()
-                    s.save(update_fields=['import_date'])
+            rows = [line.decode('utf-8').rstrip('\r\n').split('\t') for line in f]
+        with run_import(options['diff'], options['dry_run']) as importer:
+            importer.add_students(rows)
+            report(importer, self.stdout, options['verbosity'])
+        counts = importer.result()
 
         self.stdout.write(
-            self.style.SUCCESS('Successfully import'))
+            self.style.SUCCESS(
+                'Successfully import: %(grades)d grades added, %(inserted)d students inserted, '
+                '%(updated)d updated, %(unchanged)d unchanged' % counts))
@@ -1,5 +1,6 @@
-from django.core.management.base import BaseCommand, CommandError
-from core.models import Grade, Teachers
+from django.core.management.base import BaseCommand
+
+from core.importing import run_import
 
 
 class Command(BaseCommand):
@@ -7,18 +8,22 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('file_tsv')
+        parser.add_argument('--diff', action='store_true', default=False,
+                            help='Write only changed teachers')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Report changes without saving them')
 
     def handle(self, *args, **options):
-        cleared_grades = set()
         with open(options['file_tsv']) as f:
-            for line in f:
-                year, letter, torder, role, name = line.rstrip('\r\n').split('\t')
-                g, g_created = Grade.objects.get_or_create(
-                    graduation_year=year, letter=letter)
-                if g.pk not in cleared_grades:
-                    Teachers.objects.filter(grade_id=g.pk).delete()
-                    cleared_grades.add(g.pk)
-                g.teachers.create(role=role, content=name, torder=torder)
+            rows = [line.decode('utf-8').rstrip('\r\n').split('\t') for line in f]
+        with run_import(options['diff'], options['dry_run']) as importer:
+            importer.replace_teachers(rows)
+            if importer.differential and options['verbosity'] > 0:
+                for line in importer.changes:
+                    self.stdout.write(line)
+        counts = importer.result()
 
         self.stdout.write(
-            self.style.SUCCESS('Successfully import'))
+            self.style.SUCCESS(
+                'Successfully import: %(grades)d grades added, teachers %(teachers_inserted)d inserted, '
+                '%(teachers_updated)d updated, %(teachers_deleted)d deleted' % counts))
@@ -0,0 +1,98 @@
+# coding=utf-8
+import os
+import pstats
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import profiling
+
+
+class Command(BaseCommand):
+    help = 'Summarize request profiles from PROFILE_DIR'
+    CMD_REPORT = 'report'
+    CMD_TOKEN = 'token'
+    COMMANDS = (CMD_REPORT, CMD_TOKEN)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'subcommand',
+            help="""`report' to print where time goes for each view and merge the stacks,
+            `token' to print a value for the X-Profile header that profiles one request
+            """
+        )
+        parser.add_argument('--dir', default=None,
+                            help='report: directory with profiles, PROFILE_DIR by default')
+        parser.add_argument('--view', default=None,
+                            help='report: only this view (url name)')
+        parser.add_argument('--output', default=None,
+                            help='report: write merged collapsed stacks for flamegraph.pl, '
+                                 'the view name is the root frame')
+        parser.add_argument('--top', type=int, default=10,
+                            help='report: functions to show for .prof files')
+
+    def handle(self, *args, **options):
+        subcommand = options.get('subcommand')
+        if subcommand not in self.COMMANDS:
+            raise CommandError('Unknown subcommand {}. Use report|token'.format(subcommand))
+        self.options = options
+        self.__getattribute__('run_' + subcommand)()
+
+    def run_token(self):
+        self.stdout.write('X-Profile: %s' % profiling.make_token())
+
+    def run_report(self):
+        directory = self.options['dir'] or getattr(settings, 'PROFILE_DIR', None)
+        if not directory or not os.path.isdir(directory):
+            raise CommandError('No profiles directory, set PROFILE_DIR or pass --dir')
+        collapsed = defaultdict(list)
+        prof = defaultdict(list)
+        for name in sorted(os.listdir(directory)):
+            view = profiling.view_name(name)
+            if self.options['view'] and view != self.options['view']:
+                continue
+            path = os.path.join(directory, name)
+            if name.endswith('.collapsed'):
+                collapsed[view].append(path)
+            elif name.endswith('.prof'):
+                prof[view].append(path)
+
+        merged = []
+        for view, paths in sorted(collapsed.items()):
+            stacks = Counter()
+            for path in paths:
+                with open(path) as f:
+                    for line in f:
+                        stack, count = line.rstrip('\n').rsplit(' ', 1)
+                        stacks[stack] += int(count)
+            by_category = Counter()
+            for stack, count in stacks.items():
+                frames = reversed(stack.split(';'))
+                by_category[profiling.category(f.rsplit(':', 1)[0] for f in frames)] += count
+            self.write_summary(view, len(paths), by_category, 'samples')
+            merged.extend('%s;%s %d' % (view, stack, count) for stack, count in stacks.items())
+
+        for view, paths in sorted(prof.items()):
+            stats = pstats.Stats(*paths)
+            by_category = Counter()
+            for (filename, line, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+                by_category[profiling.category([filename])] += tt
+            self.write_summary(view, len(paths), by_category, 's')
+            functions = sorted(stats.stats.items(), key=lambda x: -x[1][2])[:self.options['top']]
+            for (filename, line, func), (cc, nc, tt, ct, callers) in functions:
+                self.stdout.write('    %8.3fs %8d  %s:%d(%s)' % (
+                    tt, nc, profiling.short_name(filename), line, func))
+
+        if self.options['output']:
+            with open(self.options['output'], 'w') as f:
+                f.write('\n'.join(merged) + '\n')
+        if not collapsed and not prof:
+            self.stdout.write('No profiles')
+
+    def write_summary(self, view, requests, by_category, unit):
+        total = sum(by_category.values()) or 1
+        self.stdout.write('%s: %d requests, %s %s; %s' % (
+            view, requests, unit == 's' and '%.3f' % total or total, unit, ', '.join(
+                '%s %.0f%%' % (name, 100.0 * by_category[name] / total)
+                for name in ('orm', 'templates', 'rules', 'other'))))
@@ -0,0 +1,108 @@
+# coding=utf-8
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import auth_service, rules
+from core.models import AuthCode, AuthorActivity
+from core.utils import bulk_update
+
+
+class RateLimiter(object):
+    """
+    Не больше rate запросов в секунду на все потоки
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = time.time()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Command(BaseCommand):
+    help = 'Revalidate all auth codes against the auth service and ' \
+           'recompute fields the changed codes voted on'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-id', type=int, default=0,
+                            help='Resume from this AuthCode id')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--rate', type=float, default=10,
+                            help='Requests per second, 0 for no limit')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--dry-run', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        limiter = RateLimiter(options['rate'])
+
+        def check(a):
+            limiter.wait()
+            try:
+                return a, auth_service.client.fetch(a.code)
+            except auth_service.AuthServiceUnavailable as e:
+                return a, e
+
+        pool = ThreadPool(options['workers'])
+        codes = AuthCode.objects.filter(id__gte=options['start_id']).order_by('id')
+        last_id = options['start_id'] - 1
+        total = changed_total = pairs_total = 0
+        try:
+            while True:
+                batch = list(codes.filter(id__gt=last_id)[:options['batch_size']])
+                if not batch:
+                    break
+                changed = []
+                for a, data in pool.imap(check, batch):
+                    if isinstance(data, Exception):
+                        raise CommandError('Auth service error on code #%d: %s. '
+                                           'Resume with --start-id %d' % (a.pk, data, a.pk))
+                    old = (a.status, a.owner_id)
+                    # Имя и класс владельца есть только в ответе о действующем коде
+                    owner = data['status'] == 'valid' and auth_service.find_owner(data) or None
+                    if auth_service.apply_data(a, data, owner):
+                        a.old = old
+                        changed.append(a)
+                total += len(batch)
+                changed_total += len(changed)
+                pairs_total += self.save(changed, options['dry_run'])
+                last_id = batch[-1].pk
+                self.stdout.write('Checked %d codes, %d changed, up to #%d' % (
+                    total, changed_total, last_id))
+        finally:
+            pool.close()
+        self.stdout.write('Done: %d codes, %d changed, %d fields recomputed' % (
+            total, changed_total, pairs_total))
+
+    def save(self, changed, dry_run):
+        """
+        Записывает измененные коды и пересчитывает пары (target, field_name),
+        за которые голосовали коды со сменившимся владельцем или статусом
+        """
+        pairs = rules.code_pairs(a.pk for a in changed if a.old != (a.status, a.owner_id))
+        if dry_run:
+            for a in changed:
+                self.stdout.write('#%d %s: %s, owner %s' % (a.pk, a.code, a.status, a.owner_id))
+            return len(pairs)
+        now = timezone.now()
+        for a in changed:
+            a.updated_at = now
+        bulk_update(changed, ('status', 'cross_name', 'revoked_at', 'owner', 'updated_at'))
+        AuthCode.objects.cache.forget(*[a.code for a in changed])
+        AuthorActivity.objects.rebuild(
+            owner_id for a in changed if a.old[1] != a.owner_id
+            for owner_id in (a.old[1], a.owner_id)
+        )
+        for target_id, field_name in pairs:
+            rules.update_fields(target_id, field_name)
+        return len(pairs)
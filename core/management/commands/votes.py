@@ -1,21 +1,43 @@
 # coding=utf-8
+import multiprocessing
+import os
 import sys
+import time
 
-from itertools import groupby
+from itertools import groupby, imap
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
 from django.db.models import Max
 
 from core import rules
 from core.models import FieldValue, Vote
 
 
+def score_shard(shard):
+    """
+    Пересчитывает выпускников с id в [target_from, target_to).
+    Выполняется в процессах пула, в базу не пишет
+    """
+    target_from, target_to = shard
+    started = time.time()
+    changes, total_votes = rules.recompute_targets(target_from, target_to, force_update=True)
+    return {
+        'shard': shard,
+        'pid': os.getpid(),
+        'edits': [edit for edit, fields in changes],
+        'votes': total_votes,
+        'elapsed': time.time() - started,
+    }
+
+
 class Command(BaseCommand):
     help = 'Manage votes'
     CMD_CHECK = 'check'
     CMD_CONVERT = 'convert'
     CMD_UPDATE = 'update'
-    COMMANDS = (CMD_CHECK, CMD_CONVERT, CMD_UPDATE)
+    CMD_VERIFY = 'verify'
+    COMMANDS = (CMD_CHECK, CMD_CONVERT, CMD_UPDATE, CMD_VERIFY)
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -23,14 +45,28 @@ class Command(BaseCommand):
             help="""`check' to check if votes are allright,
             `convert' to try to convert bad votes,
             `update' to recalculate fields scores and statuses 
+            `verify' to compare stored vote aggregates with a recalculation
             """
         )
+        parser.add_argument(
+            '--bulk', action='store_true',
+            help="update: read all votes in one pass and write changes in batches"
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="update --bulk: only report fields whose status or score would change"
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help="update --bulk: number of processes scoring shards of students"
+        )
 
     def handle(self, *args, **options):
         subcommand = options.get('subcommand')
         if subcommand not in self.COMMANDS:
-            raise CommandError('Unknown subcommand {}. Use check|convert|update'.format(subcommand))
+            raise CommandError('Unknown subcommand {}. Use check|convert|update|verify'.format(subcommand))
 
+        self.options = options
         self.__getattribute__('run_' + subcommand)()
 
     def run_check(self):
@@ -61,12 +97,104 @@ class Command(BaseCommand):
         self.stdout.write("Total actions taken: {}".format(total_actions))
 
     def run_update(self):
+        if self.options['bulk']:
+            return self._bulk_update()
+        if self.options['dry_run'] or self.options['workers'] != 1:
+            raise CommandError('--dry-run and --workers work only with --bulk')
         for item in FieldValue.objects \
                 .values('target_id', 'field_name') \
                 .annotate(last_vote=Max('vote__timestamp')) \
                 .order_by('last_vote'):
             rules.update_fields(item['target_id'], item['field_name'], timestamp=item['last_vote'], force_update=True)
 
+    # Выпускников в одном шарде `update --bulk', шард читается одним запросом
+    SHARD_TARGETS = 200
+
+    def _shards(self):
+        target_ids = list(FieldValue.objects.order_by('target_id')
+                          .values_list('target_id', flat=True).distinct())
+        for i in range(0, len(target_ids), self.SHARD_TARGETS):
+            chunk = target_ids[i:i + self.SHARD_TARGETS]
+            yield chunk[0], chunk[-1] + 1
+
+    def _bulk_update(self):
+        dry_run = self.options['dry_run']
+        workers = self.options['workers']
+        started = time.time()
+        shards = list(self._shards())
+
+        pool = None
+        if workers > 1:
+            # Дочерние процессы открывают свои соединения
+            connections.close_all()
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(score_shard, shards)
+        else:
+            results = imap(score_shard, shards)
+
+        total_fields = 0
+        total_diffs = 0
+        total_votes = 0
+        by_worker = {}
+        try:
+            with transaction.atomic():
+                for result in results:
+                    edits = result['edits']
+                    total_fields += len(edits)
+                    total_votes += result['votes']
+                    worker = by_worker.setdefault(result['pid'], [0, 0, 0.0])
+                    worker[0] += 1
+                    worker[1] += result['votes']
+                    worker[2] += result['elapsed']
+                    if self.options['verbosity'] > 1:
+                        self.stdout.write("Shard {}-{}: {} votes, {} fields in {:.2f}s ({:.0f} votes/s)".format(
+                            result['shard'][0], result['shard'][1] - 1, result['votes'], len(edits),
+                            result['elapsed'], result['votes'] / max(result['elapsed'], 1e-6),
+                        ))
+                    for edit in edits:
+                        if edit.status != edit.old_status or edit.votes != edit.old_votes:
+                            total_diffs += 1
+                            if dry_run:
+                                self.stdout.write(self._diff(edit))
+                    if not dry_run:
+                        rules.save_changes(edits)
+        except BaseException:
+            # Остальные шарды уже не нужны
+            if pool:
+                pool.terminate()
+            raise
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        elapsed = time.time() - started
+        for pid, (shards_done, votes, busy) in sorted(by_worker.items()):
+            self.stdout.write("Worker {}: {} shards, {} votes in {:.2f}s ({:.0f} votes/s)".format(
+                pid, shards_done, votes, busy, votes / max(busy, 1e-6)))
+        self.stdout.write("Fields recalculated: {}".format(total_fields))
+        self.stdout.write("Fields with changed status or score: {}".format(total_diffs))
+        self.stdout.write("Votes: {} in {:.2f}s ({:.0f} votes/s)".format(
+            total_votes, elapsed, total_votes / max(elapsed, 1e-6)))
+
+    def run_verify(self):
+        total_fields = 0
+        stale_fields = 0
+        for target_from, target_to in self._shards():
+            changes, total_votes = rules.recompute_targets(target_from, target_to)
+            total_fields += FieldValue.objects.filter(
+                target_id__gte=target_from, target_id__lt=target_to).count()
+            for edit, fields in changes:
+                stale_fields += 1
+                self._err("{}; stale: {}".format(self._diff(edit), ', '.join(fields)))
+        self.stdout.write("Fields with stale aggregates: {}/{}".format(stale_fields, total_fields))
+
+    def _diff(self, edit):
+        return "Field #{} ({} {}): status {} -> {}, votes {} -> {}".format(
+            edit.id, edit.target_id, edit.field_name,
+            edit.old_status, edit.status, edit.old_votes, edit.votes,
+        )
+
     def _err(self, msg):
         self.stdout.write(self.style.ERROR(msg))
 
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:18
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+re_word = re.compile(r'\w+', re.U)
+
+
+def search_terms(text):
+    """
+    Копия core.models.search_terms на момент миграции
+    """
+    terms = set()
+    for word in re_word.findall(text.lower()):
+        for i in range(len(word) - 1):
+            terms.add(word[i:])
+    return terms
+
+
+def fill_search_terms(apps, schema_editor):
+    Student = apps.get_model('core', 'Student')
+    FieldValue = apps.get_model('core', 'FieldValue')
+    SearchTerm = apps.get_model('core', 'SearchTerm')
+
+    batch = []
+
+    def add(term, **kwargs):
+        batch.append(SearchTerm(term=term, **kwargs))
+        if len(batch) >= 1000:
+            SearchTerm.objects.bulk_create(batch)
+            del batch[:]
+
+    for student in Student.objects.all().iterator():
+        for term in search_terms(student.name):
+            add(term, student_id=student.id)
+    facts = FieldValue.objects.exclude(status='deleted').exclude(field_name='email')
+    for fact in facts.iterator():
+        for term in search_terms(fact.field_value):
+            add(term, student_id=fact.target_id, field_value_id=fact.id)
+    SearchTerm.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_auto_20180305_2031'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=200)),
+            ],
+            options={
+                'verbose_name': '\u043f\u043e\u0438\u0441\u043a\u043e\u0432\u044b\u0439 \u0442\u0435\u0440\u043c\u0438\u043d',
+                'verbose_name_plural': '\u043f\u043e\u0438\u0441\u043a\u043e\u0432\u044b\u0435 \u0442\u0435\u0440\u043c\u0438\u043d\u044b',
+            },
+        ),
+        migrations.AlterField(
+            model_name='fieldvalue',
+            name='field_name',
+            field=models.CharField(choices=[('name', '\u0418\u0437\u043c\u0435\u043d\u0435\u043d\u0438\u044f \u0444\u0430\u043c\u0438\u043b\u0438\u0438 / \u0438\u043c\u0435\u043d\u0438'), ('email', 'Email'), ('city', '\u0413\u043e\u0440\u043e\u0434'), ('profession', '\u041f\u0440\u043e\u0444\u0435\u0441\u0441\u0438\u044f / \u0434\u043e\u043b\u0436\u043d\u043e\u0441\u0442\u044c'), ('degree', '\u0423\u0447\u0451\u043d\u0430\u044f \u0441\u0442\u0435\u043f\u0435\u043d\u044c'), ('company', '\u041a\u043e\u043c\u043f\u0430\u043d\u0438\u044f / \u0412\u0423\u0417'), ('link', '\u0414\u043e\u043c\u0430\u0448\u043d\u044f\u044f \u0441\u0442\u0440\u0430\u043d\u0438\u0446\u0430'), ('social_fb', 'Facebook'), ('social_vk', '\u0412\u041a\u043e\u043d\u0442\u0430\u043a\u0442\u0435'), ('social_li', 'LinkedIn'), ('wiki', 'Wikipedia'), ('grade', '\u0423\u0447\u0438\u043b\u0441\u044f \u0442\u0430\u043a\u0436\u0435 \u0432 \u043a\u043b\u0430\u0441\u0441\u0435'), ('death_year', '\u0413\u043e\u0434 \u0441\u043c\u0435\u0440\u0442\u0438')], max_length=20, verbose_name='\u0418\u043c\u044f \u043f\u043e\u043b\u044f'),
+        ),
+        migrations.AddField(
+            model_name='searchterm',
+            name='field_value',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='core.FieldValue'),
+        ),
+        migrations.AddField(
+            model_name='searchterm',
+            name='student',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='core.Student'),
+        ),
+        migrations.RunPython(fill_search_terms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:20
+from __future__ import unicode_literals
+
+import json
+import urlparse
+from collections import OrderedDict
+from itertools import groupby
+
+from django.db import migrations, models
+
+# Копии core.models.student_card и order_facts на момент миграции
+FIELDS = ('name', 'email', 'city', 'profession', 'degree', 'company', 'link',
+          'social_fb', 'social_vk', 'social_li', 'wiki', 'grade', 'death_year')
+BADGE_FIELDS = ('email', 'profession', 'degree', 'city', 'company',
+                'link', 'social_fb', 'social_vk', 'social_li', 'wiki')
+STATUSES = ('trusted', 'untrusted', 'hidden', 'deleted')
+VISIBLE_STATUSES = ('trusted', 'untrusted')
+
+
+def order_facts(modifications):
+    result = OrderedDict((name, []) for name in FIELDS)
+    key = lambda x: (STATUSES.index(x.status), -x.votes)
+    for m in sorted(modifications, key=key):
+        result[m.field_name].append(m)
+    return result
+
+
+def student_card(modifications):
+    card = {'names': [], 'death_year': [], 'badges': []}
+    for name, facts in order_facts(modifications).items():
+        for m in facts:
+            if m.status not in VISIBLE_STATUSES:
+                continue
+            if name == 'name':
+                card['names'].append({'value': m.field_value, 'status': m.status})
+            elif name == 'death_year':
+                if m.status == 'trusted':
+                    card['death_year'].append(m.field_value)
+            elif name in BADGE_FIELDS:
+                badge = {'field': name, 'status': m.status}
+                if name != 'email':
+                    badge['value'] = m.field_value
+                if name == 'link':
+                    badge['host'] = str(urlparse.urlparse(m.field_value).hostname)
+                card['badges'].append(badge)
+    return json.dumps(card, ensure_ascii=False, separators=(',', ':'))
+
+
+def fill_cards(apps, schema_editor):
+    Student = apps.get_model('core', 'Student')
+    FieldValue = apps.get_model('core', 'FieldValue')
+
+    facts = FieldValue.objects.order_by('target_id').iterator()
+    for target_id, modifications in groupby(facts, key=lambda x: x.target_id):
+        Student.objects.filter(pk=target_id).update(
+            card=student_card(list(modifications)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_fieldvalue_status_update_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='card',
+            field=models.TextField(blank=True, default='', verbose_name='\u041a\u0430\u0440\u0442\u043e\u0447\u043a\u0430 \u0434\u043b\u044f \u0441\u043f\u0438\u0441\u043a\u043e\u0432'),
+        ),
+        migrations.RunPython(fill_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:25
+from __future__ import unicode_literals
+
+from itertools import groupby
+
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+# Копии core.rules.apply_vote и score_edit на момент миграции
+SCORE_DIGITS = 6
+VOID_STATUSES = ('nonexistent', 'revoked')
+
+
+def apply_vote(edit, vote):
+    change = vote.value in ('added', 'upvoted') and 1 or -1
+    is_own_edit = False
+    trust_level = 0.1
+    if vote.author_code and vote.author_code.status in VOID_STATUSES:
+        trust_level = 0
+    elif vote.author_code:
+        is_own_edit = vote.author_code.owner_id == edit.target_id
+        trust_level = vote.author_code.trust_level
+        if change == -1:
+            edit.negative_count += 1
+    factor = is_own_edit and 10 or 1
+
+    edit.votes = round(edit.votes + change * trust_level * factor, SCORE_DIGITS)
+    edit.vote_count += 1
+    if edit.vote_count == 1:
+        edit.first_vote_author_id = vote.author_code_id
+    if vote.value == 'to_delete':
+        edit.delete_vote_count += 1
+        if is_own_edit:
+            edit.owner_delete_count += 1
+        edit.delete_vote_author_id = vote.author_code_id
+
+
+def score_edit(edit, votes):
+    edit.votes = 0
+    edit.vote_count = 0
+    edit.negative_count = 0
+    edit.delete_vote_count = 0
+    edit.owner_delete_count = 0
+    edit.first_vote_author_id = None
+    edit.delete_vote_author_id = None
+    for vote in votes:
+        apply_vote(edit, vote)
+
+
+def fill_aggregates(apps, schema_editor):
+    FieldValue = apps.get_model('core', 'FieldValue')
+    Vote = apps.get_model('core', 'Vote')
+
+    step = 2000
+    last_id = FieldValue.objects.aggregate(Max('id'))['id__max'] or 0
+    for first_id in range(0, last_id + 1, step):
+        votes = Vote.objects.filter(
+            field_value_id__gte=first_id, field_value_id__lt=first_id + step,
+        ).select_related('field_value', 'author_code').order_by('field_value_id', 'id')
+        for edit, edit_votes in groupby(list(votes), key=lambda x: x.field_value):
+            score_edit(edit, list(edit_votes))
+            FieldValue.objects.filter(pk=edit.pk).update(
+                votes=edit.votes,
+                vote_count=edit.vote_count,
+                negative_count=edit.negative_count,
+                delete_vote_count=edit.delete_vote_count,
+                owner_delete_count=edit.owner_delete_count,
+                first_vote_author_id=edit.first_vote_author_id,
+                delete_vote_author_id=edit.delete_vote_author_id,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_student_card'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fieldvalue',
+            name='delete_vote_author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.AuthCode', verbose_name='\u0410\u0432\u0442\u043e\u0440 \u043f\u043e\u0441\u043b\u0435\u0434\u043d\u0435\u0433\u043e \u0433\u043e\u043b\u043e\u0441\u0430 \u0437\u0430 \u0443\u0434\u0430\u043b\u0435\u043d\u0438\u0435'),
+        ),
+        migrations.AddField(
+            model_name='fieldvalue',
+            name='delete_vote_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='\u0427\u0438\u0441\u043b\u043e \u0433\u043e\u043b\u043e\u0441\u043e\u0432 \u0437\u0430 \u0443\u0434\u0430\u043b\u0435\u043d\u0438\u0435'),
+        ),
+        migrations.AddField(
+            model_name='fieldvalue',
+            name='first_vote_author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.AuthCode', verbose_name='\u0410\u0432\u0442\u043e\u0440 \u043f\u0435\u0440\u0432\u043e\u0433\u043e \u0433\u043e\u043b\u043e\u0441\u0430'),
+        ),
+        migrations.AddField(
+            model_name='fieldvalue',
+            name='negative_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='\u0427\u0438\u0441\u043b\u043e \u0433\u043e\u043b\u043e\u0441\u043e\u0432 \u043f\u0440\u043e\u0442\u0438\u0432 \u043e\u0442 \u0430\u0432\u0442\u043e\u0440\u0438\u0437\u043e\u0432\u0430\u043d\u043d\u044b\u0445'),
+        ),
+        migrations.AddField(
+            model_name='fieldvalue',
+            name='owner_delete_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='\u0427\u0438\u0441\u043b\u043e \u0433\u043e\u043b\u043e\u0441\u043e\u0432 \u0437\u0430 \u0443\u0434\u0430\u043b\u0435\u043d\u0438\u0435 \u043e\u0442 \u0441\u0430\u043c\u043e\u0433\u043e \u0432\u044b\u043f\u0443\u0441\u043a\u043d\u0438\u043a\u0430'),
+        ),
+        migrations.AddField(
+            model_name='fieldvalue',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='\u0427\u0438\u0441\u043b\u043e \u0433\u043e\u043b\u043e\u0441\u043e\u0432'),
+        ),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
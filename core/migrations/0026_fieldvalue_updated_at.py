@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_updated_at(apps, schema_editor):
+    FieldValue = apps.get_model('core', 'FieldValue')
+    FieldValue.objects.update(updated_at=F('status_update_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_vote_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fieldvalue',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='\u0414\u0430\u0442\u0430 \u0438\u0437\u043c\u0435\u043d\u0435\u043d\u0438\u044f'),
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:38
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_fieldvalue_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='fieldvalue',
+            index_together=set([('status_update_date', 'id')]),
+        ),
+    ]
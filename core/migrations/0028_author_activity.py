@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_activity(apps, schema_editor):
+    Vote = apps.get_model('core', 'Vote')
+    AuthorActivity = apps.get_model('core', 'AuthorActivity')
+    rows = Vote.objects.filter(
+        author_code__owner__isnull=False,
+    ).values_list(
+        'author_code__owner_id', 'field_value_id', 'field_value__status_update_date',
+    ).order_by().distinct()
+    AuthorActivity.objects.bulk_create((
+        AuthorActivity(author_id=author_id, field_value_id=field_value_id,
+                       status_update_date=status_update_date)
+        for author_id, field_value_id, status_update_date in rows
+    ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_fieldvalue_feed_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status_update_date', models.DateTimeField(verbose_name='\u0414\u0430\u0442\u0430 \u043e\u0431\u043d\u043e\u0432\u043b\u0435\u043d\u0438\u044f \u0441\u0442\u0430\u0442\u0443\u0441\u0430 \u043f\u0440\u0430\u0432\u043a\u0438')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Student')),
+                ('field_value', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='core.FieldValue')),
+            ],
+            options={
+                'verbose_name': '\u0430\u043a\u0442\u0438\u0432\u043d\u043e\u0441\u0442\u044c \u0430\u0432\u0442\u043e\u0440\u0430',
+                'verbose_name_plural': '\u0430\u043a\u0442\u0438\u0432\u043d\u043e\u0441\u0442\u044c \u0430\u0432\u0442\u043e\u0440\u043e\u0432',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='vote',
+            index_together=set([('author_code', 'field_value')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='authoractivity',
+            unique_together=set([('author', 'field_value')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='authoractivity',
+            index_together=set([('author', 'status_update_date', 'field_value')]),
+        ),
+        migrations.RunPython(fill_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:45
+from __future__ import unicode_literals
+
+import json
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_feed(apps, schema_editor):
+    FieldValue = apps.get_model('core', 'FieldValue')
+    Vote = apps.get_model('core', 'Vote')
+    FeedEntry = apps.get_model('core', 'FeedEntry')
+    ids = list(FieldValue.objects.exclude(field_name='email').order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(ids), 500):
+        batch = ids[i:i + 500]
+        voters = defaultdict(lambda: {'upvoted': [], 'downvoted': []})
+        for field_value_id, value, owner_id in Vote.objects.filter(
+                field_value_id__in=batch, value__in=('upvoted', 'downvoted'),
+        ).order_by('-timestamp').values_list('field_value_id', 'value', 'author_code__owner_id'):
+            voters[field_value_id][value].append(owner_id)
+        FeedEntry.objects.bulk_create(
+            FeedEntry(
+                field_value_id=f.pk,
+                target_id=f.target_id,
+                target_name=f.target.name,
+                graduation_year=f.target.main_grade.graduation_year,
+                grade_letter=f.target.main_grade.letter,
+                author_id=f.author_code_id and f.author_code.owner_id,
+                field_name=f.field_name,
+                value=f.field_value,
+                status=f.status,
+                status_update_date=f.status_update_date,
+                vote_count=f.vote_count,
+                voters=json.dumps(voters[f.pk], separators=(',', ':')),
+            )
+            for f in FieldValue.objects.filter(pk__in=batch).select_related('target__main_grade', 'author_code')
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_author_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('field_value', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feed_entry', serialize=False, to='core.FieldValue')),
+                ('target_name', models.CharField(max_length=200)),
+                ('graduation_year', models.PositiveSmallIntegerField(verbose_name='\u0413\u043e\u0434 \u0432\u044b\u043f\u0443\u0441\u043a\u0430')),
+                ('grade_letter', models.CharField(max_length=1, verbose_name='\u0411\u0443\u043a\u0432\u0430 \u043a\u043b\u0430\u0441\u0441\u0430')),
+                ('field_name', models.CharField(choices=[('name', '\u0418\u0437\u043c\u0435\u043d\u0435\u043d\u0438\u044f \u0444\u0430\u043c\u0438\u043b\u0438\u0438 / \u0438\u043c\u0435\u043d\u0438'), ('email', 'Email'), ('city', '\u0413\u043e\u0440\u043e\u0434'), ('profession', '\u041f\u0440\u043e\u0444\u0435\u0441\u0441\u0438\u044f / \u0434\u043e\u043b\u0436\u043d\u043e\u0441\u0442\u044c'), ('degree', '\u0423\u0447\u0451\u043d\u0430\u044f \u0441\u0442\u0435\u043f\u0435\u043d\u044c'), ('company', '\u041a\u043e\u043c\u043f\u0430\u043d\u0438\u044f / \u0412\u0423\u0417'), ('link', '\u0414\u043e\u043c\u0430\u0448\u043d\u044f\u044f \u0441\u0442\u0440\u0430\u043d\u0438\u0446\u0430'), ('social_fb', 'Facebook'), ('social_vk', '\u0412\u041a\u043e\u043d\u0442\u0430\u043a\u0442\u0435'), ('social_li', 'LinkedIn'), ('wiki', 'Wikipedia'), ('grade', '\u0423\u0447\u0438\u043b\u0441\u044f \u0442\u0430\u043a\u0436\u0435 \u0432 \u043a\u043b\u0430\u0441\u0441\u0435'), ('death_year', '\u0413\u043e\u0434 \u0441\u043c\u0435\u0440\u0442\u0438')], max_length=20, verbose_name='\u0418\u043c\u044f \u043f\u043e\u043b\u044f')),
+                ('value', models.CharField(max_length=200, verbose_name='\u0417\u043d\u0430\u0447\u0435\u043d\u0438\u0435 \u043f\u043e\u043b\u044f')),
+                ('status', models.CharField(choices=[('trusted', '\u0423\u0432\u0435\u0440\u0435\u043d\u043d\u0430\u044f'), ('untrusted', '\u041d\u0435\u0443\u0432\u0435\u0440\u0435\u043d\u043d\u0430\u044f'), ('hidden', '\u0421\u043a\u0440\u044b\u0442\u0430\u044f'), ('deleted', '\u0423\u0434\u0430\u043b\u0435\u043d\u043d\u0430\u044f')], max_length=20, verbose_name='\u0421\u0442\u0430\u0442\u0443\u0441 \u043f\u0440\u0430\u0432\u043a\u0438')),
+                ('status_update_date', models.DateTimeField(verbose_name='\u0414\u0430\u0442\u0430 \u043e\u0431\u043d\u043e\u0432\u043b\u0435\u043d\u0438\u044f \u0441\u0442\u0430\u0442\u0443\u0441\u0430')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='\u0414\u0430\u0442\u0430 \u0438\u0437\u043c\u0435\u043d\u0435\u043d\u0438\u044f')),
+                ('vote_count', models.PositiveIntegerField(default=0, verbose_name='\u0427\u0438\u0441\u043b\u043e \u0433\u043e\u043b\u043e\u0441\u043e\u0432')),
+                ('voters', models.TextField(default='{}', verbose_name='\u0413\u043e\u043b\u043e\u0441\u043e\u0432\u0430\u0432\u0448\u0438\u0435 \u0437\u0430 \u0438 \u043f\u0440\u043e\u0442\u0438\u0432')),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Student')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Student')),
+            ],
+            options={
+                'verbose_name': '\u0437\u0430\u043f\u0438\u0441\u044c \u043b\u0435\u043d\u0442\u044b',
+                'verbose_name_plural': '\u0437\u0430\u043f\u0438\u0441\u0438 \u043b\u0435\u043d\u0442\u044b',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='feedentry',
+            index_together=set([('graduation_year', 'grade_letter', 'status_update_date', 'field_value'), ('graduation_year', 'status_update_date', 'field_value'), ('target', 'status_update_date', 'field_value'), ('status_update_date', 'field_value')]),
+        ),
+        migrations.RunPython(fill_feed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 12:13
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Одинаковые коды сливаются в последний обновленный: ссылки на
+    остальные переносятся на него
+    """
+    AuthCode = apps.get_model('core', 'AuthCode')
+    references = [
+        (apps.get_model('core', 'Student'), 'creator_code'),
+        (apps.get_model('core', 'FieldValue'), 'author_code'),
+        (apps.get_model('core', 'FieldValue'), 'first_vote_author'),
+        (apps.get_model('core', 'FieldValue'), 'delete_vote_author'),
+        (apps.get_model('core', 'Vote'), 'author_code'),
+    ]
+    duplicated = AuthCode.objects.values('code').annotate(n=Count('id')).filter(n__gt=1)
+    for code in duplicated.values_list('code', flat=True):
+        ids = list(AuthCode.objects.filter(code=code).order_by('-updated_at', '-id').values_list('id', flat=True))
+        keep, others = ids[0], ids[1:]
+        for model, field in references:
+            model.objects.filter(**{field + '_id__in': others}).update(**{field + '_id': keep})
+        AuthCode.objects.filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_feed_entry'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='authcode',
+            name='code',
+            field=models.CharField(max_length=100, unique=True, validators=[django.core.validators.RegexValidator('^[^\\s]+$')]),
+        ),
+    ]
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 12:16
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+from django.utils import timezone
+
+UP_DOWN = ('upvoted', 'downvoted')
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+# Копии core.rules.apply_vote, aggregate_status и score_edit на момент миграции
+SCORE_DIGITS = 6
+VOID_STATUSES = ('nonexistent', 'revoked')
+AGGREGATE_FIELDS = ('votes', 'vote_count', 'negative_count', 'delete_vote_count', 'owner_delete_count',
+                    'first_vote_author_id', 'delete_vote_author_id')
+
+
+def apply_vote(edit, vote):
+    change = vote.value in ('added', 'upvoted') and 1 or -1
+    is_own_edit = False
+    trust_level = 0.1
+    if vote.author_code and vote.author_code.status in VOID_STATUSES:
+        trust_level = 0
+    elif vote.author_code:
+        is_own_edit = vote.author_code.owner_id == edit.target_id
+        trust_level = vote.author_code.trust_level
+        if change == -1:
+            edit.negative_count += 1
+    factor = is_own_edit and 10 or 1
+
+    edit.votes = round(edit.votes + change * trust_level * factor, SCORE_DIGITS)
+    edit.vote_count += 1
+    if edit.vote_count == 1:
+        edit.first_vote_author_id = vote.author_code_id
+    if vote.value == 'to_delete':
+        edit.delete_vote_count += 1
+        if is_own_edit:
+            edit.owner_delete_count += 1
+        edit.delete_vote_author_id = vote.author_code_id
+
+
+def aggregate_status(edit):
+    if edit.owner_delete_count:
+        return 'deleted'
+    if edit.delete_vote_count \
+            and edit.vote_count == 1 + edit.negative_count \
+            and edit.first_vote_author_id == edit.delete_vote_author_id:
+        return 'deleted'
+    if not edit.delete_vote_count \
+            and edit.vote_count == 1 + edit.negative_count \
+            and edit.negative_count > 1:
+        return 'deleted'
+    if edit.votes > 0:
+        if edit.votes > 0.9:
+            return 'trusted'
+        return 'untrusted'
+    return 'hidden'
+
+
+def score_edit(edit, votes):
+    edit.votes = 0
+    edit.vote_count = 0
+    edit.negative_count = 0
+    edit.delete_vote_count = 0
+    edit.owner_delete_count = 0
+    edit.first_vote_author_id = None
+    edit.delete_vote_author_id = None
+    for vote in votes:
+        apply_vote(edit, vote)
+    return aggregate_status(edit)
+
+
+def duplicates(queryset, fields):
+    """
+    Значения fields, встречающиеся больше одного раза
+    """
+    return queryset.order_by().values(*fields).annotate(n=Count('id')).filter(n__gt=1).values(*fields)
+
+
+def merge_facts(apps, schema_editor):
+    """
+    Одинаковые правки сливаются в первую: голоса, активность авторов
+    переносятся на нее, после чего ее агрегаты и статус пересчитываются
+    """
+    FieldValue = apps.get_model('core', 'FieldValue')
+    Vote = apps.get_model('core', 'Vote')
+    AuthorActivity = apps.get_model('core', 'AuthorActivity')
+    SearchTerm = apps.get_model('core', 'SearchTerm')
+    FeedEntry = apps.get_model('core', 'FeedEntry')
+    merged = []
+    for fields in duplicates(FieldValue.objects.all(), ['target', 'field_name', 'field_value']):
+        ids = list(FieldValue.objects.filter(**fields).order_by('id').values_list('id', flat=True))
+        keep, others = ids[0], ids[1:]
+        Vote.objects.filter(field_value_id__in=others).update(field_value_id=keep)
+        authors = set(AuthorActivity.objects.filter(field_value_id=keep).values_list('author_id', flat=True))
+        for activity in AuthorActivity.objects.filter(field_value_id__in=others):
+            if activity.author_id in authors:
+                activity.delete()
+            else:
+                authors.add(activity.author_id)
+                activity.field_value_id = keep
+                activity.save()
+        SearchTerm.objects.filter(field_value_id__in=others).delete()
+        FeedEntry.objects.filter(field_value_id__in=others).delete()
+        FieldValue.objects.filter(id__in=others).delete()
+        merged.append(keep)
+    rescore(apps, merged)
+
+
+def rescore(apps, ids):
+    """
+    Заново считает агрегаты и статус правок по их голосам
+    """
+    FieldValue = apps.get_model('core', 'FieldValue')
+    Vote = apps.get_model('core', 'Vote')
+    now = timezone.now()
+    for edit in FieldValue.objects.filter(id__in=ids):
+        votes = Vote.objects.filter(field_value_id=edit.id).select_related('author_code').order_by('id')
+        status = score_edit(edit, votes)
+        values = dict((name, getattr(edit, name)) for name in AGGREGATE_FIELDS)
+        if status != edit.status:
+            values.update(status=status, status_update_date=now)
+        FieldValue.objects.filter(id=edit.id).update(updated_at=now, **values)
+
+
+def merge_votes(apps, schema_editor):
+    """
+    Из одинаковых голосов кода остается первый, из голосов за и против
+    одной правки — последний. Правки, у которых убраны голоса,
+    пересчитываются
+    """
+    Vote = apps.get_model('core', 'Vote')
+    votes = Vote.objects.filter(author_code__isnull=False)
+    edits = set()
+    for fields in duplicates(votes, ['field_value', 'author_code', 'value']):
+        ids = list(Vote.objects.filter(**fields).order_by('id').values_list('id', flat=True))
+        Vote.objects.filter(id__in=ids[1:]).delete()
+        edits.add(fields['field_value'])
+    for fields in duplicates(votes.filter(value__in=UP_DOWN), ['field_value', 'author_code']):
+        ids = list(Vote.objects.filter(value__in=UP_DOWN, **fields).order_by('-id').values_list('id', flat=True))
+        Vote.objects.filter(id__in=ids[1:]).delete()
+        edits.add(fields['field_value'])
+    rescore(apps, edits)
+
+
+def add_up_down_index(apps, schema_editor):
+    """
+    Частичный индекс есть не везде (в MySQL нет): там голос за и против
+    одного кода разводит handle_vote под блокировкой правки
+    """
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute(
+            "CREATE UNIQUE INDEX vote_up_down_unique ON core_vote (field_value_id, author_code_id) "
+            "WHERE value IN ('upvoted', 'downvoted')")
+
+
+def remove_up_down_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute("DROP INDEX vote_up_down_unique")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_authcode_unique_code'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_facts, migrations.RunPython.noop),
+        migrations.RunPython(merge_votes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='fieldvalue',
+            unique_together=set([('target', 'field_name', 'field_value')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set([('field_value', 'author_code', 'value')]),
+        ),
+        migrations.RunPython(add_up_down_index, remove_up_down_index),
+    ]
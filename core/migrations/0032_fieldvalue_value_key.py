@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 12:21
+from __future__ import unicode_literals
+
+import unicodedata
+import urllib
+import urlparse
+
+from django.db import migrations, models
+from django.db.models import Case, Value, When
+from django.utils.encoding import force_text
+
+URL_FIELDS = ('link', 'social_fb', 'social_vk', 'social_li', 'wiki')
+
+# Копии core.canonical.value_key и core.utils.bulk_update на момент миграции
+MAX_LENGTH = 255
+DEFAULT_PORTS = (80, 443)
+
+
+def fold_text(text):
+    text = unicodedata.normalize('NFKC', force_text(text)).lower().replace('ё', 'е')
+    return ' '.join(text.split())
+
+
+def canonical_url(url):
+    url = force_text(url).strip()
+    if '://' not in url:
+        url = 'http://' + url
+    try:
+        parts = urlparse.urlsplit(url)
+    except ValueError:
+        return fold_text(url)
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[len('www.'):]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port not in DEFAULT_PORTS:
+        host += ':%d' % port
+    path = urllib.unquote(parts.path.encode('utf-8')).decode('utf-8', 'replace')
+    key = host + unicodedata.normalize('NFKC', path).rstrip('/')
+    if parts.query:
+        key += '?' + parts.query
+    return key
+
+
+def value_key(value, is_url=False):
+    if is_url:
+        return canonical_url(value)[:MAX_LENGTH]
+    return fold_text(value)[:MAX_LENGTH]
+
+
+def bulk_update(objs, fields):
+    model = type(objs[0])
+    values = {}
+    for name in fields:
+        field = model._meta.get_field(name)
+        values[name] = Case(*[
+            When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field))
+            for obj in objs
+        ], output_field=field)
+    model.objects.filter(pk__in=[obj.pk for obj in objs]).update(**values)
+
+
+def fill_value_key(apps, schema_editor):
+    """
+    Ключи существующих правок, пачками по 500
+    """
+    FieldValue = apps.get_model('core', 'FieldValue')
+    ids = list(FieldValue.objects.order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(ids), 500):
+        facts = list(FieldValue.objects.filter(pk__in=ids[i:i + 500]).only('field_name', 'field_value'))
+        for f in facts:
+            f.value_key = value_key(f.field_value, f.field_name in URL_FIELDS)
+        bulk_update(facts, ['value_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_unique_facts_and_votes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fieldvalue',
+            name='value_key',
+            field=models.CharField(default='', editable=False, max_length=255, verbose_name='\u041a\u043b\u044e\u0447 \u0437\u043d\u0430\u0447\u0435\u043d\u0438\u044f'),
+        ),
+        migrations.AlterIndexTogether(
+            name='fieldvalue',
+            index_together=set([('target', 'field_name', 'value_key'), ('status_update_date', 'id')]),
+        ),
+        migrations.RunPython(fill_value_key, migrations.RunPython.noop),
+    ]
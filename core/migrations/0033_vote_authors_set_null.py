@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 12:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_fieldvalue_value_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fieldvalue',
+            name='delete_vote_author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.AuthCode', verbose_name='\u0410\u0432\u0442\u043e\u0440 \u043f\u043e\u0441\u043b\u0435\u0434\u043d\u0435\u0433\u043e \u0433\u043e\u043b\u043e\u0441\u0430 \u0437\u0430 \u0443\u0434\u0430\u043b\u0435\u043d\u0438\u0435'),
+        ),
+        migrations.AlterField(
+            model_name='fieldvalue',
+            name='first_vote_author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.AuthCode', verbose_name='\u0410\u0432\u0442\u043e\u0440 \u043f\u0435\u0440\u0432\u043e\u0433\u043e \u0433\u043e\u043b\u043e\u0441\u0430'),
+        ),
+    ]
@@ -1,14 +1,24 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
-from collections import OrderedDict
-
+import json
+import operator
+import re
+import threading
+import time
+import urlparse
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Q
 from django.urls import reverse
-from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
 from django.utils.functional import cached_property
 
+from core import canonical
+
 
 class Timestamped(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
@@ -25,6 +35,7 @@ class Grade(models.Model):
     profile = models.CharField('Тип класса', max_length=50, blank=True, null=True)
     letter = models.CharField('Буква выпускного класса', max_length=1)
     graduation_year = models.PositiveSmallIntegerField('Год выпуска')
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
 
     class Meta:
         verbose_name = 'класс'
@@ -44,6 +55,9 @@ class Student(Timestamped):
     main_grade = models.ForeignKey(Grade)
     creator_code = models.ForeignKey('AuthCode', blank=True, null=True)
     import_date = models.DateTimeField(null=True, blank=True)
+    card = models.TextField('Карточка для списков', blank=True, default='')
+    # Переименование и перевод в другой класс, по нему отвечают 304
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
 
     class Meta:
         verbose_name = 'выпускник'
@@ -52,32 +66,129 @@ class Student(Timestamped):
     def __unicode__(self):
         return '%s %s' % (self.name, self.main_grade)
 
+    def save(self, *args, **kwargs):
+        super(Student, self).save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'name' in update_fields:
+            SearchTerm.objects.update_student(self)
+
     def get_absolute_url(self):
         return reverse('student-detail', args=[str(self.id)])
 
     @cached_property
     def ordered_facts(self):
-        result = OrderedDict()
-        for name, text, _ in FieldValue.EDITABLE_FIELDS:
-            result[name] = []
-        order = [i[0] for i in FieldValue.STATUS_CHOICES]
-        key = lambda x: (order.index(x.status), -x.votes)
-        ms = sorted(self.modifications.all(), key=key)
-        for m in ms:
-            result[m.field_name].append(m)
-        return result
+        return order_facts(self.modifications.all())
+
+    @cached_property
+    def card_data(self):
+        if not self.card:
+            return {'names': [], 'death_year': [], 'badges': []}
+        return json.loads(self.card)
+
+    def update_card(self):
+        self.card = student_card(self.modifications.all())
+        self.save(update_fields=['card'])
+
+
+def order_facts(modifications):
+    """
+    Факты по типам в порядке EDITABLE_FIELDS, внутри типа — по статусу
+    и убыванию голосов
+    """
+    result = OrderedDict()
+    for name, text, _ in FieldValue.EDITABLE_FIELDS:
+        result[name] = []
+    order = [i[0] for i in FieldValue.STATUS_CHOICES]
+    key = lambda x: (order.index(x.status), -x.votes)
+    for m in sorted(modifications, key=key):
+        result[m.field_name].append(m)
+    return result
+
+
+def student_card(modifications):
+    """
+    Карточка выпускника для списков в JSON: видимые изменения имени,
+    год смерти и значки фактов в порядке показа
+    """
+    card = {'names': [], 'death_year': [], 'badges': []}
+    visible = (FieldValue.STATUS_TRUSTED, FieldValue.STATUS_UNTRUSTED)
+    for name, facts in order_facts(modifications).items():
+        for m in facts:
+            if m.status not in visible:
+                continue
+            if name == FieldValue.FIELD_NAME:
+                card['names'].append({'value': m.field_value, 'status': m.status})
+            elif name == FieldValue.FIELD_DEATH_YEAR:
+                if m.status == FieldValue.STATUS_TRUSTED:
+                    card['death_year'].append(m.field_value)
+            elif name in FieldValue.BADGE_FIELDS:
+                badge = {'field': name, 'status': m.status}
+                # Сам email в списках не показывается
+                if name != FieldValue.FIELD_EMAIL:
+                    badge['value'] = m.field_value
+                if name == FieldValue.FIELD_LINK:
+                    badge['host'] = str(urlparse.urlparse(m.field_value).hostname)
+                card['badges'].append(badge)
+    return json.dumps(card, ensure_ascii=False, separators=(',', ':'))
+
+
+class AuthCodeCache(object):
+    """
+    LRU кэш процесса: код → значения на ttl секунд, не больше size кодов
+    (имена настроек). Для AuthCode значения — CACHED_FIELDS, запись кода
+    через ORM сбрасывает его (core.signals); изменения из других
+    процессов видны через TTL
+    """
+
+    def __init__(self, size='AUTH_CODE_CACHE_SIZE', ttl='AUTH_CODE_CACHE_TTL'):
+        self.size_setting = size
+        self.ttl_setting = ttl
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.items = OrderedDict()
+
+    def get(self, code):
+        with self.lock:
+            item = self.items.pop(code, None)
+            if item is None or item[0] < time.time():
+                return None
+            self.items[code] = item
+            return item[1]
+
+    def set(self, code, values):
+        with self.lock:
+            self.items.pop(code, None)
+            self.items[code] = (time.time() + getattr(settings, self.ttl_setting), values)
+            while len(self.items) > getattr(settings, self.size_setting):
+                self.items.popitem(last=False)
+
+    def forget(self, *codes):
+        with self.lock:
+            for code in codes:
+                self.items.pop(code, None)
 
 
 class AuthCodeManager(models.Manager):
+    # Поля, нужные при записи правок и голосов, в порядке полей модели
+    CACHED_FIELDS = ('id', 'code', 'status', 'owner_id', 'trust_level')
+
+    cache = AuthCodeCache()
+
     def get_by_code(self, code):
-        try:
-            author_code = self.get(code=code)
-        except ObjectDoesNotExist:
+        """
+        AuthCode по коду из кэша процесса: остальные поля отложены и
+        читаются из базы при обращении. Неизвестный код создается
+        """
+        values = self.cache.get(code)
+        if values is None:
             # TODO: resolve code to real name and status
-            author_code = self.create(
-                code=code, status='active', owner_name='Anonymous'
-            )
-        return author_code
+            author_code, created = self.get_or_create(code=code, defaults={'status': 'active'})
+            values = tuple(getattr(author_code, name) for name in self.CACHED_FIELDS)
+            self.cache.set(code, values)
+        return self.model.from_db(self.db, self.CACHED_FIELDS, values)
 
 
 class AuthCode(models.Model):
@@ -89,10 +200,12 @@ class AuthCode(models.Model):
         (STATUS_NONEXISTENT, 'несуществующий'),
         (STATUS_REVOKED, 'отозван'),
     )
+    # Голоса таких кодов не влияют на статус правок
+    VOID_STATUSES = (STATUS_NONEXISTENT, STATUS_REVOKED)
 
     code = models.CharField(
         validators=[RegexValidator(r'^[^\s]+$')],
-        max_length=100
+        max_length=100, unique=True
     )
     status = models.CharField(max_length=10, choices=STATUS_CHOICES)
     owner = models.ForeignKey(Student, null=True)
@@ -170,6 +283,18 @@ class FieldValue(Timestamped):
         FIELD_WIKI
     )
 
+    # Поля, которые показываются значками в списках выпускников
+    BADGE_FIELDS = (
+        FIELD_EMAIL,
+        FIELD_PROFESSION,
+        FIELD_DEGREE,
+        FIELD_CITY,
+        FIELD_COMPANY,
+    ) + URL_FIELDS
+
+    # Поля, видимые в карточке выпускника (student_card)
+    CARD_FIELDS = (FIELD_NAME, FIELD_DEATH_YEAR) + BADGE_FIELDS
+
     STATUS_TRUSTED = 'trusted'
     STATUS_UNTRUSTED = 'untrusted'
     STATUS_HIDDEN = 'hidden'
@@ -191,26 +316,94 @@ class FieldValue(Timestamped):
         'Имя поля', max_length=20,
         choices=[(k, v) for k, v, h in EDITABLE_FIELDS])
     field_value = models.CharField('Значение поля', max_length=200)
+    # Одинаковые по смыслу значения имеют один ключ, см. core.canonical
+    value_key = models.CharField('Ключ значения', max_length=canonical.MAX_LENGTH,
+                                 default='', editable=False)
     status = models.CharField('Статус правки', choices=STATUS_CHOICES,
                               default=STATUS_TRUSTED, max_length=20)
     status_update_date = models.DateTimeField(
-        'Дата обновления статуса', auto_now_add=True)
+        'Дата обновления статуса', auto_now_add=True, db_index=True)
+    # Меняется вместе с любым агрегатом голосов, по нему отвечают 304
+    updated_at = models.DateTimeField(
+        'Дата изменения', auto_now=True, db_index=True)
     votes = models.FloatField(default=0)
 
+    # Агрегаты голосов, из которых без перечитывания голосов получается статус
+    vote_count = models.PositiveIntegerField('Число голосов', default=0)
+    negative_count = models.PositiveIntegerField(
+        'Число голосов против от авторизованных', default=0)
+    delete_vote_count = models.PositiveIntegerField(
+        'Число голосов за удаление', default=0)
+    owner_delete_count = models.PositiveIntegerField(
+        'Число голосов за удаление от самого выпускника', default=0)
+    # Удаление кода не удаляет правки, за которые он голосовал: ссылка
+    # обнуляется, агрегаты пересчитывает core.signals.rescore_deleted_code
+    first_vote_author = models.ForeignKey(
+        AuthCode, related_name='+', verbose_name='Автор первого голоса',
+        blank=True, null=True, on_delete=models.SET_NULL)
+    delete_vote_author = models.ForeignKey(
+        AuthCode, related_name='+', verbose_name='Автор последнего голоса за удаление',
+        blank=True, null=True, on_delete=models.SET_NULL)
+
+    AGGREGATE_FIELDS = (
+        'votes',
+        'vote_count',
+        'negative_count',
+        'delete_vote_count',
+        'owner_delete_count',
+        'first_vote_author',
+        'delete_vote_author',
+    )
+
+    # Поля, от которых зависит поисковый индекс правки
+    SEARCH_DEPENDS_ON = {'status', 'field_name', 'field_value', 'target'}
+
     objects = FieldValueManager()
 
     class Meta:
         verbose_name = 'правка'
         verbose_name_plural = 'правки'
+        # Постраничный вывод ленты по ключу (status_update_date, id)
+        index_together = [('status_update_date', 'id'), ('target', 'field_name', 'value_key')]
+        unique_together = [('target', 'field_name', 'field_value')]
 
     def save(self, *args, **kwargs):
-        # Проверяем уникальность ('target', 'field_value', 'field_name')
-        if not self.pk and FieldValue.objects.filter(
-                target=self.target_id,
-                field_value=self.field_value,
-                field_name=self.field_name).exists():
-            return  # Недобавляем повторящиеся значение
-        super(FieldValue, self).save(*args, **kwargs)
+        self.value_key = canonical.value_key(self.field_value, self.field_name in self.URL_FIELDS)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'field_name', 'field_value'} & set(update_fields):
+            kwargs['update_fields'] = list(update_fields) + ['value_key']
+        created = not self.pk
+        if created and not kwargs.get('force_insert'):
+            # Повторяющееся значение не добавляем: уникальность проверяет
+            # база, без отдельного запроса и без гонки. С force_insert
+            # повтор разбирает вызывающий (core.rules.add_fact)
+            try:
+                with transaction.atomic():
+                    super(FieldValue, self).save(*args, **kwargs)
+            except IntegrityError:
+                if not FieldValue.objects.filter(
+                        target=self.target_id,
+                        field_name=self.field_name,
+                        field_value=self.field_value).exists():
+                    raise
+                self.pk = None
+                return
+        else:
+            super(FieldValue, self).save(*args, **kwargs)
+        if created:
+            SearchTerm.objects.add_field_values([self])
+            FeedEntry.objects.add_field_value(self)
+            return
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or self.SEARCH_DEPENDS_ON.intersection(update_fields):
+            SearchTerm.objects.update_field_value(self)
+        if update_fields is None:
+            FeedEntry.objects.update_field_values([self.pk])
+
+    @property
+    def is_searchable(self):
+        return self.status != FieldValue.STATUS_DELETED \
+            and self.field_name != FieldValue.FIELD_EMAIL
 
     @cached_property
     def delete_vote(self):
@@ -224,6 +417,23 @@ class FieldValue(Timestamped):
         return '%s _ %s' % (self.target, self.get_field_name_display())
 
 
+class VoteManager(models.Manager):
+    def user_state(self, code, field_value_ids):
+        """
+        Голоса кода сессии за правки страницы одним запросом по индексу
+        (author_code, field_value): {id правки: {значения голосов}}
+        """
+        state = defaultdict(set)
+        field_value_ids = list(field_value_ids)
+        if not code or not field_value_ids:
+            return state
+        for field_value_id, value in self.filter(
+                author_code__code=code, field_value_id__in=field_value_ids,
+        ).order_by().values_list('field_value_id', 'value'):
+            state[field_value_id].add(value)
+        return state
+
+
 class Vote(Timestamped):
     """
     а также может быть голосованием за правильность или наличие ошибки
@@ -246,22 +456,228 @@ class Vote(Timestamped):
     )
     value = models.CharField('Тип голоса', choices=VOTE_CHOICES, max_length=16)
 
+    objects = VoteManager()
+
     class Meta:
         verbose_name = 'голос'
         verbose_name_plural = 'голоса'
         ordering = ('-timestamp',)
-        # Плохо работает для анонимусов
-        # unique_together = ('field_value', 'author_code', 'value')
+        # Голоса анонимусов (author_code NULL) не ограничены. Кроме того,
+        # одному коду нельзя голосовать за правку и за, и против: это
+        # проверяет handle_vote, а в PostgreSQL и SQLite еще и частичный
+        # уникальный индекс vote_up_down_unique из миграции 0031
+        unique_together = [('field_value', 'author_code', 'value')]
+        index_together = [('author_code', 'field_value')]
 
     def __unicode__(self):
         return self.field_value.field_value
 
 
+class AuthorActivityManager(models.Manager):
+    def add(self, author_id, field_value):
+        """
+        Первый голос автора за правку: строки еще нет, ее вставляет
+        core.rules, знающий все голоса правки
+        """
+        self.create(author_id=author_id, field_value_id=field_value.pk,
+                    status_update_date=field_value.status_update_date)
+
+    def remove(self, author_id, field_value_id):
+        """
+        Последний голос автора за правку отменен
+        """
+        self.filter(author_id=author_id, field_value_id=field_value_id).delete()
+
+    def sync_dates(self, field_value_ids):
+        """
+        Переносит status_update_date правок в строки активности
+        """
+        field_value_ids = list(field_value_ids)
+        if not field_value_ids:
+            return
+        activity, fact = self.model._meta.db_table, FieldValue._meta.db_table
+        with connection.cursor() as cursor:
+            for i in range(0, len(field_value_ids), 500):
+                batch = field_value_ids[i:i + 500]
+                cursor.execute(
+                    'UPDATE {activity} SET status_update_date = ('
+                    'SELECT status_update_date FROM {fact} WHERE {fact}.id = {activity}.field_value_id'
+                    ') WHERE field_value_id IN ({ids})'.format(
+                        activity=activity, fact=fact, ids=', '.join(['%s'] * len(batch))),
+                    batch)
+
+    def rebuild(self, author_ids):
+        """
+        Заново собирает активность авторов по их голосам, например после
+        смены владельца кода
+        """
+        author_ids = [a for a in set(author_ids) if a]
+        if not author_ids:
+            return
+        self.filter(author_id__in=author_ids).delete()
+        self.bulk_create(
+            AuthorActivity(author_id=author_id, field_value_id=field_value_id,
+                           status_update_date=status_update_date)
+            for author_id, field_value_id, status_update_date in Vote.objects.filter(
+                author_code__owner_id__in=author_ids,
+            ).values_list(
+                'author_code__owner_id', 'field_value_id', 'field_value__status_update_date',
+            ).order_by().distinct()
+        )
+
+
+class AuthorActivity(models.Model):
+    """
+    Правки, за которые голосовал выпускник своими кодами, с копией
+    status_update_date правки: лента автора читается по индексу
+    (author, status_update_date, field_value)
+    """
+    author = models.ForeignKey(Student, related_name='+')
+    field_value = models.ForeignKey(FieldValue, related_name='activities')
+    status_update_date = models.DateTimeField('Дата обновления статуса правки')
+
+    objects = AuthorActivityManager()
+
+    class Meta:
+        verbose_name = 'активность автора'
+        verbose_name_plural = 'активность авторов'
+        unique_together = ('author', 'field_value')
+        index_together = [('author', 'status_update_date', 'field_value')]
+
+    def __unicode__(self):
+        return '%s: %s' % (self.author_id, self.field_value_id)
+
+
+class FeedEntryManager(models.Manager):
+    def entry(self, f, voters):
+        return FeedEntry(
+            field_value_id=f.pk,
+            target_id=f.target_id,
+            target_name=f.target.name,
+            graduation_year=f.target.main_grade.graduation_year,
+            grade_letter=f.target.main_grade.letter,
+            author_id=f.author_code_id and f.author_code.owner_id,
+            field_name=f.field_name,
+            value=f.field_value,
+            status=f.status,
+            status_update_date=f.status_update_date,
+            vote_count=f.vote_count,
+            voters=json.dumps(voters, separators=(',', ':')),
+        )
+
+    def add_field_value(self, f):
+        """
+        Запись ленты новой правки: голосов за и против у нее еще нет
+        """
+        if f.field_name != FieldValue.FIELD_EMAIL:
+            self.bulk_create([self.entry(f, {Vote.VOTE_UP: [], Vote.VOTE_DOWN: []})])
+
+    def update_votes(self, f, votes):
+        """
+        Переносит в запись ленты статус и голоса правки одним UPDATE.
+        votes — все голоса правки с кодами авторов
+        """
+        if f.field_name == FieldValue.FIELD_EMAIL:
+            return
+        voters = {Vote.VOTE_UP: [], Vote.VOTE_DOWN: []}
+        # Новые голоса первыми, как в update_field_values
+        for vote in sorted(votes, key=lambda v: v.timestamp, reverse=True):
+            if vote.value in voters:
+                voters[vote.value].append(vote.author_code_id and vote.author_code.owner_id)
+        self.filter(field_value_id=f.pk).update(
+            status=f.status,
+            status_update_date=f.status_update_date,
+            vote_count=f.vote_count,
+            voters=json.dumps(voters, separators=(',', ':')),
+            updated_at=timezone.now(),
+        )
+
+    def update_field_values(self, field_value_ids):
+        """
+        Пересобирает записи ленты правок: данные выпускника и класса,
+        владельца кода автора и владельцев голосов за и против
+        """
+        field_value_ids = sorted(set(field_value_ids))
+        for i in range(0, len(field_value_ids), 500):
+            batch = field_value_ids[i:i + 500]
+            voters = {pk: {Vote.VOTE_UP: [], Vote.VOTE_DOWN: []} for pk in batch}
+            for field_value_id, value, owner_id in Vote.objects.filter(
+                    field_value_id__in=batch, value__in=(Vote.VOTE_UP, Vote.VOTE_DOWN),
+            ).values_list('field_value_id', 'value', 'author_code__owner_id'):
+                voters[field_value_id][value].append(owner_id)
+            facts = FieldValue.objects.filter(pk__in=batch).exclude(
+                field_name=FieldValue.FIELD_EMAIL,
+            ).select_related('target__main_grade', 'author_code')
+            self.filter(field_value_id__in=batch).delete()
+            self.bulk_create(self.entry(f, voters[f.pk]) for f in facts)
+
+    def update_students(self, students):
+        """
+        Переносит в ленту новые имя и класс выпускников
+        """
+        for s in students:
+            self.filter(target_id=s.pk).update(
+                target_name=s.name,
+                graduation_year=s.main_grade.graduation_year,
+                grade_letter=s.main_grade.letter,
+                updated_at=timezone.now(),
+            )
+
+
+class FeedEntry(models.Model):
+    """
+    Запись ленты правок со всем, что показывает лента: страница ленты
+    читается одним запросом по индексу без цепочек prefetch. Правки
+    с email в ленту не попадают
+    """
+    field_value = models.OneToOneField(FieldValue, primary_key=True, related_name='feed_entry')
+    target = models.ForeignKey(Student, related_name='+')
+    target_name = models.CharField(max_length=200)
+    graduation_year = models.PositiveSmallIntegerField('Год выпуска')
+    grade_letter = models.CharField('Буква класса', max_length=1)
+    # Владелец кода, которым правка добавлена
+    author = models.ForeignKey(Student, related_name='+', blank=True, null=True)
+    field_name = models.CharField(
+        'Имя поля', max_length=20,
+        choices=[(k, v) for k, v, h in FieldValue.EDITABLE_FIELDS])
+    value = models.CharField('Значение поля', max_length=200)
+    status = models.CharField('Статус правки', choices=FieldValue.STATUS_CHOICES, max_length=20)
+    status_update_date = models.DateTimeField('Дата обновления статуса')
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    vote_count = models.PositiveIntegerField('Число голосов', default=0)
+    # {"upvoted": [id владельца или null, ...], "downvoted": [...]}
+    voters = models.TextField('Голосовавшие за и против', default='{}')
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'записи ленты'
+        index_together = [
+            ('status_update_date', 'field_value'),
+            ('target', 'status_update_date', 'field_value'),
+            ('graduation_year', 'status_update_date', 'field_value'),
+            ('graduation_year', 'grade_letter', 'status_update_date', 'field_value'),
+        ]
+
+    def __unicode__(self):
+        return '%s _ %s' % (self.target_name, self.get_field_name_display())
+
+    @property
+    def grade_name(self):
+        return '%s%s' % (self.graduation_year, self.grade_letter)
+
+    @cached_property
+    def voter_ids(self):
+        return json.loads(self.voters)
+
+
 class Teachers(models.Model):
     grade = models.ForeignKey(Grade, related_name='teachers')
     role = models.CharField(max_length=512)
     content = models.TextField()
     torder = models.SmallIntegerField()
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
 
     class Meta:
         verbose_name = 'учителя'
@@ -270,3 +686,95 @@ class Teachers(models.Model):
 
     def __unicode__(self):
         return ' '.join([self.role, self.content])
+
+
+re_word = re.compile(r'\w+', re.U)
+
+
+def search_terms(text):
+    """
+    Все суффиксы слов текста длиной от двух символов в нижнем регистре.
+    Подстрока из букв встречается в тексте тогда и только тогда, когда
+    она является началом одного из суффиксов
+    """
+    terms = set()
+    for word in re_word.findall(text.lower()):
+        for i in range(len(word) - 1):
+            terms.add(word[i:])
+    return terms
+
+
+class SearchTermManager(models.Manager):
+    def update_student(self, student):
+        self.update_students([student])
+
+    def update_students(self, students):
+        if not students:
+            return
+        self.filter(student_id__in=[s.pk for s in students], field_value=None).delete()
+        self.bulk_create(
+            SearchTerm(term=term, student_id=s.pk)
+            for s in students
+            for term in search_terms(s.name)
+        )
+
+    def update_field_value(self, field_value):
+        self.update_field_values([field_value])
+
+    def update_field_values(self, field_values):
+        if not field_values:
+            return
+        self.filter(field_value_id__in=[f.pk for f in field_values]).delete()
+        self.add_field_values(field_values)
+
+    def add_field_values(self, field_values):
+        """
+        Термины новых правок: удалять еще нечего
+        """
+        self.bulk_create(
+            SearchTerm(term=term, student_id=f.target_id, field_value_id=f.pk)
+            for f in field_values if f.is_searchable
+            for term in search_terms(f.field_value)
+        )
+
+    def starting_with(self, prefix):
+        """
+        Термины с префиксом. Диапазон, а не LIKE 'prefix%': LIKE в SQLite
+        не читает индекс по term, а термины и так в нижнем регистре
+        """
+        return self.filter(term__gte=prefix, term__lt=prefix + '\uffff')
+
+    def students_q(self, words):
+        """
+        Условие на выпускников, у которых все слова встречаются в имени
+        или все слова встречаются в одном видимом факте
+        """
+        words = [w.lower() for w in words]
+        by_name = [
+            Q(pk__in=self.starting_with(w).filter(field_value=None).values('student_id'))
+            for w in words
+        ]
+        facts = self.starting_with(words[0]).filter(field_value__isnull=False)
+        for w in words[1:]:
+            facts = facts.filter(field_value_id__in=self.starting_with(w).values('field_value_id'))
+        return reduce(operator.and_, by_name) | Q(pk__in=facts.values('student_id'))
+
+
+class SearchTerm(models.Model):
+    """
+    Поисковый индекс: суффиксы слов имени выпускника (field_value пуст)
+    и видимых фактов о нем, кроме email
+    """
+    term = models.CharField(max_length=200, db_index=True)
+    student = models.ForeignKey(Student, related_name='search_terms')
+    field_value = models.ForeignKey(FieldValue, related_name='search_terms',
+                                    blank=True, null=True)
+
+    objects = SearchTermManager()
+
+    class Meta:
+        verbose_name = 'поисковый термин'
+        verbose_name_plural = 'поисковые термины'
+
+    def __unicode__(self):
+        return self.term
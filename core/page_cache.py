@@ -0,0 +1,194 @@
+# coding=utf-8
+"""
+Кэш HTML страниц со списками. Ключ страницы включает версии областей
+(класс, год выпуска, первая буква имени, список классов), от которых
+зависит ее содержимое; запись в базу увеличивает версии только
+затронутых областей, и старые ключи больше не читаются
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import time
+from calendar import timegm
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+from django.db.models.expressions import RawSQL
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, quote_etag
+
+GRADES = 'grades'
+
+# Кэши в памяти процесса: сброс версий из другого процесса до них не доходит
+LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def get_cache():
+    return caches[settings.PAGE_CACHE]
+
+
+def is_enabled():
+    backend = settings.CACHES[settings.PAGE_CACHE]['BACKEND']
+    return backend not in LOCAL_BACKENDS or settings.PAGE_CACHE_LOCAL
+
+
+def grade_scope(grade_id):
+    return 'grade:%s' % grade_id
+
+
+def year_scope(year):
+    return 'year:%s' % year
+
+
+def char_scope(char):
+    return 'char:%s' % char[:1].upper()
+
+
+def student_scopes(name, grade_id, year):
+    return [grade_scope(grade_id), year_scope(year), char_scope(name)]
+
+
+def version_key(scope):
+    return 'version:%s' % force_bytes(scope).encode('hex')
+
+
+def versions(scopes):
+    cache = get_cache()
+    keys = [version_key(s) for s in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Версия могла быть вытеснена из кэша: начинаем с нового числа,
+            # чтобы не попасть на старые страницы
+            cache.add(key, int(time.time() * 1000), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def invalidate(*scopes):
+    cache = get_cache()
+    for scope in set(scopes):
+        try:
+            cache.incr(version_key(scope))
+        except ValueError:
+            pass
+
+
+def invalidate_students(target_ids):
+    from core.models import Student
+
+    scopes = set()
+    for name, grade_id, year in Student.objects.filter(pk__in=target_ids).values_list(
+            'name', 'main_grade_id', 'main_grade__graduation_year'):
+        scopes.update(student_scopes(name, grade_id, year))
+    invalidate(*scopes)
+
+
+def variant(request):
+    """
+    Анонимы видят одну страницу на всех, вошедшие — свою
+    """
+    code = request.session.get('auth_code')
+    if not code:
+        return 'anon'
+    return hashlib.sha1(force_bytes(code)).hexdigest()[:16]
+
+
+def page_key(request, scopes):
+    return 'page:%s:%s:%s' % (
+        hashlib.md5(force_bytes(request.get_full_path())).hexdigest(),
+        '.'.join(str(v) for v in versions(scopes)),
+        variant(request),
+    )
+
+
+class CachedContentMixin(object):
+    """
+    Отдает блок content страницы из кэша, не выполняя запросов
+    get_context_data. Блок рисуется из content_template_name, шаблон
+    страницы выводит его как content
+    """
+    content_template_name = None
+
+    def get_cache_scopes(self):
+        """
+        Области, от которых зависит страница, или None, если ее не кэшируем
+        """
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        scopes = is_enabled() and self.get_cache_scopes() or None
+        self.cache_key = scopes is not None and page_key(request, scopes) or None
+        if self.cache_key:
+            content = get_cache().get(self.cache_key)
+            if content is not None:
+                return self.response_class(
+                    request=request,
+                    template=[self.template_name],
+                    context={'view': self, 'content': content},
+                    using=self.template_engine,
+                )
+        return super(CachedContentMixin, self).get(request, *args, **kwargs)
+
+    def render_to_response(self, context, **response_kwargs):
+        if 'content' not in context:
+            context['content'] = render_to_string(
+                self.content_template_name, context, self.request)
+            if self.cache_key:
+                get_cache().set(self.cache_key, context['content'], settings.PAGE_CACHE_TIMEOUT)
+        return super(CachedContentMixin, self).render_to_response(context, **response_kwargs)
+
+
+class ConditionalMixin(object):
+    """
+    Отвечает 304 на If-None-Match / If-Modified-Since, не выполняя
+    запросов страницы: валидатор считает get_validator по индексам.
+    ETag зависит от кода сессии: в шапке и пометках голосов видно, кто
+    вошел; Last-Modified отдается только анонимам
+    """
+
+    def get_validator(self):
+        """
+        (время последнего изменения, прочие данные для ETag) или None
+        """
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        validator = self.get_validator()
+        if validator is None:
+            return super(ConditionalMixin, self).get(request, *args, **kwargs)
+        last_modified, parts = validator
+        user = variant(request)
+        etag = hashlib.md5(force_bytes(repr(
+            (request.get_full_path(), last_modified, parts, user)))).hexdigest()
+        if last_modified and user == 'anon':
+            last_modified = timegm(last_modified.utctimetuple())
+        else:
+            last_modified = None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super(ConditionalMixin, self).get(request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = quote_etag(etag)
+                if last_modified:
+                    response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+def latest(*dates):
+    dates = [d for d in dates if d]
+    return dates and max(dates) or None
+
+
+def subquery(qs, function, column, output_field):
+    """
+    function(column) по строкам qs скалярным подзапросом для aggregate():
+    валидатор читает каждую таблицу своим подзапросом одним запросом
+    к базе, не перебирая соединение таблиц
+    """
+    sql, params = qs.order_by().values(column).query.sql_with_params()
+    return Max(RawSQL('SELECT %s(%s) FROM (%s) subquery' % (function, column, sql), params, output_field))
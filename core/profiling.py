@@ -0,0 +1,192 @@
+# coding=utf-8
+"""
+Профилирование запросов на боевом сайте. ProfilingMiddleware включается
+настройкой PROFILE_DIR и профилирует долю PROFILE_SAMPLE_RATE запросов,
+а также любой запрос с подписанным заголовком X-Profile (значение
+выдает `profiles token'). Профили пишутся в PROFILE_DIR по одному файлу
+на запрос, с именем представления в имени файла; старые файлы
+удаляются, когда каталог превышает PROFILE_MAX_BYTES.
+
+Два способа: sampler раз в PROFILE_INTERVAL секунд снимает стек потока
+запроса и пишет свернутые стеки (.collapsed, формат flamegraph.pl),
+cprofile пишет .prof для pstats. Сводку по файлам печатает
+`profiles report'
+"""
+from __future__ import unicode_literals
+
+import cProfile
+import os
+import random
+import sys
+import thread
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+
+SALT = 'core.profiling'
+
+# Куда уходит время: первая снизу стека подходящая категория
+CATEGORIES = (
+    ('rules', ('core/rules.py',)),
+    ('orm', ('django/db/',)),
+    ('templates', ('pyjade/', 'django/template/')),
+)
+
+
+def make_token():
+    return signing.dumps('profile', salt=SALT)
+
+
+def check_token(token):
+    try:
+        return signing.loads(token, salt=SALT, max_age=settings.PROFILE_TOKEN_MAX_AGE) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def category(filenames):
+    """
+    Категория по файлам кадров, от внутреннего к внешнему
+    """
+    for filename in filenames:
+        for name, parts in CATEGORIES:
+            if any(part in filename for part in parts):
+                return name
+    return 'other'
+
+
+_short_names = {}
+
+
+def short_name(filename):
+    """
+    Путь файла от каталога из sys.path: django/db/models/query.py
+    """
+    if filename not in _short_names:
+        best = filename
+        for path in sys.path:
+            if path and filename.startswith(path.rstrip('/') + '/'):
+                candidate = filename[len(path.rstrip('/')) + 1:]
+                if len(candidate) < len(best):
+                    best = candidate
+        _short_names[filename] = best
+    return _short_names[filename]
+
+
+class StackSampler(object):
+    """
+    Снимает стек потока, вызвавшего start, раз в interval секунд.
+    stacks — счетчик свернутых стеков «файл:функция;...» от корня
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def start(self):
+        self.thread_id = thread.get_ident()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.run)
+        self.sampler.daemon = True
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.sampler.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s' % (short_name(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack.encode('utf-8'), count))
+
+
+class CProfiler(object):
+    def __init__(self, interval=None):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+ENGINES = {
+    'sampler': (StackSampler, 'collapsed'),
+    'cprofile': (CProfiler, 'prof'),
+}
+
+
+def rotate(directory, max_bytes):
+    """
+    Удаляет самые старые профили, пока каталог больше max_bytes
+    """
+    files = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(('.prof', '.collapsed')) and os.path.isfile(path):
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size, path))
+    total = sum(size for mtime, name, size, path in files)
+    for mtime, name, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+class ProfilingMiddleware(object):
+    header = 'HTTP_X_PROFILE'
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILE_DIR', None):
+            raise MiddlewareNotUsed()
+        if not os.path.isdir(settings.PROFILE_DIR):
+            os.makedirs(settings.PROFILE_DIR)
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        token = request.META.get(self.header)
+        if token:
+            return check_token(token)
+        return random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        engine, extension = ENGINES[settings.PROFILE_ENGINE]
+        profiler = engine(settings.PROFILE_INTERVAL)
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        match = getattr(request, 'resolver_match', None)
+        view = match and match.url_name or 'unknown'
+        path = os.path.join(settings.PROFILE_DIR, '%s-%d-%d.%s' % (
+            view, time.time() * 1000, os.getpid(), extension))
+        profiler.dump(path)
+        rotate(settings.PROFILE_DIR, settings.PROFILE_MAX_BYTES)
+        return response
+
+
+def view_name(filename):
+    return filename.rsplit('.', 1)[0].rsplit('-', 2)[0]
@@ -0,0 +1,133 @@
+# coding=utf-8
+"""
+Счетчики запросов к базе: число запросов, время в базе, время отрисовки
+шаблона и самые частые повторяющиеся запросы. QueryStats считает внутри
+блока with, QueryStatsMiddleware — на каждый запрос, с заголовком ответа
+X-Query-Stats и строкой в журнале core.query_stats
+"""
+from __future__ import unicode_literals
+
+import logging
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connection, reset_queries
+
+logger = logging.getLogger(__name__)
+
+re_in_list = re.compile(r'\bIN \([^()]*\)', re.I)
+re_string = re.compile(r"'(?:[^']|'')*'")
+re_number = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def fingerprint(sql):
+    """
+    Запрос без значений: одинаковые по форме запросы с разными id
+    совпадают, так и видны N+1
+    """
+    sql = re_in_list.sub('IN (...)', sql)
+    sql = re_string.sub('?', sql)
+    return re_number.sub('?', sql)
+
+
+class QueryStats(object):
+    """
+    with QueryStats() as stats: ... — запросы внутри блока в stats.queries
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.render_time = 0
+        self.total_time = 0
+
+    def __enter__(self):
+        self.force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        # Начало запроса очищает журнал запросов соединения
+        self.reset_connected = request_started.disconnect(reset_queries)
+        # Журнал соединения хранит только последние запросы, пишем в свой
+        self.queries_log = connection.queries_log
+        connection.queries_log = self.queries
+        self.started_at = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.total_time = time.time() - self.started_at
+        connection.force_debug_cursor = self.force_debug_cursor
+        connection.queries_log = self.queries_log
+        connection.queries_log.extend(self.queries)
+        if self.reset_connected:
+            request_started.connect(reset_queries)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def db_time(self):
+        return sum(float(q['time']) for q in self.queries)
+
+    def repeated(self, top=3):
+        """
+        Самые частые формы запросов, встретившиеся больше одного раза
+        """
+        counts = Counter(fingerprint(q['sql']) for q in self.queries)
+        return [(sql, n) for sql, n in counts.most_common(top) if n > 1]
+
+    def summary(self):
+        return 'queries=%d; db=%.1fms; render=%.1fms; total=%.1fms' % (
+            self.count, self.db_time * 1000, self.render_time * 1000, self.total_time * 1000)
+
+
+class QueryStatsMiddleware(object):
+    """
+    Включается настройкой QUERY_STATS. Запросы дольше
+    QUERY_STATS_LOG_SLOWER (секунды) пишутся в журнал с повторами
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_STATS', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryStats() as stats:
+            request.query_stats = stats
+            response = self.get_response(request)
+        if getattr(request, 'render_started_at', None):
+            stats.render_time = time.time() - request.render_started_at
+        response['X-Query-Stats'] = stats.summary()
+        if stats.total_time >= settings.QUERY_STATS_LOG_SLOWER:
+            logger.info('%s %s %s', request.method, request.get_full_path(), stats.summary())
+            for sql, n in stats.repeated():
+                logger.info('  %dx %s', n, sql)
+        return response
+
+    def process_template_response(self, request, response):
+        # Шаблон рисуется сразу после этого вызова
+        request.render_started_at = time.time()
+        return response
+
+
+class QueryBudgetMixin(object):
+    """
+    Для TestCase: with self.assertQueryBudget(10): ... падает, если
+    запросов больше, и показывает повторяющиеся
+    """
+
+    def assertQueryBudget(self, budget, msg=None):
+        testcase = self
+
+        class Context(QueryStats):
+            def __exit__(self, exc_type, exc_value, traceback):
+                super(Context, self).__exit__(exc_type, exc_value, traceback)
+                if exc_type is None and self.count > budget:
+                    testcase.fail('%s%d queries, budget %d. Repeated:\n%s' % (
+                        msg and msg + ': ' or '', self.count, budget,
+                        '\n'.join('%dx %s' % (n, sql) for sql, n in self.repeated()) or '-'))
+
+        return Context()
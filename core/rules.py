@@ -3,9 +3,257 @@ from __future__ import unicode_literals
 
 from itertools import groupby
 
+from django.db import transaction
 from django.utils import timezone
 
-from core.models import Vote, AuthCode, FieldValue
+from core import page_cache
+from core.models import Vote, AuthCode, AuthorActivity, FeedEntry, FieldValue, Student, SearchTerm, student_card
+from core.utils import bulk_update
+
+
+# Сумма голосов округляется, чтобы пересчет по всем голосам и пошаговое
+# добавление и отмена голосов давали одно и то же число
+SCORE_DIGITS = 6
+
+
+def apply_vote(edit, vote):
+    """
+    Учитывает голос в агрегатах правки с текущими владельцем и доверием
+    его кода
+    """
+    change = vote.value in (Vote.VOTE_ADDED, Vote.VOTE_UP) and 1 or -1
+    is_own_edit = False
+    trust_level = 0.1
+    if vote.author_code and vote.author_code.status in AuthCode.VOID_STATUSES:
+        # Голос отозванного или несуществующего кода остается, но не весит
+        trust_level = 0
+    elif vote.author_code:
+        is_own_edit = vote.author_code.owner_id == edit.target_id
+        trust_level = vote.author_code.trust_level
+        if change == -1:
+            edit.negative_count += 1
+    factor = is_own_edit and 10 or 1
+
+    edit.votes = round(edit.votes + change * trust_level * factor, SCORE_DIGITS)
+    edit.vote_count += 1
+    if edit.vote_count == 1:
+        edit.first_vote_author_id = vote.author_code_id
+    if vote.value == Vote.VOTE_TO_DEL:
+        edit.delete_vote_count += 1
+        if is_own_edit:
+            edit.owner_delete_count += 1
+        edit.delete_vote_author_id = vote.author_code_id
+
+
+def aggregate_status(edit):
+    """
+    Статус правки по агрегатам ее голосов
+    """
+    if edit.owner_delete_count:
+        return FieldValue.STATUS_DELETED
+
+    if edit.delete_vote_count \
+            and edit.vote_count == 1 + edit.negative_count \
+            and edit.first_vote_author_id == edit.delete_vote_author_id:
+        return FieldValue.STATUS_DELETED
+
+    if not edit.delete_vote_count \
+            and edit.vote_count == 1 + edit.negative_count \
+            and edit.negative_count > 1:
+        return FieldValue.STATUS_DELETED
+
+    if edit.votes > 0:
+        if edit.votes > 0.9:
+            return FieldValue.STATUS_TRUSTED
+        return FieldValue.STATUS_UNTRUSTED
+    return FieldValue.STATUS_HIDDEN
+
+
+def score_edit(edit, votes):
+    """
+    Заново считает агрегаты правки по всем ее голосам, упорядоченным по id,
+    и возвращает статус
+    """
+    edit.votes = 0
+    edit.vote_count = 0
+    edit.negative_count = 0
+    edit.delete_vote_count = 0
+    edit.owner_delete_count = 0
+    edit.first_vote_author_id = None
+    edit.delete_vote_author_id = None
+    for vote in votes:
+        apply_vote(edit, vote)
+    return aggregate_status(edit)
+
+
+def aggregates(edit):
+    return [getattr(edit, edit._meta.get_field(f).attname) for f in FieldValue.AGGREGATE_FIELDS]
+
+
+def changed_fields(edit, old_aggregates, status, timestamp, force_update=False):
+    """
+    Выставляет правке статус и возвращает поля, которые нужно записать
+    """
+    edit.old_status, edit.old_votes = edit.status, old_aggregates[0]
+    fields_to_update = []
+    if edit.status != status or force_update:
+        edit.status = status
+        edit.status_update_date = timestamp
+        fields_to_update.extend(['status', 'status_update_date'])
+    for name, old, new in zip(FieldValue.AGGREGATE_FIELDS, old_aggregates, aggregates(edit)):
+        if old != new:
+            fields_to_update.append(name)
+    if fields_to_update:
+        edit.updated_at = timezone.now()
+        fields_to_update.append('updated_at')
+    return fields_to_update
+
+
+def recompute(all_votes, timestamp, force_update=False):
+    """
+    Пересчитывает правки по их голосам, упорядоченным по правке и id.
+    Возвращает пары (правка, измененные поля) для правок, которые нужно
+    записать; прежние значения остаются в edit.old_status и edit.old_votes
+    """
+    changes = []
+    for edit, votes in groupby(all_votes, key=lambda x: x.field_value):
+        old_aggregates = aggregates(edit)
+        status = score_edit(edit, list(votes))
+        fields_to_update = changed_fields(edit, old_aggregates, status, timestamp, force_update)
+        if fields_to_update:
+            changes.append((edit, fields_to_update))
+    return changes
+
+
+def card_changed(edit, first_vote=False, facts=None):
+    """
+    Меняет ли пересчет правки карточку выпускника: значок появляется,
+    пропадает или меняет статус, либо голоса переставляют его среди
+    видимых фактов того же поля и статуса. Карточка упорядочена
+    устойчивой сортировкой правок по id, так что при равных голосах
+    раньше идет правка с меньшим id. facts — уже прочитанные правки
+    выпускника
+    """
+    visible = (FieldValue.STATUS_TRUSTED, FieldValue.STATUS_UNTRUSTED)
+    if edit.field_name not in FieldValue.CARD_FIELDS:
+        return False
+    if first_vote:
+        # Правки без голосов может еще не быть в карточке
+        return edit.status in visible
+    if edit.status != edit.old_status:
+        return edit.status in visible or edit.old_status in visible
+    if edit.status not in visible or edit.votes == edit.old_votes:
+        return False
+    if facts is None:
+        facts = FieldValue.objects.filter(
+            target_id=edit.target_id, field_name=edit.field_name, status=edit.status)
+    low, high = sorted([edit.old_votes, edit.votes])
+    return any(
+        f.field_name == edit.field_name and f.status == edit.status
+        and (f.pk < edit.pk and low <= f.votes < high or f.pk > edit.pk and low < f.votes <= high)
+        for f in facts)
+
+
+def update_card(target_id, facts=None):
+    """
+    Пересобирает карточку выпускника одним UPDATE, без чтения самого
+    выпускника и без его сигналов. facts — все правки выпускника по id,
+    если они уже прочитаны
+    """
+    if facts is None:
+        facts = FieldValue.objects.filter(target_id=target_id).order_by('id')
+    Student.objects.filter(pk=target_id).update(card=student_card(list(facts)))
+
+
+def _update_vote(vote, sign, timestamp=None, votes=None, facts=None):
+    # Без точки сохранения: IntegrityError откатывает транзакцию
+    # вызывающего целиком
+    with transaction.atomic(savepoint=False):
+        if votes is None:
+            edit = FieldValue.objects.select_for_update().get(pk=vote.field_value_id)
+            votes = list(edit.vote_set.select_related('author_code').order_by('id'))
+        else:
+            edit = vote.field_value
+        old_aggregates = aggregates(edit)
+        if sign > 0:
+            vote.save()
+            votes.append(vote)
+            apply_vote(edit, vote)
+            status = aggregate_status(edit)
+        else:
+            votes.remove(vote)
+            vote.delete()
+            # Вес голоса зависит от текущих владельца и доверия кода, а они
+            # могли смениться после голоса: вычитать нельзя, правка
+            # пересчитывается по оставшимся голосам
+            status = score_edit(edit, votes)
+            if not votes:
+                # Правки без голосов полный пересчет не трогает
+                status = edit.status
+        fields_to_update = changed_fields(
+            edit, old_aggregates, status, timestamp or timezone.now())
+        if fields_to_update:
+            edit.save(update_fields=fields_to_update)
+        if card_changed(edit, sign > 0 and len(votes) == 1, facts):
+            update_card(edit.target_id, facts)
+            if edit.status == edit.old_status:
+                # Смену статуса сбрасывает сигнал сохранения правки
+                page_cache.invalidate_students([edit.target_id])
+        if 'status_update_date' in fields_to_update:
+            AuthorActivity.objects.filter(field_value_id=edit.pk).update(
+                status_update_date=edit.status_update_date)
+
+        # Строка активности есть, пока у автора остаются голоса за правку:
+        # голоса уже прочитаны под блокировкой, отдельной проверки не нужно
+        author_id = vote.author_code_id and vote.author_code.owner_id
+        if author_id and not any(
+                v.author_code_id and v.author_code.owner_id == author_id
+                for v in votes if v.pk != vote.pk):
+            if sign > 0:
+                AuthorActivity.objects.add(author_id, edit)
+            else:
+                AuthorActivity.objects.remove(author_id, edit.pk)
+        FeedEntry.objects.update_votes(edit, votes)
+    return edit
+
+
+def add_vote(vote, timestamp=None, votes=None, facts=None):
+    """
+    Сохраняет голос и за O(1) обновляет агрегаты и статус правки.
+    Если вызывающий уже прочитал под блокировкой голоса правки (votes,
+    по id, пополняется голосом) и все правки выпускника (facts, по id,
+    среди них vote.field_value), они не перечитываются
+    """
+    return _update_vote(vote, 1, timestamp, votes, facts)
+
+
+def remove_vote(vote, timestamp=None, votes=None, facts=None):
+    """
+    Удаляет голос и пересчитывает агрегаты и статус правки по ее
+    оставшимся голосам. votes и facts — как в add_vote, голос из votes
+    убирается
+    """
+    return _update_vote(vote, -1, timestamp, votes, facts)
+
+
+def add_fact(edit, vote, facts):
+    """
+    Сохраняет новую правку вместе с ее первым голосом: агрегаты и статус
+    считаются до вставки, карточка собирается из уже прочитанных правок
+    выпускника facts. Повтор значения поднимает IntegrityError
+    """
+    with transaction.atomic(savepoint=False):
+        apply_vote(edit, vote)
+        edit.status = aggregate_status(edit)
+        edit.save(force_insert=True)
+        vote.field_value = edit
+        vote.save()
+        author_id = vote.author_code_id and vote.author_code.owner_id
+        if author_id:
+            AuthorActivity.objects.add(author_id, edit)
+        if edit.field_name in FieldValue.CARD_FIELDS:
+            update_card(edit.target_id, list(facts) + [edit])
+    return edit
 
 
 def update_fields(target_id, field_name, timestamp=None, force_update=False):
@@ -17,65 +265,100 @@ def update_fields(target_id, field_name, timestamp=None, force_update=False):
         'author_code',
     ).order_by('field_value_id', 'id'))
 
-    computed_statuses = {}
-    old_votes = {}
-    edits = []
     if not timestamp:
         timestamp = timezone.now()
 
-    for edit, votes in groupby(all_votes, key=lambda x: x.field_value):
-        edits.append(edit)
-        old_votes[edit] = edit.votes
-        edit.votes = 0
-        to_delete_vote = None
-        negative_authenticated = 0
+    changes = recompute(all_votes, timestamp, force_update)
+    for edit, fields_to_update in changes:
+        edit.save(update_fields=fields_to_update)
+    AuthorActivity.objects.sync_dates(
+        edit.pk for edit, fields_to_update in changes
+        if 'status_update_date' in fields_to_update
+    )
+    # Владельцы кодов голосовавших могли смениться
+    FeedEntry.objects.update_field_values(vote.field_value_id for vote in all_votes)
+
+    if changes:
+        Student.objects.get(pk=target_id).update_card()
+
+
+def recompute_targets(target_from, target_to, force_update=False):
+    """
+    Пересчитывает все пары (target, field_name) выпускников с id
+    в [target_from, target_to) за один запрос голосов. Время обновления
+    статуса — время последнего голоса пары, как в `votes update'.
+    Возвращает изменения и число прочитанных голосов
+    """
+    all_votes = Vote.objects.filter(
+        field_value__target_id__gte=target_from,
+        field_value__target_id__lt=target_to,
+    ).select_related(
+        'field_value',
+        'author_code',
+    ).order_by(
+        'field_value__target_id', 'field_value__field_name', 'field_value_id', 'id',
+    )
+
+    changes = []
+    total_votes = 0
+    pairs = groupby(all_votes, key=lambda x: (x.field_value.target_id, x.field_value.field_name))
+    for pair, votes in pairs:
         votes = list(votes)
+        total_votes += len(votes)
+        timestamp = max(vote.timestamp for vote in votes)
+        changes.extend(recompute(votes, timestamp, force_update))
+    return changes, total_votes
 
-        for vote in votes:
-            if vote.value == Vote.VOTE_TO_DEL:
-                to_delete_vote = vote
-                if vote.author_code_id and vote.author_code.owner_id == edit.target_id:
-                    computed_statuses[edit] = FieldValue.STATUS_DELETED
-            change = vote.value in (Vote.VOTE_ADDED, Vote.VOTE_UP) and 1 or -1
-            is_own_edit = False
-            trust_level = 0.1
-            if vote.author_code:
-                is_own_edit = vote.author_code.owner_id == edit.target_id
-                trust_level = vote.author_code.trust_level
-                if change == -1:
-                    negative_authenticated += 1
-            factor = is_own_edit and 10 or 1
-
-            edit.votes += change * trust_level * factor
-
-        if to_delete_vote \
-                and len(votes) == 1 + negative_authenticated \
-                and votes[0].author_code == to_delete_vote.author_code:
-            computed_statuses[edit] = FieldValue.STATUS_DELETED
-
-        if not to_delete_vote \
-                and len(votes) == 1 + negative_authenticated\
-                and negative_authenticated > 1:
-            computed_statuses[edit] = FieldValue.STATUS_DELETED
-
-    edits = sorted(edits, key=lambda e: e.votes, reverse=True)
-
-    for edit in edits:
-        if edit not in computed_statuses:
-            if edit.votes > 0:
-                if edit.votes > 0.9:
-                    computed_statuses[edit] = FieldValue.STATUS_TRUSTED
-                else:
-                    computed_statuses[edit] = FieldValue.STATUS_UNTRUSTED
-            else:
-                computed_statuses[edit] = FieldValue.STATUS_HIDDEN
-
-        fields_to_update = []
-        if edit.status != computed_statuses[edit] or force_update:
-            edit.status = computed_statuses[edit]
-            edit.status_update_date = timestamp
-            fields_to_update.extend(['status', 'status_update_date'])
-        if edit.votes != old_votes[edit]:
-            fields_to_update.append('votes')
-        if fields_to_update:
-            edit.save(update_fields=fields_to_update)
+
+def update_code_votes(auth_code_ids):
+    """
+    Пересчитывает пары, за правки которых голосовали коды, после смены
+    их владельца или доверия. Возвращает число пар
+    """
+    pairs = code_pairs(auth_code_ids)
+    for target_id, field_name in pairs:
+        update_fields(target_id, field_name)
+    return len(pairs)
+
+
+def code_pairs(auth_code_ids):
+    """
+    Пары (target, field_name), за правки которых голосовали коды
+    """
+    auth_code_ids = list(auth_code_ids)
+    if not auth_code_ids:
+        return []
+    return list(Vote.objects.filter(author_code_id__in=auth_code_ids).values_list(
+        'field_value__target_id', 'field_value__field_name',
+    ).distinct().order_by('field_value__target_id', 'field_value__field_name'))
+
+
+def update_cards(target_ids):
+    facts = FieldValue.objects.filter(target_id__in=target_ids).order_by('target_id')
+    bulk_update([
+        Student(pk=target_id, card=student_card(list(modifications)))
+        for target_id, modifications in groupby(facts, key=lambda x: x.target_id)
+    ], ['card'])
+
+
+def save_changes(edits, batch_size=500):
+    """
+    Записывает пересчитанные правки пачками, обновляет поисковый индекс
+    правок со сменившимся статусом и карточки затронутых выпускников
+    """
+    with transaction.atomic():
+        for i in range(0, len(edits), batch_size):
+            batch = edits[i:i + batch_size]
+            bulk_update(batch, ('status', 'status_update_date', 'updated_at') + FieldValue.AGGREGATE_FIELDS)
+            SearchTerm.objects.update_field_values([
+                e for e in batch if e.status != e.old_status
+            ])
+            AuthorActivity.objects.sync_dates(e.pk for e in batch)
+            FeedEntry.objects.update_field_values(e.pk for e in batch)
+            targets = set(
+                e.target_id for e in batch
+                if e.status != e.old_status or e.votes != e.old_votes
+            )
+            update_cards(targets)
+            # bulk_update не посылает сигналов
+            page_cache.invalidate_students(targets)
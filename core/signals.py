@@ -0,0 +1,107 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.db.models.signals import pre_save, pre_delete, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core import page_cache, rules
+from core.models import AuthCode, Grade, Student, Teachers, FieldValue, FeedEntry
+
+
+@receiver(pre_save, sender=Student)
+def remember_student(sender, instance, update_fields=None, **kwargs):
+    """
+    Запоминает прежние имя и класс: страницы старой буквы и старого
+    класса тоже нужно сбросить
+    """
+    instance._old_values = None
+    if not instance.pk:
+        return
+    if update_fields is not None and not {'name', 'main_grade'} & set(update_fields):
+        return
+    instance._old_values = Student.objects.filter(pk=instance.pk).values_list(
+        'name', 'main_grade_id', 'main_grade__graduation_year').first()
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def invalidate_student(sender, instance, **kwargs):
+    scopes = page_cache.student_scopes(
+        instance.name, instance.main_grade_id, instance.main_grade.graduation_year)
+    old = getattr(instance, '_old_values', None)
+    if old:
+        scopes.extend(page_cache.student_scopes(*old))
+    page_cache.invalidate(*scopes)
+
+
+@receiver(post_save, sender=Student)
+def update_feed_student(sender, instance, created=False, **kwargs):
+    old = getattr(instance, '_old_values', None)
+    if old and old[:2] != (instance.name, instance.main_grade_id):
+        FeedEntry.objects.update_students([instance])
+
+
+@receiver(post_save, sender=Grade)
+def update_feed_grade(sender, instance, created=False, **kwargs):
+    if not created:
+        FeedEntry.objects.filter(target__main_grade=instance).update(
+            graduation_year=instance.graduation_year, grade_letter=instance.letter,
+            updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Grade)
+@receiver(post_delete, sender=Grade)
+def invalidate_grade(sender, instance, **kwargs):
+    page_cache.invalidate(
+        page_cache.GRADES,
+        page_cache.grade_scope(instance.pk),
+        page_cache.year_scope(instance.graduation_year),
+    )
+
+
+@receiver(post_save, sender=Teachers)
+@receiver(post_delete, sender=Teachers)
+def invalidate_teachers(sender, instance, **kwargs):
+    page_cache.invalidate(
+        page_cache.grade_scope(instance.grade_id),
+        page_cache.year_scope(instance.grade.graduation_year),
+    )
+
+
+@receiver(post_save, sender=FieldValue)
+def invalidate_field_value(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'status' in update_fields:
+        target = getattr(instance, FieldValue.target.cache_name, None)
+        if target:
+            # Выпускник уже прочитан, например при добавлении правки
+            page_cache.invalidate(*page_cache.student_scopes(
+                target.name, target.main_grade_id, target.main_grade.graduation_year))
+        else:
+            page_cache.invalidate_students([instance.target_id])
+
+
+@receiver(post_delete, sender=FieldValue)
+def invalidate_deleted_field_value(sender, instance, **kwargs):
+    page_cache.invalidate_students([instance.target_id])
+
+
+@receiver(post_save, sender=AuthCode)
+@receiver(post_delete, sender=AuthCode)
+def forget_auth_code(sender, instance, **kwargs):
+    AuthCode.objects.cache.forget(instance.code)
+
+
+@receiver(pre_delete, sender=AuthCode)
+def remember_code_pairs(sender, instance, **kwargs):
+    """
+    Голоса кода удаляются вместе с ним: правки, за которые он голосовал,
+    нужно пересчитать
+    """
+    instance._voted_pairs = rules.code_pairs([instance.pk])
+
+
+@receiver(post_delete, sender=AuthCode)
+def rescore_deleted_code(sender, instance, **kwargs):
+    for target_id, field_name in getattr(instance, '_voted_pairs', ()):
+        rules.update_fields(target_id, field_name)
@@ -0,0 +1,268 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import bisect
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from core.canonical import fold_text
+from core.models import FieldValue, Student, re_word
+
+
+class PrefixIndex(object):
+    """
+    Отсортированный массив слов и для каждого слова — множество ключей
+    значений, в которых оно встречается. Поиск по префиксу — бинарный
+    поиск по массиву. Значения с одним ключом (см. core.canonical)
+    считаются одним, показывается самое частое написание. Каждый ключ
+    весит (число фактов с ним, сумма их голосов)
+    """
+
+    def __init__(self):
+        self.words = []
+        self.postings = {}
+        self.weights = {}
+        self.labels = {}
+
+    def add(self, value, votes=0, key=None):
+        key = key or fold_text(value)
+        weight = self.weights.get(key)
+        if weight is None:
+            weight = self.weights[key] = [0, 0]
+            self.labels[key] = Counter()
+            for word in set(re_word.findall(fold_text(key))):
+                postings = self.postings.get(word)
+                if postings is None:
+                    postings = self.postings[word] = set()
+                    bisect.insort(self.words, word)
+                postings.add(key)
+        weight[0] += 1
+        weight[1] += votes
+        self.labels[key][value] += 1
+
+    def remove(self, value, votes=0, key=None):
+        key = key or fold_text(value)
+        weight = self.weights.get(key)
+        if weight is None:
+            return
+        weight[0] -= 1
+        weight[1] -= votes
+        labels = self.labels[key]
+        labels[value] -= 1
+        if labels[value] <= 0:
+            del labels[value]
+        if weight[0] > 0:
+            return
+        del self.weights[key]
+        del self.labels[key]
+        for word in set(re_word.findall(fold_text(key))):
+            postings = self.postings[word]
+            postings.discard(key)
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+
+    def starting_with(self, prefix):
+        result = set()
+        i = bisect.bisect_left(self.words, prefix)
+        while i < len(self.words) and self.words[i].startswith(prefix):
+            result |= self.postings[self.words[i]]
+            i += 1
+        return result
+
+    def label(self, key):
+        return max(self.labels[key].items(), key=lambda item: (item[1], item[0]))[0]
+
+    def search(self, prefixes, limit=None):
+        """
+        Значения, в которых каждый префикс начинает какое-нибудь слово,
+        от самых частых и популярных
+        """
+        keys = None
+        # Длинные префиксы дают меньшие множества, с них и начинаем
+        for prefix in sorted(set(fold_text(p) for p in prefixes), key=len, reverse=True):
+            found = self.starting_with(prefix)
+            keys = found if keys is None else keys & found
+            if not keys:
+                return []
+        order = lambda k: (-self.weights[k][0], -self.weights[k][1], k)
+        return [self.label(k) for k in sorted(keys, key=order)[:limit]]
+
+
+class SuggestState(object):
+    """
+    Один снимок индекса подсказок: значения фактов и имена выпускников.
+    Чтение из базы (*_rows) идет без блокировки, запись в индексы
+    (apply_*) — под блокировкой SuggestIndex
+    """
+    EXCLUDED_FIELDS = (
+        FieldValue.FIELD_EMAIL,
+        FieldValue.FIELD_SOCIAL_FB,
+        FieldValue.FIELD_SOCIAL_VK,
+    )
+
+    def __init__(self):
+        self.values = PrefixIndex()
+        self.names = PrefixIndex()
+        self.facts = {}
+        self.students = {}
+        self.synced_at = None
+        self.students_synced_at = None
+
+    def is_suggested(self, status, field_name):
+        return status != FieldValue.STATUS_DELETED \
+            and field_name not in self.EXCLUDED_FIELDS
+
+    def update_fact(self, pk, value, votes, key=None):
+        old = self.facts.pop(pk, None)
+        if old:
+            self.values.remove(*old)
+        if value is not None:
+            self.facts[pk] = (value, votes, key)
+            self.values.add(value, votes, key)
+
+    def update_student(self, pk, name):
+        old = self.students.pop(pk, None)
+        if old:
+            self.names.remove(old)
+        if name is not None:
+            self.students[pk] = name
+            self.names.add(name)
+
+    def fact_rows(self):
+        """
+        Новые и измененные факты: updated_at меняется и с голосами, и
+        с правкой значения, статус может при этом остаться прежним
+        """
+        qs = FieldValue.objects.all()
+        if self.synced_at:
+            qs = qs.filter(updated_at__gte=self.synced_at)
+        else:
+            qs = qs.exclude(status=FieldValue.STATUS_DELETED) \
+                .exclude(field_name__in=self.EXCLUDED_FIELDS)
+        return list(qs.values_list(
+            'id', 'field_name', 'field_value', 'value_key', 'status', 'votes',
+            'updated_at',
+        ))
+
+    def apply_facts(self, rows):
+        for pk, field_name, value, key, status, votes, updated in rows:
+            if self.is_suggested(status, field_name):
+                self.update_fact(pk, value, votes, key)
+            else:
+                self.update_fact(pk, None, 0)
+            if not self.synced_at or updated > self.synced_at:
+                self.synced_at = updated
+
+    def student_rows(self):
+        """
+        Новые и измененные выпускники (переименование тоже меняет
+        updated_at) и число всех выпускников: по нему видно удаление
+        """
+        qs = Student.objects.all()
+        if self.students_synced_at:
+            qs = qs.filter(updated_at__gte=self.students_synced_at)
+        return list(qs.values_list('id', 'name', 'updated_at')), Student.objects.count()
+
+    def apply_students(self, rows):
+        for pk, name, updated in rows:
+            self.update_student(pk, name)
+            if not self.students_synced_at or updated > self.students_synced_at:
+                self.students_synced_at = updated
+
+    def remove_students(self, existing_ids):
+        for pk in set(self.students) - set(existing_ids):
+            self.update_student(pk, None)
+
+    def sync(self, lock):
+        fact_rows = self.fact_rows()
+        student_rows, count = self.student_rows()
+        with lock:
+            self.apply_facts(fact_rows)
+            self.apply_students(student_rows)
+            deleted = len(self.students) > count
+        if deleted:
+            ids = list(Student.objects.values_list('id', flat=True))
+            with lock:
+                self.remove_students(ids)
+
+
+class SuggestIndex(object):
+    """
+    Индекс подсказок в памяти процесса: значения фактов (кроме email, FB и VK)
+    и имена выпускников. Раз в SUGGEST_INDEX_REFRESH секунд дочитывает факты,
+    измененные с прошлого раза, и новых, переименованных и
+    удаленных выпускников; раз в SUGGEST_INDEX_REBUILD секунд строится
+    заново. Новый снимок строит один запрос вне блокировки, остальные
+    тем временем ищут по старому; до первого снимка процесса они ждут
+    его не дольше SUGGEST_INDEX_WAIT секунд
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.state = None
+            self.building = False
+            self.refreshing = False
+            self.refreshed = 0
+            self.built = 0
+            self.ready.clear()
+
+    def build(self):
+        state = SuggestState()
+        try:
+            state.sync(threading.Lock())
+        finally:
+            with self.lock:
+                self.building = False
+        with self.lock:
+            self.state = state
+            self.built = self.refreshed = time.time()
+        self.ready.set()
+
+    def refresh(self):
+        """
+        Снимок для поиска: перестраивает или дочитывает его, если пора и
+        этим не занят другой запрос
+        """
+        now = time.time()
+        with self.lock:
+            state = self.state
+            rebuild = not self.building and now - self.built > settings.SUGGEST_INDEX_REBUILD
+            refresh = not rebuild and state is not None and not self.refreshing \
+                and now - self.refreshed >= settings.SUGGEST_INDEX_REFRESH
+            self.building = self.building or rebuild
+            self.refreshing = self.refreshing or refresh
+        if rebuild:
+            self.build()
+        elif refresh:
+            try:
+                state.sync(self.lock)
+            finally:
+                with self.lock:
+                    self.refreshing = False
+                    self.refreshed = now
+        elif state is None:
+            self.ready.wait(settings.SUGGEST_INDEX_WAIT)
+        with self.lock:
+            return self.state
+
+    def suggest(self, prefixes, limit, students=False):
+        state = self.refresh()
+        if state is None:
+            return []
+        with self.lock:
+            data = state.values.search(prefixes, limit)
+            if students:
+                data = state.names.search(prefixes, limit) + data
+        return data
+
+
+index = SuggestIndex()
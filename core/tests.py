@@ -1,9 +1,36 @@
-from django.test import TestCase
+# coding=utf-8
+import datetime
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from StringIO import StringIO
 
-from core import rules
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core import auth_service, canonical, importing, profiling, rules, suggest, urls
+from core.auth_stub import AuthStubServer, valid_code
+from core.management.commands import votes as votes_command
+from core.views import StudentListView
+from core.query_stats import QueryBudgetMixin, QueryStats, fingerprint
 from core.models import *
 
 
+def ignore_duplicate(func, *args, **kwargs):
+    # random test votes may repeat a vote that the unique index rejects
+    try:
+        with transaction.atomic():
+            return func(*args, **kwargs)
+    except IntegrityError:
+        return None
+
+
 class FieldValueStatusTestCase(TestCase):
     def setUp(self):
         super(FieldValueStatusTestCase, self).setUp()
@@ -135,3 +162,1357 @@ class FieldValueStatusTestCase(TestCase):
         self.f.refresh_from_db()
         self.assertEqual(self.f.status, FieldValue.STATUS_DELETED)
         self.assertEqual(self.f.votes, -8.9)
+
+
+class StudentSearchTestCase(TestCase):
+    def setUp(self):
+        super(StudentSearchTestCase, self).setUp()
+        g = Grade(letter='U', graduation_year='2048')
+        g.save()
+        self.xu = Student(name='Xu Bo', main_grade=g)
+        self.xu.save()
+        self.nguen = Student(name='Nguen Zobra', main_grade=g)
+        self.nguen.save()
+        self.city = FieldValue(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima, Peru')
+        self.city.save()
+        FieldValue(target=self.nguen, field_name=FieldValue.FIELD_EMAIL, field_value='lima@example.com').save()
+
+    def search(self, *words):
+        return set(Student.objects.filter(SearchTerm.objects.students_q(words)))
+
+    def test_name(self):
+        self.assertEqual(self.search('zob'), {self.nguen})
+        self.assertEqual(self.search('BO'), {self.xu})
+        self.assertEqual(self.search('xu', 'bo'), {self.xu})
+
+    def test_fact_substring(self):
+        self.assertEqual(self.search('im'), {self.xu})
+        self.assertEqual(self.search('lima', 'peru'), {self.xu})
+
+    def test_words_in_one_fact(self):
+        FieldValue(target=self.nguen, field_name=FieldValue.FIELD_CITY, field_value='Lima').save()
+        FieldValue(target=self.nguen, field_name=FieldValue.FIELD_COMPANY, field_value='Peru Inc').save()
+        self.assertEqual(self.search('lima', 'peru'), {self.xu})
+
+    def test_email_excluded(self):
+        self.assertEqual(self.search('example'), set())
+
+    def test_deleted_excluded(self):
+        self.city.status = FieldValue.STATUS_DELETED
+        self.city.save(update_fields=['status'])
+        self.assertEqual(self.search('lima'), set())
+
+        self.city.status = FieldValue.STATUS_HIDDEN
+        self.city.save(update_fields=['status'])
+        self.assertEqual(self.search('lima'), {self.xu})
+
+    def test_rename(self):
+        self.xu.name = 'Xu Zobov'
+        self.xu.save()
+        self.assertEqual(self.search('bo'), {self.xu})
+        self.assertEqual(self.search('zob'), {self.xu, self.nguen})
+
+    def test_prefix_uses_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN is SQLite syntax')
+        qs = SearchTerm.objects.starting_with('lim').values('student_id')
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('USING INDEX', plan)
+        self.assertIn('term>? AND term<?', plan)
+
+
+class PrefixIndexTestCase(TestCase):
+    def test_search(self):
+        index = suggest.PrefixIndex()
+        index.add('Lima, Peru')
+        index.add('Limassol')
+        index.add('Limassol', votes=2)
+        self.assertEqual(index.search(['lim']), ['Limassol', 'Lima, Peru'])
+        self.assertEqual(index.search(['PER', 'li']), ['Lima, Peru'])
+        self.assertEqual(index.search(['ima']), [])
+        self.assertEqual(index.search(['lim'], limit=1), ['Limassol'])
+
+    def test_remove(self):
+        index = suggest.PrefixIndex()
+        index.add('Lima')
+        index.add('Lima')
+        index.remove('Lima')
+        self.assertEqual(index.search(['li']), ['Lima'])
+        index.remove('Lima')
+        self.assertEqual(index.search(['li']), [])
+        self.assertEqual(index.words, [])
+
+    def test_variants(self):
+        index = suggest.PrefixIndex()
+        index.add(u'Королёв')
+        index.add(u'королев')
+        index.add(u'Королев')
+        index.add(u'Королев')
+        self.assertEqual(index.search([u'корол']), [u'Королев'])
+        self.assertEqual(index.search([u'КОРОЛЁ']), [u'Королев'])
+        index.remove(u'Королев')
+        index.remove(u'Королев')
+        self.assertEqual(len(index.search([u'кор'])), 1)
+
+
+class CanonicalTestCase(TestCase):
+    def test_text(self):
+        self.assertEqual(canonical.value_key(u'  Ёлки   Палки '), u'елки палки')
+        self.assertEqual(canonical.value_key(u'ｍｉｔ'), 'mit')
+        self.assertEqual(canonical.value_key('x' * 300), 'x' * canonical.MAX_LENGTH)
+
+    def test_url(self):
+        key = canonical.value_key('https://www.Facebook.com/lima/', is_url=True)
+        self.assertEqual(key, 'facebook.com/lima')
+        for url in ('http://facebook.com/lima', 'facebook.com/lima#about',
+                    'http://FACEBOOK.COM:80/lima', 'http://facebook.com/%6Cima'):
+            self.assertEqual(canonical.value_key(url, is_url=True), key)
+        self.assertEqual(canonical.value_key('http://facebook.com:8080/lima', is_url=True),
+                         'facebook.com:8080/lima')
+        self.assertEqual(canonical.value_key('http://vk.com/id1?w=wall', is_url=True), 'vk.com/id1?w=wall')
+        self.assertEqual(canonical.value_key('http://[Foo', is_url=True), 'http://[foo')
+        self.assertEqual(canonical.value_key('[x', is_url=True), 'http://[x')
+        # the path is case sensitive
+        self.assertNotEqual(canonical.value_key('http://vk.com/Lima', is_url=True),
+                            canonical.value_key('http://vk.com/lima', is_url=True))
+
+    def test_fact(self):
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        f = FieldValue.objects.create(target=xu, field_name=FieldValue.FIELD_SOCIAL_FB,
+                                      field_value='https://www.facebook.com/lima/')
+        self.assertEqual(f.value_key, 'facebook.com/lima')
+        f.field_value = 'https://facebook.com/lim'
+        f.save(update_fields=['field_value'])
+        f.refresh_from_db()
+        self.assertEqual(f.value_key, 'facebook.com/lim')
+        f = FieldValue.objects.create(target=xu, field_name=FieldValue.FIELD_LINK, field_value='http://[foo')
+        self.assertEqual(f.value_key, 'http://[foo')
+
+    def test_add_variant(self):
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        FieldValue.objects.create(target=xu, field_name=FieldValue.FIELD_SOCIAL_FB,
+                                  field_value='https://www.facebook.com/lima/')
+        FieldValue.objects.create(target=xu, field_name=FieldValue.FIELD_CITY, field_value=u'Королёв')
+        url = reverse('student-value-create', kwargs={'pk': xu.pk})
+        self.client.post(url, {'field_name': FieldValue.FIELD_SOCIAL_FB, 'field_value': 'http://facebook.com/lima'})
+        self.client.post(url, {'field_name': FieldValue.FIELD_CITY, 'field_value': u'королев'})
+        self.assertEqual(FieldValue.objects.filter(target=xu).count(), 2)
+        self.client.post(url, {'field_name': FieldValue.FIELD_CITY, 'field_value': u'Королев, МО'})
+        self.assertEqual(FieldValue.objects.filter(target=xu).count(), 3)
+
+    def test_feed_grade(self):
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        zoe = Student.objects.create(name='Zoe', main_grade=Grade.objects.create(letter='A', graduation_year=2049))
+        FieldValue.objects.create(target=xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        FieldValue.objects.create(target=zoe, field_name=FieldValue.FIELD_GRADE, field_value='2048u')
+        # a value that only looks like a grade does not count
+        FieldValue.objects.create(target=zoe, field_name=FieldValue.FIELD_COMPANY, field_value='2048U')
+        FeedEntry.objects.update_field_values(FieldValue.objects.values_list('pk', flat=True))
+        response = self.client.get(reverse('feed'), {'grade': '2048U'})
+        self.assertEqual(sorted(f.value for f in response.context['object_list']), ['2048u', 'Lima'])
+
+
+class SuggestTestCase(TestCase):
+    def setUp(self):
+        super(SuggestTestCase, self).setUp()
+        suggest.index.reset()
+        g = Grade(letter='U', graduation_year='2048')
+        g.save()
+        self.xu = Student(name='Xu Lim', main_grade=g)
+        self.xu.save()
+        FieldValue(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima').save()
+        FieldValue(target=self.xu, field_name=FieldValue.FIELD_EMAIL, field_value='lima@example.com').save()
+        FieldValue(target=self.xu, field_name=FieldValue.FIELD_SOCIAL_FB,
+                   field_value='https://facebook.com/lima').save()
+
+    def get(self, **params):
+        return self.client.get(reverse('suggest-list'), params).json()['data']
+
+    def test_suggest(self):
+        self.assertEqual(self.get(query='li'), ['Lima'])
+        self.assertEqual(self.get(query='li', students='1'), ['Xu Lim', 'Lima'])
+        self.assertEqual(self.get(query=''), [])
+
+    def test_incremental(self):
+        self.assertEqual(self.get(query='li'), ['Lima'])
+        f = FieldValue.objects.get(field_value='Lima')
+        f.status = FieldValue.STATUS_DELETED
+        f.save()
+        FieldValue(target=self.xu, field_name=FieldValue.FIELD_COMPANY, field_value='Lidl').save()
+        suggest.index.refreshed = 0
+        self.assertEqual(self.get(query='li'), ['Lidl'])
+        # a vote changes the weight but not the status: picked up through updated_at
+        FieldValue(target=self.xu, field_name=FieldValue.FIELD_COMPANY, field_value='Lisp').save()
+        suggest.index.refreshed = 0
+        self.assertEqual(self.get(query='li'), ['Lidl', 'Lisp'])
+        FieldValue.objects.filter(field_value='Lisp').update(votes=5, updated_at=timezone.now())
+        suggest.index.refreshed = 0
+        self.assertEqual(self.get(query='li'), ['Lisp', 'Lidl'])
+
+    def test_students_refresh(self):
+        self.assertEqual(self.get(query='xu', students='1'), ['Xu Lim'])
+        self.xu.name = 'Xi Lim'
+        self.xu.save()
+        suggest.index.refreshed = 0
+        self.assertEqual(self.get(query='xu', students='1'), [])
+        self.assertEqual(self.get(query='xi', students='1'), ['Xi Lim'])
+        self.xu.delete()
+        suggest.index.refreshed = 0
+        self.assertEqual(self.get(query='xi', students='1'), [])
+
+    def test_rebuild_in_progress(self):
+        self.get(query='li')
+        # another request is building a new index: the old one is served meanwhile
+        suggest.index.building = True
+        suggest.index.built = 0
+        suggest.index.refreshed = time.time()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(query='li'), ['Lima'])
+
+
+class StudentCardTestCase(TestCase):
+    def setUp(self):
+        super(StudentCardTestCase, self).setUp()
+        self.g = Grade(letter='U', graduation_year='2048')
+        self.g.save()
+        self.xu = Student(name='Xu Bo', main_grade=self.g)
+        self.xu.save()
+        self.code = AuthCode(status=AuthCode.STATUS_VALID, code='1')
+        self.code.save()
+
+    def add(self, field_name, field_value):
+        f = FieldValue(target=self.xu, author_code=self.code, field_name=field_name, field_value=field_value)
+        f.save()
+        Vote.objects.create(field_value=f, author_code=self.code, value=Vote.VOTE_ADDED)
+        rules.update_fields(self.xu.pk, field_name)
+        return f
+
+    def test_card(self):
+        self.add(FieldValue.FIELD_LINK, 'http://xu.example.com/about')
+        self.add(FieldValue.FIELD_NAME, 'Li')
+        self.add(FieldValue.FIELD_DEATH_YEAR, '2100')
+        self.add(FieldValue.FIELD_EMAIL, 'xu@example.com')
+        card = Student.objects.get(pk=self.xu.pk).card_data
+        self.assertEqual(card['names'], [{'value': 'Li', 'status': FieldValue.STATUS_TRUSTED}])
+        self.assertEqual(card['death_year'], ['2100'])
+        self.assertEqual(card['badges'], [
+            {'field': FieldValue.FIELD_EMAIL, 'status': FieldValue.STATUS_TRUSTED},
+            {'field': FieldValue.FIELD_LINK, 'status': FieldValue.STATUS_TRUSTED,
+             'value': 'http://xu.example.com/about', 'host': 'xu.example.com'},
+        ])
+
+    def test_hidden(self):
+        f = self.add(FieldValue.FIELD_CITY, 'Lima')
+        c = AuthCode.objects.create(status=AuthCode.STATUS_VALID, code='2')
+        Vote.objects.create(field_value=f, author_code=c, value=Vote.VOTE_DOWN)
+        rules.update_fields(self.xu.pk, FieldValue.FIELD_CITY)
+        self.assertEqual(Student.objects.get(pk=self.xu.pk).card_data['badges'], [])
+
+    def test_vote_reorders(self):
+        self.add(FieldValue.FIELD_CITY, 'Lima')
+        oslo = self.add(FieldValue.FIELD_CITY, 'Oslo')
+        codes = [AuthCode.objects.create(status=AuthCode.STATUS_VALID, code=str(i)) for i in range(2, 4)]
+
+        def card_updates(vote):
+            with QueryStats() as stats:
+                rules.add_vote(vote)
+            return len([q for q in stats.queries if q['sql'].startswith('UPDATE "core_student"')])
+
+        # Oslo overtakes Lima
+        self.assertEqual(card_updates(Vote(field_value=oslo, author_code=codes[0], value=Vote.VOTE_UP)), 1)
+        self.assertEqual([b['value'] for b in Student.objects.get(pk=self.xu.pk).card_data['badges']],
+                         ['Oslo', 'Lima'])
+        # already first: the card stays as is
+        self.assertEqual(card_updates(Vote(field_value=oslo, author_code=codes[1], value=Vote.VOTE_UP)), 0)
+        student = Student.objects.get(pk=self.xu.pk)
+        self.assertEqual(student.card, student_card(student.modifications.all()))
+
+    def test_list(self):
+        self.add(FieldValue.FIELD_COMPANY, 'Lima Inc')
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('student-list'), {'grade_id': self.g.pk})
+            content = response.getvalue()
+        self.assertIn(b'Lima Inc', content)
+
+
+class VotesUpdateTestCase(TestCase):
+    def setUp(self):
+        super(VotesUpdateTestCase, self).setUp()
+        rnd = random.Random(57)
+        g = Grade(letter='U', graduation_year='2048')
+        g.save()
+        students = [Student.objects.create(name='Student %d' % i, main_grade=g) for i in range(6)]
+        codes = [None] + [
+            AuthCode.objects.create(status=AuthCode.STATUS_VALID, owner=rnd.choice(students + [None]),
+                                    code=str(i), trust_level=rnd.choice([0.5, 1, 2]))
+            for i in range(5)
+        ]
+        for student in students:
+            for i in range(4):
+                f = FieldValue.objects.create(
+                    target=student, field_name=rnd.choice([FieldValue.FIELD_CITY, FieldValue.FIELD_COMPANY]),
+                    field_value='Value %d' % i, status=FieldValue.STATUS_HIDDEN)
+                Vote.objects.create(field_value=f, author_code=rnd.choice(codes), value=Vote.VOTE_ADDED)
+                for j in range(rnd.randint(0, 4)):
+                    ignore_duplicate(Vote.objects.create, field_value=f, author_code=rnd.choice(codes),
+                                     value=rnd.choice([Vote.VOTE_UP, Vote.VOTE_DOWN, Vote.VOTE_TO_DEL]))
+
+    def snapshot(self):
+        return list(FieldValue.objects.order_by('id').values_list('id', 'status', 'votes', 'status_update_date'))
+
+    def test_bulk_matches_per_pair(self):
+        call_command('votes', 'update', stdout=StringIO())
+        expected = self.snapshot()
+        FieldValue.objects.update(status=FieldValue.STATUS_HIDDEN, votes=0)
+        call_command('votes', 'update', '--bulk', stdout=StringIO())
+        self.assertEqual(self.snapshot(), expected)
+        self.assertNotEqual(set(s for _, s, _, _ in expected), {FieldValue.STATUS_HIDDEN})
+        for student in Student.objects.all():
+            self.assertEqual(student.card, student_card(student.modifications.all()))
+
+    def test_workers_match_per_pair(self):
+        call_command('votes', 'update', stdout=StringIO())
+        expected = self.snapshot()
+        FieldValue.objects.update(status=FieldValue.STATUS_HIDDEN, votes=0)
+        # more shards than workers
+        votes_command.Command.SHARD_TARGETS = 2
+        try:
+            out = StringIO()
+            call_command('votes', 'update', '--bulk', '--workers', '2', stdout=out)
+        finally:
+            del votes_command.Command.SHARD_TARGETS
+        self.assertEqual(self.snapshot(), expected)
+        self.assertIn('Fields recalculated: 24', out.getvalue())
+
+    def test_dry_run(self):
+        before = self.snapshot()
+        out = StringIO()
+        call_command('votes', 'update', '--bulk', '--dry-run', stdout=out)
+        self.assertEqual(self.snapshot(), before)
+        self.assertIn('status hidden -> trusted', out.getvalue())
+
+    def test_bulk_options_need_bulk(self):
+        before = self.snapshot()
+        for options in (['--dry-run'], ['--workers', '2']):
+            self.assertRaises(CommandError, call_command, 'votes', 'update', *options, stdout=StringIO())
+        self.assertEqual(self.snapshot(), before)
+
+    def test_shards(self):
+        out = StringIO()
+        call_command('votes', 'update', '--bulk', '--workers', '1', '-v', '2', stdout=out)
+        self.assertIn('Shard %d-%d' % (Student.objects.first().pk, Student.objects.last().pk), out.getvalue())
+        self.assertIn('Worker ', out.getvalue())
+
+
+class IncrementalVotesTestCase(TestCase):
+    def test_matches_full_recompute(self):
+        rnd = random.Random(1957)
+        g = Grade(letter='U', graduation_year='2048')
+        g.save()
+        students = [Student.objects.create(name='Student %d' % i, main_grade=g) for i in range(4)]
+        codes = [None] + [
+            AuthCode.objects.create(status=AuthCode.STATUS_VALID, owner=rnd.choice(students + [None]),
+                                    code=str(i), trust_level=rnd.choice([0.5, 1, 2]))
+            for i in range(5)
+        ]
+        facts = []
+        for student in students:
+            for i in range(3):
+                f = FieldValue.objects.create(target=student, field_name=FieldValue.FIELD_CITY,
+                                              field_value='Value %d' % i)
+                rules.add_vote(Vote(field_value=f, author_code=rnd.choice(codes), value=Vote.VOTE_ADDED))
+                facts.append(f)
+        for i in range(150):
+            votes = list(Vote.objects.exclude(value=Vote.VOTE_ADDED).select_related('author_code'))
+            if votes and rnd.random() < 0.3:
+                rules.remove_vote(rnd.choice(votes))
+            else:
+                ignore_duplicate(rules.add_vote, Vote(
+                    field_value=rnd.choice(facts), author_code=rnd.choice(codes),
+                    value=rnd.choice([Vote.VOTE_UP, Vote.VOTE_DOWN, Vote.VOTE_TO_DEL])))
+
+        out = StringIO()
+        call_command('votes', 'verify', stdout=out)
+        self.assertIn('Fields with stale aggregates: 0/12', out.getvalue())
+        self.assertGreater(FieldValue.objects.filter(status=FieldValue.STATUS_DELETED).count(), 0)
+
+    def test_delete_code_keeps_facts(self):
+        g = Grade.objects.create(letter='U', graduation_year='2048')
+        xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        code = AuthCode.objects.create(status=AuthCode.STATUS_VALID, code='1')
+        f = FieldValue.objects.create(target=xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=f, author_code=code, value=Vote.VOTE_ADDED))
+        rules.add_vote(Vote(field_value=f, value=Vote.VOTE_UP))
+        rules.add_vote(Vote(field_value=f, author_code=code, value=Vote.VOTE_TO_DEL))
+        code.delete()
+        f.refresh_from_db()
+        self.assertIsNone(f.first_vote_author_id)
+        self.assertIsNone(f.delete_vote_author_id)
+        self.assertEqual((f.vote_count, f.delete_vote_count, f.status), (1, 0, FieldValue.STATUS_UNTRUSTED))
+
+    def test_remove_after_owner_change(self):
+        g = Grade.objects.create(letter='U', graduation_year='2048')
+        xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        code = AuthCode.objects.create(status=AuthCode.STATUS_VALID, code='1')
+        f = FieldValue.objects.create(target=xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=f, value=Vote.VOTE_ADDED))
+        rules.add_vote(Vote(field_value=f, author_code=code, value=Vote.VOTE_TO_DEL))
+        # bound without recomputing, the weight of the vote changes under it
+        AuthCode.objects.filter(pk=code.pk).update(owner=xu)
+        rules.remove_vote(Vote.objects.get(author_code=code))
+        f.refresh_from_db()
+        self.assertEqual((f.votes, f.vote_count, f.delete_vote_count, f.owner_delete_count), (0.1, 1, 0, 0))
+        self.assertEqual(f.status, FieldValue.STATUS_UNTRUSTED)
+
+    def test_verify_reports_stale(self):
+        g = Grade(letter='U', graduation_year='2048')
+        g.save()
+        xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        f = FieldValue.objects.create(target=xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=f, value=Vote.VOTE_ADDED))
+        Vote.objects.create(field_value=f, value=Vote.VOTE_UP)
+        out = StringIO()
+        call_command('votes', 'verify', stdout=out)
+        self.assertIn('stale: votes, vote_count', out.getvalue())
+        self.assertIn('Fields with stale aggregates: 1/1', out.getvalue())
+
+
+class AuthServiceTestCase(TestCase):
+    def setUp(self):
+        g = Grade.objects.create(letter='U', graduation_year='2048')
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        self.stub = AuthStubServer({'57-2048u-xubo-1': valid_code('Xu Bo', 2048, 'U')}).start()
+        self.settings = override_settings(AUTH_SERVICE_URL=self.stub.url, AUTH_SERVICE_TIMEOUT=0.2,
+                                          AUTH_SERVICE_FAILURES=2, AUTH_SERVICE_RETRY=60)
+        self.settings.enable()
+        auth_service.client.reset()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.stub.stop()
+        auth_service.client.reset()
+
+    def login(self, code):
+        return self.client.post(reverse('api-login'), {'auth_code': code})
+
+    def test_cached(self):
+        self.assertEqual(self.login('57-2048u-xubo-1').status_code, 200)
+        self.assertEqual(self.login('57-2048u-xubo-1').status_code, 200)
+        self.assertEqual(self.login('57-2048u-nope-1').status_code, 404)
+        self.assertEqual(self.login('57-2048u-nope-1').status_code, 404)
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(AuthCode.objects.get(code='57-2048u-xubo-1').owner, self.xu)
+        self.assertEqual(self.client.session['student_id'], self.xu.pk)
+
+    @override_settings(AUTH_SERVICE_CACHE_SIZE=1)
+    def test_cache_bounded(self):
+        self.login('57-2048u-nope-1')
+        self.login('57-2048u-nope-2')
+        self.assertEqual(len(auth_service.client.cache.items), 1)
+        self.login('57-2048u-nope-1')
+        self.assertEqual(self.stub.requests, 3)
+
+    def test_slow_service(self):
+        AuthCode.objects.create(code='57-2048u-xubo-2', status=AuthCode.STATUS_VALID, owner=self.xu)
+        AuthCode.objects.create(code='57-2048u-xubo-3', status=AuthCode.STATUS_REVOKED, owner=self.xu)
+        self.stub.delay = 0.5
+        self.assertEqual(self.login('57-2048u-xubo-2').status_code, 200)
+        self.assertEqual(self.client.session['student_id'], self.xu.pk)
+        self.assertEqual(self.login('57-2048u-xubo-3').status_code, 403)
+        # circuit is open, the service is not asked anymore
+        self.assertEqual(self.login('57-2048u-xubo-1').status_code, 503)
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(AuthCode.objects.get(code='57-2048u-xubo-2').status, AuthCode.STATUS_VALID)
+
+    def test_owner_change_rescores(self):
+        code = AuthCode.objects.create(code='57-2048u-xubo-1', status=AuthCode.STATUS_VALID)
+        f = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=f, value=Vote.VOTE_ADDED))
+        rules.add_vote(Vote(field_value=f, author_code=code, value=Vote.VOTE_DOWN))
+        self.assertEqual(self.login(code.code).status_code, 200)
+        f.refresh_from_db()
+        # the vote of the student on their own fact weighs ten times more
+        self.assertEqual(f.votes, -9.9)
+
+
+class AuthCodeCacheTestCase(TestCase):
+    def setUp(self):
+        AuthCode.objects.cache.reset()
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        self.zoe = Student.objects.create(name='Zoe', main_grade=g)
+        self.code = AuthCode.objects.create(code='57-2048u-xubo-1', status=AuthCode.STATUS_VALID,
+                                            owner=self.xu, cross_name='xubo', trust_level=2)
+
+    def test_cached(self):
+        AuthCode.objects.get_by_code(self.code.code)
+        with self.assertNumQueries(0):
+            a = AuthCode.objects.get_by_code(self.code.code)
+        self.assertEqual((a.pk, a.owner_id, a.trust_level, a.status),
+                         (self.code.pk, self.xu.pk, 2, AuthCode.STATUS_VALID))
+        # the other fields are read on access
+        with self.assertNumQueries(1):
+            self.assertEqual(a.cross_name, 'xubo')
+
+    def test_save_invalidates(self):
+        AuthCode.objects.get_by_code(self.code.code)
+        self.code.owner = self.zoe
+        self.code.save()
+        self.assertEqual(AuthCode.objects.get_by_code(self.code.code).owner_id, self.zoe.pk)
+        self.code.delete()
+        self.assertNotEqual(AuthCode.objects.get_by_code(self.code.code).pk, self.code.pk)
+
+    def test_unknown_code(self):
+        a = AuthCode.objects.get_by_code('unknown')
+        self.assertEqual(AuthCode.objects.get_by_code('unknown').pk, a.pk)
+        self.assertEqual(AuthCode.objects.filter(code='unknown').count(), 1)
+
+    @override_settings(AUTH_CODE_CACHE_SIZE=2)
+    def test_lru(self):
+        for code in ('a', self.code.code, 'b'):
+            AuthCode.objects.get_by_code(code)
+        with self.assertNumQueries(0):
+            AuthCode.objects.get_by_code('b')
+        # the least recently used code was dropped
+        with self.assertNumQueries(1):
+            AuthCode.objects.get_by_code('a')
+
+    def test_vote_reads_code_once(self):
+        session = self.client.session
+        session['auth_code'] = self.code.code
+        session.save()
+        facts = [FieldValue.objects.create(target=self.zoe, field_name=FieldValue.FIELD_CITY, field_value=city)
+                 for city in ('Lima', 'Oslo')]
+        with QueryStats() as stats:
+            for f in facts:
+                self.client.post(reverse('field-vote', kwargs={'pk': f.pk, 'vote_type': Vote.VOTE_UP}))
+        code_queries = [q for q in stats.queries if 'FROM "core_authcode" WHERE "core_authcode"."code"' in q['sql']]
+        self.assertEqual(len(code_queries), 1)
+
+
+class IdempotentWritesTestCase(TestCase):
+    def setUp(self):
+        AuthCode.objects.cache.reset()
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        self.code = AuthCode.objects.create(code='57-2048u-xubo-1', status=AuthCode.STATUS_VALID)
+        self.f = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=self.f, value=Vote.VOTE_ADDED))
+        session = self.client.session
+        session['auth_code'] = self.code.code
+        session.save()
+
+    def vote(self, vote_type):
+        return self.client.post(reverse('field-vote', kwargs={'pk': self.f.pk, 'vote_type': vote_type}))
+
+    def test_duplicate_fact(self):
+        f = FieldValue(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        f.save()
+        self.assertIsNone(f.pk)
+        self.assertEqual(FieldValue.objects.filter(target=self.xu).count(), 1)
+
+    def test_duplicate_vote(self):
+        self.assertEqual(self.vote(Vote.VOTE_UP).status_code, 302)
+        self.assertEqual(self.vote(Vote.VOTE_UP).status_code, 406)
+        self.assertEqual(Vote.objects.filter(author_code=self.code).count(), 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            rules.add_vote(Vote(field_value=self.f, author_code=self.code, value=Vote.VOTE_UP))
+        self.f.refresh_from_db()
+        self.assertEqual(self.f.vote_count, 2)
+
+    def test_switch_vote(self):
+        self.vote(Vote.VOTE_UP)
+        self.vote(Vote.VOTE_DOWN)
+        self.assertEqual(list(Vote.objects.filter(author_code=self.code).values_list('value', flat=True)),
+                         [Vote.VOTE_DOWN])
+        self.client.post(reverse('field-vote', kwargs={'pk': self.f.pk, 'vote_type': Vote.VOTE_DOWN})
+                         + '?remove=yes,please')
+        self.assertFalse(Vote.objects.filter(author_code=self.code).exists())
+
+    def test_anonymous_votes(self):
+        rules.add_vote(Vote(field_value=self.f, value=Vote.VOTE_UP))
+        rules.add_vote(Vote(field_value=self.f, value=Vote.VOTE_UP))
+        self.assertEqual(Vote.objects.filter(author_code=None, value=Vote.VOTE_UP).count(), 2)
+
+
+class RevalidateCodesTestCase(TestCase):
+    def setUp(self):
+        g = Grade.objects.create(letter='U', graduation_year='2048')
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        self.a = AuthCode.objects.create(code='57-2048u-xubo-1', status=AuthCode.STATUS_VALID, trust_level=0.5)
+        self.b = AuthCode.objects.create(code='57-2048u-xubo-2', status=AuthCode.STATUS_VALID, owner=self.xu)
+        self.c = AuthCode.objects.create(code='57-2048u-xubo-3', status=AuthCode.STATUS_VALID)
+        self.stub = AuthStubServer({
+            self.a.code: valid_code('Xu Bo', 2048, 'U', 'Xu'),
+            self.b.code: dict(valid_code('Xu Bo', 2048, 'U'), status='disabled',
+                              disabled_at='2026-01-02T03:04:05Z'),
+            self.c.code: valid_code('', 2048, 'U'),
+        }).start()
+        self.settings = override_settings(AUTH_SERVICE_URL=self.stub.url)
+        self.settings.enable()
+        auth_service.client.reset()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.stub.stop()
+        auth_service.client.reset()
+
+    def test_revalidate(self):
+        f = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=f, author_code=self.a, value=Vote.VOTE_ADDED))
+        self.assertEqual(FieldValue.objects.get(pk=f.pk).status, FieldValue.STATUS_UNTRUSTED)
+
+        out = StringIO()
+        call_command('revalidate_codes', batch_size=2, rate=0, stdout=out)
+        self.assertIn('Done: 3 codes, 2 changed, 1 fields recomputed', out.getvalue())
+        a = AuthCode.objects.get(pk=self.a.pk)
+        self.assertEqual((a.owner, a.cross_name), (self.xu, 'Xu'))
+        b = AuthCode.objects.get(pk=self.b.pk)
+        self.assertEqual(b.status, AuthCode.STATUS_REVOKED)
+        self.assertEqual(b.revoked_at.year, 2026)
+        # the vote is an own edit now
+        f = FieldValue.objects.get(pk=f.pk)
+        self.assertEqual((f.status, f.votes), (FieldValue.STATUS_TRUSTED, 5))
+
+    def test_revoked_votes_void(self):
+        f = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=f, value=Vote.VOTE_ADDED))
+        rules.add_vote(Vote(field_value=f, author_code=self.b, value=Vote.VOTE_UP))
+        self.assertEqual(FieldValue.objects.get(pk=f.pk).status, FieldValue.STATUS_TRUSTED)
+        call_command('revalidate_codes', rate=0, stdout=StringIO())
+        # the owner's code is revoked and its upvote weighs nothing
+        f = FieldValue.objects.get(pk=f.pk)
+        self.assertEqual((f.status, f.votes, f.vote_count), (FieldValue.STATUS_UNTRUSTED, 0.1, 2))
+
+    def test_not_found(self):
+        d = AuthCode.objects.create(code='57-2048u-nope-1', status=AuthCode.STATUS_VALID, owner=self.xu)
+        out = StringIO()
+        call_command('revalidate_codes', rate=0, stdout=out)
+        self.assertIn('Done: 4 codes', out.getvalue())
+        d = AuthCode.objects.get(pk=d.pk)
+        self.assertEqual((d.status, d.owner), (AuthCode.STATUS_NONEXISTENT, self.xu))
+
+    def test_resume_and_dry_run(self):
+        out = StringIO()
+        call_command('revalidate_codes', start_id=self.b.pk, dry_run=True, stdout=out)
+        self.assertIn('Done: 2 codes, 1 changed', out.getvalue())
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(AuthCode.objects.get(pk=self.b.pk).status, AuthCode.STATUS_VALID)
+
+
+class ImportDbTestCase(TestCase):
+    def import_db(self, lines):
+        f = tempfile.NamedTemporaryFile(suffix='.tsv')
+        f.write('\n'.join(lines).encode('utf-8'))
+        f.flush()
+        out = StringIO()
+        call_command('import_db', f.name, stdout=out)
+        return out.getvalue()
+
+    def test_import(self):
+        Student.objects.create(name='Xu Bo', main_grade=Grade.objects.create(letter='U', graduation_year=2048))
+        with self.assertNumQueries(13):
+            out = self.import_db([u'Xu Bo\t2048\tU', u'\u041e\u043b\u044f\t2048\tU', u'Zoe\t2049\tA'])
+        self.assertIn('1 grades added, 2 students inserted, 1 updated, 0 unchanged', out)
+        self.assertEqual(Student.objects.filter(import_date__isnull=False).count(), 3)
+        self.assertEqual(list(Student.objects.filter(SearchTerm.objects.students_q([u'\u043e\u043b']))),
+                         [Student.objects.get(name=u'\u041e\u043b\u044f')])
+
+        out = self.import_db([u'Zoe\t2049\tA'])
+        self.assertIn('0 grades added, 0 students inserted, 1 updated, 2 unchanged', out)
+
+
+class ImportAlumniTestCase(TestCase):
+    DATA = {
+        '2048u': {'year': 2048, 'name': u'11 «U»',
+                  'teachers': [{'role': u'Math', 'text': u'Ada'}, {'role': u'Physics', 'text': u'Bob'}],
+                  'pupils': [u'Xu Bo', u'Оля']},
+        '2049a': {'year': 2049, 'name': u'11 «A»', 'teachers': [], 'pupils': [u'Zoe {,}']},
+    }
+
+    def test_iter_classes(self):
+        f = StringIO(json.dumps(self.DATA, ensure_ascii=False, indent=2).encode('utf-8'))
+        self.assertEqual(dict(importing.iter_classes(f, chunk_size=7)), self.DATA)
+        self.assertEqual(list(importing.iter_classes(StringIO('{}'))), [])
+
+    def test_import(self):
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        Student.objects.create(name='Xu Bo', main_grade=g)
+        g.teachers.create(role='Old', content='Teacher', torder=0)
+        f = tempfile.NamedTemporaryFile(suffix='.json')
+        f.write(json.dumps(self.DATA))
+        f.flush()
+        out = StringIO()
+        call_command('import_alumni', f.name, batch_size=1, stdout=out)
+        self.assertIn('Classes: 2, grades added: 1, teachers inserted: 2, updated: 0, deleted: 1, '
+                      'students inserted: 2, updated: 1, unchanged: 0', out.getvalue())
+        self.assertEqual([unicode(t) for t in g.teachers.all()], [u'Math Ada', u'Physics Bob'])
+        self.assertEqual(Student.objects.get(name='Zoe {,}').main_grade.letter, 'A')
+
+    def import_alumni(self, data, **options):
+        f = tempfile.NamedTemporaryFile(suffix='.json')
+        f.write(json.dumps(data))
+        f.flush()
+        out = StringIO()
+        call_command('import_alumni', f.name, stdout=out, **options)
+        return out.getvalue()
+
+    def test_differential(self):
+        self.import_alumni(self.DATA)
+        xu = Student.objects.get(name='Xu Bo')
+        Student.objects.filter(pk=xu.pk).update(import_date=None)
+        Student.objects.create(name='Gone', main_grade=xu.main_grade, import_date=timezone.now())
+        Student.objects.create(name='Added by hand', main_grade=xu.main_grade)
+
+        data = json.loads(json.dumps(self.DATA))
+        data['2048u']['teachers'] = [{'role': u'Math', 'text': u'Ada'}, {'role': u'Chemistry', 'text': u'Cy'},
+                                     {'role': u'Art', 'text': u'Dee'}]
+        data['2049a']['pupils'].append(u'Yan')
+        out = self.import_alumni(data, diff=True, dry_run=True)
+        self.assertIn(u'~ teacher 2048U Physics Bob -> Chemistry Cy', out)
+        self.assertIn(u'+ teacher 2048U Art Dee', out)
+        self.assertIn(u'+ student Yan 2049A', out)
+        self.assertIn(u'? missing Gone 2048U', out)
+        self.assertNotIn(u'Added by hand', out)
+        self.assertIn('Missing from source: 1', out)
+        self.assertFalse(Student.objects.filter(name='Yan').exists())
+        self.assertEqual(Teachers.objects.count(), 2)
+
+        out = self.import_alumni(data, diff=True)
+        self.assertIn('teachers inserted: 1, updated: 1, deleted: 0, students inserted: 1, updated: 0', out)
+        self.assertEqual(Student.objects.get(pk=xu.pk).import_date, None)
+        self.assertEqual(Student.objects.get(name='Yan').main_grade.letter, 'A')
+        self.assertEqual([unicode(t) for t in xu.main_grade.teachers.all()],
+                         [u'Math Ada', u'Chemistry Cy', u'Art Dee'])
+
+        with self.assertNumQueries(6):
+            out = self.import_alumni(data, diff=True, verbosity=0)
+        self.assertIn('teachers inserted: 0, updated: 0, deleted: 0, students inserted: 0', out)
+
+
+@override_settings(PAGE_CACHE_LOCAL=True)
+class PageCacheTestCase(TestCase):
+    def setUp(self):
+        self.u = Grade.objects.create(letter='U', graduation_year=2048)
+        self.a = Grade.objects.create(letter='A', graduation_year=2049)
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=self.u)
+        Student.objects.create(name='Zoe', main_grade=self.a)
+
+    def get(self, **params):
+        return self.client.get(reverse('student-list'), params).getvalue().decode('utf-8')
+
+    # one query is the ETag validator
+    def test_cached(self):
+        self.assertIn('Xu Bo', self.get(year=2048))
+        with self.assertNumQueries(1):
+            self.assertIn('Xu Bo', self.get(year=2048))
+        self.get(year=2049)
+        self.get(char='X')
+
+        Student.objects.create(name='Xi Li', main_grade=self.u)
+        with self.assertNumQueries(1):
+            self.assertIn('Zoe', self.get(year=2049))
+        self.assertIn('Xi Li', self.get(year=2048))
+        self.assertIn('Xi Li', self.get(char='X'))
+
+        f = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=f, value=Vote.VOTE_ADDED))
+        self.assertIn('Lima', self.get(year=2048))
+        with self.assertNumQueries(1):
+            self.get(year=2049)
+
+        self.u.teachers.create(role='Math', content='Ada', torder=0)
+        self.assertIn('Ada', self.get(year=2048))
+
+    def test_local_backend(self):
+        self.get(year=2048)
+        # other processes could not reset the local copy
+        with self.settings(PAGE_CACHE_LOCAL=False):
+            with self.assertNumQueries(4):
+                self.get(year=2048)
+
+    def test_grade_list(self):
+        self.assertIn('<article>', self.client.get(reverse('grade-list')).content)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('grade-list'))
+        Grade.objects.create(letter='B', graduation_year=2050)
+        self.assertIn('2050', self.client.get(reverse('grade-list')).content)
+
+    def test_variants(self):
+        self.get(year=2048)
+        session = self.client.session
+        session['auth_code'] = '57-2048u-xubo-1'
+        session.save()
+        # a logged in session gets its own copy
+        with self.assertNumQueries(5):
+            self.get(year=2048)
+        with self.assertNumQueries(2):
+            self.get(year=2048)
+
+    def test_bulk_writes(self):
+        self.get(year=2048)
+        self.get(year=2049)
+        with importing.run_import() as importer:
+            importer.add_students([(u'Xi Li', 2048, 'U')])
+        self.assertIn('Xi Li', self.get(year=2048))
+        with self.assertNumQueries(1):
+            self.get(year=2049)
+
+        f = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        Vote.objects.create(field_value=f, value=Vote.VOTE_ADDED)
+        self.get(year=2048)
+        call_command('votes', 'update', bulk=True, stdout=StringIO())
+        self.assertIn('Lima', self.get(year=2048))
+
+
+@override_settings(PAGE_CACHE_LOCAL=True)
+class StreamingListTestCase(TestCase):
+    def setUp(self):
+        self.u = Grade.objects.create(letter='U', graduation_year=2048)
+        self.a = Grade.objects.create(letter='A', graduation_year=2048)
+        for i in range(5):
+            Student.objects.create(name='Xu %d' % i, main_grade=self.u)
+            Student.objects.create(name='Xa %d' % i, main_grade=self.a)
+        self.u.teachers.create(role='Math', content='Ada', torder=0)
+
+    def test_chunks(self):
+        StudentListView.stream_chunk = 3
+        self.addCleanup(setattr, StudentListView, 'stream_chunk', 200)
+        response = self.client.get(reverse('student-list'), {'year': 2048})
+        self.assertTrue(response.streaming)
+        content = response.getvalue().decode('utf-8')
+        for i in range(5):
+            self.assertIn('Xu %d' % i, content)
+            self.assertIn('Xa %d' % i, content)
+        # a group split across chunks keeps one header
+        self.assertEqual(content.count('<h1>'), 2)
+        self.assertEqual(content.count('Ada'), 1)
+        self.assertLess(content.index('Xa 4'), content.index('Xu 0'))
+        # the streamed content is cached whole
+        with self.assertNumQueries(1):
+            cached = self.client.get(reverse('student-list'), {'year': 2048})
+        self.assertFalse(cached.streaming)
+        body = lambda html: html[html.index('students-list'):html.index('students-bottom')]
+        self.assertEqual(body(cached.content.decode('utf-8')), body(content))
+
+    def test_insert_while_streaming(self):
+        StudentListView.stream_chunk = 3
+        self.addCleanup(setattr, StudentListView, 'stream_chunk', 200)
+        for i in range(3):
+            Student.objects.create(name='Xe', main_grade=self.u)
+        response = self.client.get(reverse('student-list'), {'char': 'X'})
+        chunks = iter(response.streaming_content)
+        # the page head, the content head and the first group part
+        content = b''.join(next(chunks) for i in range(3))
+        Student.objects.create(name='Xa 00', main_grade=self.u)
+        content = (content + b''.join(chunks)).decode('utf-8')
+        for i in range(5):
+            self.assertEqual(content.count('Xa %d<' % i), 1)
+            self.assertEqual(content.count('Xu %d<' % i), 1)
+        self.assertEqual(content.count('Xe<'), 3)
+
+    def test_empty(self):
+        response = self.client.get(reverse('student-list'), {'char': 'Q'})
+        self.assertIn(u'Пусто.', response.getvalue().decode('utf-8'))
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        self.f = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=self.f, value=Vote.VOTE_ADDED))
+
+    def assertNotModified(self, url, changed=None, **headers):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                    HTTP_IF_MODIFIED_SINCE=response['Last-Modified'], **headers)
+        self.assertEqual(again.status_code, 304)
+        if changed:
+            changed()
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                    HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(again.status_code, 200)
+
+    def vote(self):
+        rules.add_vote(Vote(field_value=self.f, value=Vote.VOTE_UP))
+
+    def test_student(self):
+        self.assertNotModified(reverse('student-detail', args=[self.xu.pk]), self.vote)
+
+    def test_panel(self):
+        self.assertNotModified(reverse('student-panel', args=[self.xu.pk]), self.vote)
+        self.assertNotModified(reverse('student-panels') + '?ids=%d' % self.xu.pk, self.vote)
+        response = self.client.get(reverse('student-panel', args=[self.xu.pk]))
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_list(self):
+        self.assertNotModified(reverse('student-list') + '?year=2048', self.vote)
+
+    def rename(self):
+        self.xu.name = 'Xu Li'
+        self.xu.save()
+
+    def test_rename(self):
+        self.assertNotModified(reverse('student-panel', args=[self.xu.pk]), self.rename)
+        self.assertNotModified(reverse('student-list') + '?char=X', self.rename)
+
+    def test_grade_header(self):
+        grade = self.xu.main_grade
+        url = reverse('student-list') + '?year=2048'
+        self.assertNotModified(url, lambda: Teachers.objects.create(grade=grade, role='Class', content='Zoe', torder=1))
+        self.assertNotModified(url, lambda: Teachers.objects.filter(grade=grade).delete())
+
+        def rename_grade():
+            grade.profile = 'Math'
+            grade.save()
+        self.assertNotModified(url, rename_grade)
+
+    def test_feed(self):
+        self.assertNotModified(reverse('feed'), self.vote)
+        self.assertNotModified(reverse('feed') + '?year=2048')
+        self.assertNotModified(reverse('feed'), self.rename)
+
+        def move_grade():
+            grade = self.xu.main_grade
+            grade.letter = 'V'
+            grade.save()
+        self.assertNotModified(reverse('feed') + '?year=2048', move_grade)
+
+    def test_author_feed(self):
+        code = AuthCode.objects.create(code='57-2048u-xubo-1', status=AuthCode.STATUS_VALID, owner=self.xu)
+        vote = Vote(field_value=self.f, author_code=code, value=Vote.VOTE_UP)
+        rules.add_vote(vote)
+        newer = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_COMPANY, field_value='Lima Inc')
+        rules.add_vote(Vote(field_value=newer, author_code=code, value=Vote.VOTE_ADDED))
+        # the older entry leaves the author feed, the newest one stays
+        self.assertNotModified(reverse('feed') + '?author_id=%d' % self.xu.pk, lambda: rules.remove_vote(vote))
+
+    def test_session(self):
+        url = reverse('student-detail', args=[self.xu.pk])
+        etag = self.client.get(url)['ETag']
+        session = self.client.session
+        session['auth_code'] = '57-2048u-xubo-1'
+        session.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class FeedPaginationTestCase(TestCase):
+    def setUp(self):
+        self.u = Grade.objects.create(letter='U', graduation_year=2048)
+        self.a = Grade.objects.create(letter='A', graduation_year=2049)
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=self.u)
+        self.zoe = Student.objects.create(name='Zoe', main_grade=self.a)
+        now = timezone.now()
+        for i in range(45):
+            f = FieldValue.objects.create(target=i % 3 and self.xu or self.zoe,
+                                          field_name=FieldValue.FIELD_CITY, field_value='City %d' % i)
+            # half of the facts share one status_update_date
+            FieldValue.objects.filter(pk=f.pk).update(
+                status_update_date=now - datetime.timedelta(seconds=i // 2))
+        FeedEntry.objects.update_field_values(FieldValue.objects.values_list('pk', flat=True))
+
+    def walk(self, **params):
+        seen = []
+        url = reverse('feed')
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.context['object_list']
+            self.assertLessEqual(len(page), 20)
+            seen.extend(f.pk for f in page)
+            if 'next_url' not in response.context:
+                break
+            # validator and page, plus the student in the header
+            with self.assertNumQueries('student_id' in params and 3 or 2) as queries:
+                response = self.client.get(url + response.context['next_url'])
+            self.assertNotIn('COUNT', ' '.join(q['sql'] for q in queries.captured_queries))
+        return seen
+
+    def test_pages(self):
+        seen = self.walk()
+        expected = list(FieldValue.objects.order_by('-status_update_date', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_filters(self):
+        self.assertEqual(len(self.walk(year=2048)), 30)
+        self.assertEqual(len(self.walk(grade='2049A')), 15)
+        self.assertEqual(len(self.walk(student_id=self.xu.pk)), 30)
+
+    def test_bad_token(self):
+        self.assertEqual(self.client.get(reverse('feed'), {'after': 'junk'}).status_code, 404)
+
+
+class AuthorFeedTestCase(TestCase):
+    def setUp(self):
+        rnd = random.Random(2048)
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        self.students = [Student.objects.create(name='Student %d' % i, main_grade=g) for i in range(3)]
+        self.codes = [
+            AuthCode.objects.create(status=AuthCode.STATUS_VALID, owner=self.students[i % 3], code=str(i))
+            for i in range(5)
+        ]
+        facts = []
+        for i in range(60):
+            f = FieldValue.objects.create(target=rnd.choice(self.students), field_name=FieldValue.FIELD_CITY,
+                                          field_value='City %d' % i)
+            rules.add_vote(Vote(field_value=f, author_code=rnd.choice(self.codes), value=Vote.VOTE_ADDED))
+            facts.append(f)
+        for i in range(100):
+            votes = list(Vote.objects.exclude(value=Vote.VOTE_ADDED).select_related('author_code'))
+            if votes and rnd.random() < 0.3:
+                rules.remove_vote(rnd.choice(votes))
+            else:
+                ignore_duplicate(rules.add_vote, Vote(
+                    field_value=rnd.choice(facts), author_code=rnd.choice(self.codes),
+                    value=rnd.choice([Vote.VOTE_UP, Vote.VOTE_DOWN, Vote.VOTE_TO_DEL])))
+
+    def expected(self, author):
+        return set(Vote.objects.filter(author_code__owner=author).values_list(
+            'author_code__owner_id', 'field_value_id', 'field_value__status_update_date'))
+
+    def test_activity_follows_votes(self):
+        for s in self.students:
+            self.assertEqual(
+                set(AuthorActivity.objects.filter(author=s).values_list(
+                    'author_id', 'field_value_id', 'status_update_date')),
+                self.expected(s))
+
+    def test_one_write_per_vote(self):
+        f = FieldValue.objects.create(target=self.students[1], field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        # codes 0 and 3 belong to the same student
+        votes = [Vote(field_value=f, author_code=self.codes[i], value=Vote.VOTE_UP) for i in (0, 3)]
+
+        def activity_sql(func, vote):
+            with QueryStats() as stats:
+                func(vote)
+            return [q['sql'].split()[0] for q in stats.queries if 'core_authoractivity' in q['sql']]
+
+        self.assertEqual(activity_sql(rules.add_vote, votes[0]), ['INSERT'])
+        self.assertEqual(activity_sql(rules.add_vote, votes[1]), [])
+        self.assertEqual(activity_sql(rules.remove_vote, votes[0]), [])
+        self.assertEqual(activity_sql(rules.remove_vote, votes[1]), ['DELETE'])
+        self.assertFalse(AuthorActivity.objects.filter(field_value=f).exists())
+
+    def test_rebuild_on_owner_change(self):
+        code = self.codes[0]
+        old_owner, new_owner = code.owner, self.students[1]
+        AuthCode.objects.filter(pk=code.pk).update(owner=new_owner)
+        AuthorActivity.objects.rebuild([old_owner.pk, new_owner.pk])
+        for s in self.students:
+            self.assertEqual(
+                set(AuthorActivity.objects.filter(author=s).values_list(
+                    'author_id', 'field_value_id', 'status_update_date')),
+                self.expected(s))
+
+    def test_feed(self):
+        author = self.students[0]
+        expected = list(FieldValue.objects.filter(
+            vote__author_code__owner=author,
+        ).exclude(status=FieldValue.STATUS_DELETED).distinct().order_by(
+            '-status_update_date', '-id').values_list('pk', flat=True))
+        url = reverse('feed')
+        seen = []
+        response = self.client.get(url, {'author_id': author.pk})
+        while True:
+            seen.extend(f.pk for f in response.context['object_list'])
+            if 'next_url' not in response.context:
+                break
+            # validator, page, voters and the author in the header
+            with self.assertNumQueries(4) as queries:
+                response = self.client.get(url + response.context['next_url'])
+            sql = queries.captured_queries[1]['sql']
+            self.assertIn('core_authoractivity', sql)
+            self.assertNotIn('core_vote', sql)
+        self.assertEqual(seen, expected)
+        # more than one page
+        self.assertGreater(len(expected), 20)
+
+
+class FeedEntryTestCase(TestCase):
+    def setUp(self):
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        self.zoe = Student.objects.create(name='Zoe', main_grade=g)
+        self.code = AuthCode.objects.create(code='57-2048u-zoe-1', status=AuthCode.STATUS_VALID, owner=self.zoe)
+        self.f = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        rules.add_vote(Vote(field_value=self.f, value=Vote.VOTE_ADDED))
+
+    def test_follows_votes(self):
+        rules.add_vote(Vote(field_value=self.f, author_code=self.code, value=Vote.VOTE_UP))
+        rules.add_vote(Vote(field_value=self.f, value=Vote.VOTE_DOWN))
+        entry = FeedEntry.objects.get(pk=self.f.pk)
+        self.assertEqual(entry.voter_ids, {Vote.VOTE_UP: [self.zoe.pk], Vote.VOTE_DOWN: [None]})
+        self.assertEqual(entry.vote_count, 3)
+
+        session = self.client.session
+        session['auth_code'] = self.code.code
+        session.save()
+        response = self.client.get(reverse('feed'))
+        item = response.context['object_list'][0]
+        self.assertEqual(item.votes_up, [self.zoe])
+        self.assertEqual(item.votes_down, [None])
+        self.assertTrue(item.upvoted)
+
+        rules.remove_vote(Vote.objects.get(author_code=self.code))
+        self.assertEqual(FeedEntry.objects.get(pk=self.f.pk).voter_ids[Vote.VOTE_UP], [])
+
+    def test_vote_updates_in_place(self):
+        with QueryStats() as stats:
+            rules.add_vote(Vote(field_value=self.f, author_code=self.code, value=Vote.VOTE_UP))
+        feed_sql = [q['sql'] for q in stats.queries if 'core_feedentry' in q['sql']]
+        self.assertEqual(len(feed_sql), 1)
+        self.assertTrue(feed_sql[0].startswith('UPDATE'))
+        entry = FeedEntry.objects.get(pk=self.f.pk)
+        self.assertEqual(entry.vote_count, 2)
+        self.assertEqual(entry.voter_ids[Vote.VOTE_UP], [self.zoe.pk])
+
+    def test_follows_student(self):
+        self.xu.name = 'Xu Bo-Lee'
+        self.xu.save()
+        self.assertEqual(FeedEntry.objects.get(pk=self.f.pk).target_name, 'Xu Bo-Lee')
+        FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_EMAIL, field_value='xu@example.com')
+        self.assertEqual(FeedEntry.objects.count(), 1)
+
+
+@override_settings(PAGE_CACHE_LOCAL=True)
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    # url name: [(method, url kwargs, params, logged in, query budget)].
+    # Page caches are warm for GET requests
+    BUDGETS = {
+        'grade-list': [('get', {}, {}, False, 0)],
+        'alphabet-list': [('get', {}, {}, False, 0)],
+        'api-login': [('get', {}, {}, True, 1)],
+        'suggest-list': [('get', {}, {'query': 'Xu'}, False, 0)],
+        'student-list': [
+            ('get', {}, {'query': 'Xu'}, False, 4),
+            ('get', {}, {'year': 2048}, False, 1),
+            ('get', {}, {'char': 'X'}, False, 1),
+            ('get', {}, {}, True, 5),
+        ],
+        'student-detail': [('get', {'pk': 'xu'}, {}, False, 4), ('get', {'pk': 'xu'}, {}, True, 6)],
+        'student-panel': [('get', {'pk': 'xu'}, {}, False, 4), ('get', {'pk': 'xu'}, {}, True, 6)],
+        'student-panels': [('get', {}, {'ids': 'xu,zoe'}, False, 3), ('get', {}, {'ids': 'xu,zoe'}, True, 5)],
+        'student-create': [('post', {}, {'name': 'Xu New', 'graduation_year': 2048, 'grade_letter': 'U'}, True, 12)],
+        'grade-student-create': [('get', {'grade_id': 'grade'}, {}, True, 2)],
+        'student-value-create': [
+            ('post', {'pk': 'xu'}, {'field_name': FieldValue.FIELD_CITY, 'field_value': 'Lima'}, True, 9),
+        ],
+        'field-vote': [('post', {'pk': 'fact', 'vote_type': 'downvoted'}, {}, True, 8)],
+        'field-sendmail': [('post', {'pk': 'email'}, {'subject': 'Hi', 'message': 'Hi'}, False, 3)],
+        'qa': [('get', {}, {}, False, 0)],
+        'feed': [('get', {}, {}, False, 3), ('get', {}, {'author_id': 'zoe'}, True, 6)],
+    }
+
+    def setUp(self):
+        self.grade = Grade.objects.create(letter='U', graduation_year=2048)
+        students = [Student.objects.create(name='Xu %d' % i, main_grade=self.grade) for i in range(10)]
+        self.xu, self.zoe = students[:2]
+        codes = [AuthCode.objects.create(code='57-2048u-xu-%d' % i, status=AuthCode.STATUS_VALID, owner=s)
+                 for i, s in enumerate(students)]
+        for s in students:
+            for i in range(3):
+                f = FieldValue.objects.create(target=s, field_name=FieldValue.FIELD_CITY, field_value='City %d' % i)
+                rules.add_vote(Vote(field_value=f, author_code=codes[i], value=Vote.VOTE_ADDED))
+                rules.add_vote(Vote(field_value=f, author_code=codes[i + 3], value=Vote.VOTE_UP))
+        self.fact = f
+        self.email = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_EMAIL,
+                                               field_value='xu@example.com')
+        self.code = codes[1]
+
+    def resolve(self, kwargs):
+        objects = {'xu': self.xu.pk, 'zoe': self.zoe.pk, 'grade': self.grade.pk, 'fact': self.fact.pk,
+                   'email': self.email.pk, 'xu,zoe': '%d,%d' % (self.xu.pk, self.zoe.pk)}
+        return {k: objects.get(v, v) for k, v in kwargs.items()}
+
+    def test_every_url_has_budget(self):
+        self.assertEqual(set(p.name for p in urls.urlpatterns), set(self.BUDGETS))
+
+    @override_settings(EMAIL_FROM='noreply@example.com')
+    def test_budgets(self):
+        for name, cases in sorted(self.BUDGETS.items()):
+            for method, kwargs, params, logged_in, budget in cases:
+                self.client.logout()
+                if logged_in:
+                    session = self.client.session
+                    session['auth_code'] = self.code.code
+                    session.save()
+                url = reverse(name, kwargs=self.resolve(kwargs))
+                params = self.resolve(params)
+                if method == 'get':
+                    self.client.get(url, params).getvalue()  # warm the caches
+                with self.assertQueryBudget(budget, '%s %s %s' % (method, url, params)):
+                    response = getattr(self.client, method)(url, params)
+                    response.getvalue()
+                self.assertLess(response.status_code, 400, url)
+
+    def test_stats(self):
+        with QueryStats() as stats:
+            list(Student.objects.filter(pk=1))
+            list(Student.objects.filter(pk=2))
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(stats.repeated(), [(fingerprint(stats.queries[0]['sql']), 2)])
+
+    @override_settings(QUERY_STATS=True, QUERY_STATS_LOG_SLOWER=60)
+    def test_header(self):
+        response = self.client.get(reverse('feed'))
+        self.assertRegexpMatches(response['X-Query-Stats'], r'^queries=\d+; db=')
+
+
+class BenchmarkTestCase(TestCase):
+    def test_generate_and_run(self):
+        sizes = ['--grades', '3', '--students', '30', '--facts', '90', '--votes', '300']
+        call_command('benchmark', 'generate', *sizes, stdout=StringIO())
+        self.assertEqual(Student.objects.count(), 30)
+        self.assertEqual(Vote.objects.count(), 300)
+        self.assertEqual(FeedEntry.objects.count(), 90)
+        self.assertRaises(CommandError, call_command, 'benchmark', 'generate', *sizes, stdout=StringIO())
+
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        call_command('benchmark', 'run', '--only', 'feed,vote,import-db', '--repeat', '2',
+                     '--output', output.name, stdout=StringIO(), stderr=StringIO())
+        data = json.load(open(output.name))
+        self.assertEqual(data['counts']['votes'], 300)
+        self.assertEqual(set(data['scenarios']), {'feed', 'vote', 'import-db'})
+        self.assertGreater(data['scenarios']['feed']['queries'], 0)
+        # writes are rolled back
+        self.assertEqual(Vote.objects.count(), 300)
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        for i in range(20):
+            FieldValue.objects.create(target=xu, field_name=FieldValue.FIELD_CITY, field_value='City %d' % i)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def files(self):
+        return sorted(os.listdir(self.dir))
+
+    def test_token(self):
+        with self.settings(PROFILE_DIR=self.dir, PROFILE_SAMPLE_RATE=0):
+            self.client.get(reverse('feed'), HTTP_X_PROFILE='junk')
+            self.assertEqual(self.files(), [])
+            self.client.get(reverse('feed'), HTTP_X_PROFILE=profiling.make_token())
+            self.assertEqual(len(self.files()), 1)
+            self.assertTrue(self.files()[0].startswith('feed-'))
+
+    def test_report(self):
+        with self.settings(PROFILE_DIR=self.dir, PROFILE_SAMPLE_RATE=1, PROFILE_INTERVAL=0.0005):
+            for i in range(3):
+                self.client.get(reverse('feed'))
+        with self.settings(PROFILE_DIR=self.dir, PROFILE_SAMPLE_RATE=1, PROFILE_ENGINE='cprofile'):
+            self.client.get(reverse('student-list'), {'year': 2048})
+        out, merged = StringIO(), os.path.join(self.dir, 'merged.txt')
+        call_command('profiles', 'report', '--dir', self.dir, '--output', merged, stdout=out)
+        self.assertIn('feed: 3 requests', out.getvalue())
+        self.assertIn('student-list: 1 requests', out.getvalue())
+        self.assertIn('orm ', out.getvalue())
+        for line in open(merged):
+            self.assertRegexpMatches(line, r'^feed;\S.* \d+$')
+
+    def test_rotate(self):
+        for i in range(5):
+            with open(os.path.join(self.dir, 'feed-%d-1.prof' % i), 'w') as f:
+                f.write('x' * 100)
+            os.utime(os.path.join(self.dir, 'feed-%d-1.prof' % i), (i, i))
+        profiling.rotate(self.dir, 250)
+        self.assertEqual(self.files(), ['feed-3-1.prof', 'feed-4-1.prof'])
+
+
+class UserVoteStateTestCase(TestCase):
+    def setUp(self):
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        self.code = AuthCode.objects.create(code='57-2048u-xubo-1', status=AuthCode.STATUS_VALID, owner=self.xu)
+        self.lima = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        self.oslo = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Oslo')
+        rules.add_vote(Vote(field_value=self.lima, author_code=self.code, value=Vote.VOTE_ADDED))
+        rules.add_vote(Vote(field_value=self.oslo, author_code=self.code, value=Vote.VOTE_DOWN))
+        session = self.client.session
+        session['auth_code'] = self.code.code
+        session.save()
+
+    def get(self):
+        response = self.client.get(reverse('student-detail', args=[self.xu.pk]))
+        return {f.field_value: f for f in response.context['grouped_modifications'][FieldValue.FIELD_CITY]}
+
+    def test_state(self):
+        facts = self.get()
+        self.assertTrue(facts['Lima'].is_owned)
+        self.assertTrue(facts['Oslo'].downvoted)
+        self.assertFalse(getattr(facts['Oslo'], 'upvoted', False))
+
+    def test_queries_do_not_grow_with_votes(self):
+        with QueryStats() as before:
+            self.get()
+        for i in range(30):
+            other = AuthCode.objects.create(code='other-%d' % i, status=AuthCode.STATUS_VALID)
+            rules.add_vote(Vote(field_value=self.oslo, author_code=other, value=Vote.VOTE_UP))
+        with QueryStats() as after:
+            self.get()
+        self.assertEqual(before.count, after.count)
+
+
+class StudentPanelTestCase(TestCase):
+    def setUp(self):
+        g = Grade.objects.create(letter='U', graduation_year=2048)
+        self.xu = Student.objects.create(name='Xu Bo', main_grade=g)
+        self.zoe = Student.objects.create(name='Zoe', main_grade=g)
+        self.code = AuthCode.objects.create(code='57-2048u-xubo-1', status=AuthCode.STATUS_VALID, owner=self.xu)
+        self.lima = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_CITY, field_value='Lima')
+        self.oslo = FieldValue.objects.create(target=self.zoe, field_name=FieldValue.FIELD_CITY, field_value='Oslo')
+        rules.add_vote(Vote(field_value=self.oslo, author_code=self.code, value=Vote.VOTE_UP))
+        session = self.client.session
+        session['auth_code'] = self.code.code
+        session.save()
+
+    def test_fragment(self):
+        response = self.client.get(reverse('student-panel', args=[self.xu.pk]))
+        self.assertContains(response, 'Lima')
+        self.assertNotContains(response, '<html')
+        self.assertLess(len(response.content), len(self.client.get(reverse('student-detail', args=[self.xu.pk])).content))
+
+    def test_batch(self):
+        ids = '%d,%d,%d' % (self.xu.pk, self.zoe.pk, self.zoe.pk + 100)
+        panels = json.loads(self.client.get(reverse('student-panels'), {'ids': ids}).content)
+        self.assertEqual(set(panels), {str(self.xu.pk), str(self.zoe.pk)})
+        self.assertIn('Lima', panels[str(self.xu.pk)])
+        self.assertNotIn('Oslo', panels[str(self.xu.pk)])
+        # the session's upvote is marked as in the single panel
+        single = self.client.get(reverse('student-panel', args=[self.zoe.pk])).content.decode('utf-8')
+        self.assertEqual(panels[str(self.zoe.pk)].count('active'), single.count('active'))
+        self.assertIn('active', single)
+
+    def test_vote_returns_panel(self):
+        url = reverse('field-vote', kwargs={'pk': self.lima.pk, 'vote_type': Vote.VOTE_DOWN})
+        response = self.client.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertRedirects(response, reverse('student-panel', args=[self.xu.pk]))
+        # a plain form submit gets the whole page
+        response = self.client.post(url + '?remove=yes,please')
+        self.assertRedirects(response, reverse('student-detail', args=[self.xu.pk]))
+
+    @override_settings(EMAIL_FROM='noreply@example.com')
+    def test_sendmail_from_page(self):
+        email = FieldValue.objects.create(target=self.xu, field_name=FieldValue.FIELD_EMAIL,
+                                          field_value='xu@example.com')
+        url = reverse('field-sendmail', args=[email.pk])
+        response = self.client.post(url, {'subject': 'Hi', 'message': 'Hi'})
+        self.assertRedirects(response, reverse('student-detail', args=[self.xu.pk]))
+        response = self.client.post(url, {'subject': 'Hi', 'message': 'Hi'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertRedirects(response, reverse('student-panel', args=[self.xu.pk]))
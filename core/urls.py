@@ -5,6 +5,8 @@ from .views import (
     StudentListView,
     SuggestListView,
     StudentDetailView,
+    StudentPanelView,
+    StudentPanelsView,
     StudentCreateView,
     FieldValueCreateView,
     handle_vote,
@@ -23,6 +25,10 @@ urlpatterns = [
     url(r'^students/$', StudentListView.as_view(), name='student-list'),
     url(r'^students/(?P<pk>[0-9]+)/$', StudentDetailView.as_view(),
         name='student-detail'),
+    url(r'^students/(?P<pk>[0-9]+)/panel/$', StudentPanelView.as_view(),
+        name='student-panel'),
+    url(r'^students/panels/$', StudentPanelsView.as_view(),
+        name='student-panels'),
     url(r'^students/add/$', StudentCreateView.as_view(),
         name='student-create'),
     url(r'^(?P<grade_id>[0-9]+)/students/add/$', StudentCreateView.as_view(),
@@ -0,0 +1,25 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.db.models import Case, Value, When
+
+
+def bulk_update(objs, fields, batch_size=500):
+    """
+    Записывает поля объектов одной модели пачками, по одному
+    UPDATE ... SET field = CASE id WHEN ... на пачку
+    """
+    objs = list(objs)
+    if not objs:
+        return
+    model = type(objs[0])
+    for i in range(0, len(objs), batch_size):
+        batch = objs[i:i + batch_size]
+        values = {}
+        for name in fields:
+            field = model._meta.get_field(name)
+            values[name] = Case(*[
+                When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field))
+                for obj in batch
+            ], output_field=field)
+        model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**values)
@@ -1,16 +1,16 @@
 # coding=utf-8
 from __future__ import unicode_literals
+import datetime
 import itertools
-import operator
 import re
-import requests
 
 from django.conf import settings
 from django.core.mail import send_mail
-from django.db.models import Q
-from django.http import JsonResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateTimeField, IntegerField, Max, Q
+from django.http import JsonResponse, StreamingHttpResponse
 from django.template.loader import render_to_string
-from django.views.generic import TemplateView
+from django.views.generic import TemplateView, View
 from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView
@@ -18,24 +18,34 @@ from django.http import \
     Http404, HttpResponseRedirect, HttpResponse, HttpResponseBadRequest
 from django.urls import reverse
 from django.shortcuts import get_object_or_404
-
-from core import rules
-from .models import Grade, Student, FieldValue, AuthCode, Vote
+from django.utils.cache import patch_cache_control
+from django.utils.encoding import force_text
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.safestring import mark_safe
+from django.utils.timezone import utc
+
+from core import auth_service, canonical, rules, suggest
+from core.page_cache import (
+    CachedContentMixin, ConditionalMixin, GRADES, grade_scope, year_scope, char_scope, get_cache, latest,
+    subquery,
+)
+from .models import Grade, Student, FieldValue, FeedEntry, AuthCode, AuthorActivity, Vote, SearchTerm, Teachers
 from .forms import StudentCreateForm, FieldValueForm, SendMailForm
 
 
 re_search = re.compile(r'\w{2,}', re.U)
 
+# Место в шаблоне, куда выводятся группы списка при выводе по частям
+STREAM_MARKER = mark_safe('<!--student-groups-->')
+
 
 def get_data(auth_code):
     """ Метод получающий данные из сервиса авторизации"""
-    r = requests.post("http://auth.alumni57.ru/api/v1/check_code", data={'code': auth_code})
-    data = r.json()
-    if data['status'] == 'ok':
-        data['status'] = 'valid'
-    if data['status'] == 'disabled' or data['status'] == 'banned':
-        data['status'] = 'revoked'
-    return data
+    try:
+        return auth_service.client.check_code(auth_code)
+    except auth_service.AuthServiceUnavailable:
+        # Сервис недоступен или тормозит: верим последнему известному статусу
+        return auth_service.known_data(auth_code)
 
 
 def escape_code(code):
@@ -53,23 +63,17 @@ def auth_code_login(request):
         request.session['display_code'] = escape_code(auth_code)
         if auth_code:  # иначе анонимус
             data = get_data(auth_code)
+            if data is None:
+                del request.session['auth_code']
+                del request.session['display_code']
+                return HttpResponse(status=503)
             if data['status'] != 'valid':
                 del request.session['auth_code']
                 del request.session['display_code']
                 if data['status'] == 'not_found':
                     return HttpResponse(status=404)
                 return HttpResponse(status=403)
-            g = Grade.objects.filter(
-                graduation_year=data['year'],
-                letter=data['letter'],
-            ).first()
-            if g:
-                s = Student.objects.filter(
-                    name=data['full_name'],
-                    main_grade_id=g.pk,
-                ).first()
-            else:
-                s = None
+            s = auth_service.find_owner(data)
             defaults = {
                 'owner': s,
                 'cross_name': data['cross_name'],
@@ -81,12 +85,18 @@ def auth_code_login(request):
             a, created = AuthCode.objects.get_or_create(
                 code=auth_code, defaults=defaults)
             if not created:
+                old_owner_id = a.owner_id
                 a.status = data['status']
                 a.cross_name = data['cross_name']
                 a.revoked_at = data['disabled_at']
                 if s:
                     a.owner_id = s.pk
                 a.save()
+                if a.owner_id != old_owner_id:
+                    AuthorActivity.objects.rebuild([old_owner_id, a.owner_id])
+                    # Голоса за свои правки весят больше, пересчет заодно
+                    # обновляет ленту этих правок
+                    rules.update_code_votes([a.pk])
             if s:
                 request.session['student_id'] = s.pk
         elif 'student_id' in request.session:
@@ -97,8 +107,12 @@ def auth_code_login(request):
     return HttpResponse(status=403)
 
 
-class AlphabetView(TemplateView):
+class AlphabetView(CachedContentMixin, TemplateView):
     template_name = 'core/alphabet.jade'
+    content_template_name = 'include/alphabet_content.jade'
+
+    def get_cache_scopes(self):
+        return []
 
     def get_context_data(self, **kwargs):
         data = super(AlphabetView, self).get_context_data(**kwargs)
@@ -106,9 +120,13 @@ class AlphabetView(TemplateView):
         return data
 
 
-class GradeListView(ListView):
+class GradeListView(CachedContentMixin, ListView):
     model = Grade
     template_name = 'core/grade_list.jade'
+    content_template_name = 'include/grade_list_content.jade'
+
+    def get_cache_scopes(self):
+        return [GRADES]
 
     def get_context_data(self, **kwargs):
         data = super(GradeListView, self).get_context_data(**kwargs)
@@ -120,18 +138,24 @@ class GradeListView(ListView):
         return data
 
 
-class BaseStudentListView(ListView):
+class StudentListView(ConditionalMixin, CachedContentMixin, ListView):
     model = Student
-
-    def get_queryset(self):
-        qs = super(BaseStudentListView, self).get_queryset()
-        qs = qs.prefetch_related('modifications')
-        return qs
-
-
-class StudentListView(BaseStudentListView):
     template_name = 'core/student_list.jade'
+    content_template_name = 'include/student_list_content.jade'
     paginate_by = 100
+    stream_chunk = 200
+
+    def get_cache_scopes(self):
+        if self.request.GET.get('query'):
+            return None
+        elif self.char:
+            # В списке по букве выводятся названия классов
+            return [char_scope(self.char), GRADES]
+        elif self.grade_id:
+            return [grade_scope(self.grade_id)]
+        elif self.year:
+            return [year_scope(self.year)]
+        return None
 
     def get_paginate_by(self, queryset):
         if self.year:
@@ -150,34 +174,52 @@ class StudentListView(BaseStudentListView):
         self.char = self.request.GET.get('char')
         return super(StudentListView, self).get(request, *args, **kwargs)
 
+    def filter_scope(self, qs):
+        if self.char:
+            return qs.filter(name__startswith=self.char)
+        elif self.grade_id:
+            return qs.filter(main_grade_id=self.grade_id)
+        elif self.year:
+            return qs.filter(main_grade__graduation_year=self.year)
+        return qs
+
+    def get_validator(self):
+        if self.request.GET.get('query') or not (self.char or self.grade_id or self.year):
+            return None
+        # Правки, классы и учителя — подзапросами по своим таблицам:
+        # соединение выпускников с правками и учителями перебирало бы их
+        # произведение. Классы и учителя выводятся в заголовках групп
+        students = self.filter_scope(Student.objects.all())
+        facts = FieldValue.objects.filter(target__in=students.values('pk'))
+        grades = Grade.objects.filter(pk__in=students.values('main_grade'))
+        teachers = Teachers.objects.filter(grade__in=students.values('main_grade'))
+        data = students.aggregate(
+            students=Count('id'),
+            updated_at=Max('updated_at'),
+            import_date=Max('import_date'),
+            fact_updated_at=subquery(facts, 'MAX', 'updated_at', DateTimeField()),
+            grade_updated_at=subquery(grades, 'MAX', 'updated_at', DateTimeField()),
+            teachers_updated_at=subquery(teachers, 'MAX', 'updated_at', DateTimeField()),
+            teachers=subquery(teachers, 'COUNT', 'id', IntegerField()),
+        )
+        return latest(
+            data['updated_at'], data['import_date'], data['fact_updated_at'],
+            data['grade_updated_at'], data['teachers_updated_at'],
+        ), (data['students'], data['teachers'])
+
     def get_queryset(self):
         qs = super(StudentListView, self).get_queryset()
         query = self.request.GET.get('query')
         if query:
-            qfv = []
-            qname = []
-            for i in re_search.findall(query):
-                qfv.append(
-                    Q(modifications__field_value__icontains=i) &
-                    ~Q(modifications__status=FieldValue.STATUS_DELETED) &
-                    ~Q(modifications__field_name=FieldValue.FIELD_EMAIL)
-                )
-                qname.append(Q(name__icontains=i))
-            if qfv and qname:
-                qs = qs.filter(
-                    reduce(operator.and_, qfv) | reduce(operator.and_, qname)
-                )
-            qs = qs.distinct()
-        elif self.char:
-            qs = qs.filter(name__startswith=self.char)
-        elif self.grade_id:
-            qs = qs.filter(main_grade_id=self.grade_id)
-        elif self.year:
-            qs = qs.filter(main_grade__graduation_year=self.year)
+            words = re_search.findall(query)
+            if words:
+                qs = qs.filter(SearchTerm.objects.students_q(words))
+        else:
+            qs = self.filter_scope(qs)
         if query or self.year:
-            qs = qs.order_by('-main_grade__graduation_year', 'main_grade__letter', 'name')
+            qs = qs.order_by('-main_grade__graduation_year', 'main_grade__letter', 'name', 'pk')
         else:
-            qs = qs.order_by('name')
+            qs = qs.order_by('name', 'pk')
         return qs.prefetch_related('main_grade', 'main_grade__teachers')
 
     def get_context_data(self, **kwargs):
@@ -188,119 +230,248 @@ class StudentListView(BaseStudentListView):
             context_data['show_teachers'] = True
         context_data['year'] = self.year
         context_data['char'] = self.char
-        res = []
-        qs = context_data['object_list']
         if self.char:
-            for g, i in itertools.groupby(qs, key=lambda x: x.name[0]):
-                l = list(i)
-                res.append(('Буква ' + g.upper(), l))
             context_data['show_grade'] = True
-        else:
-            for g, i in itertools.groupby(qs, key=lambda s: s.main_grade.pk):
-                l = list(i)
-                g = l[0].main_grade
-                res.append((g, l))
-        context_data['object_list'] = res
+        if context_data['paginator'] is None and not self.request.GET.get('query'):
+            # Список без страниц выводится по частям, см. stream_content
+            context_data['stream_marker'] = STREAM_MARKER
+            return context_data
+        context_data['object_list'] = [
+            (group, list(students)) for group, students, continued
+            in self.iter_groups(context_data['object_list'])
+        ]
         return context_data
 
+    def iter_groups(self, students, size=None):
+        """
+        (группа, студенты, продолжение ли группы): по первой букве имени
+        или по классу. С size группа делится на части не больше size
+        """
+        if self.char:
+            key = lambda s: 'Буква ' + s.name[0].upper()
+        else:
+            key = lambda s: s.main_grade
+        for group, group_students in itertools.groupby(students, key=key):
+            continued = False
+            while True:
+                part = list(itertools.islice(group_students, size))
+                if not part:
+                    break
+                yield group, part, continued
+                continued = True
+
+    def after_condition(self, ordering, student):
+        """
+        Студенты после student в порядке ordering (поля order_by, '-' —
+        по убыванию): (a > x) | (a = x, b > y) | ...
+        """
+        condition, equal = Q(), {}
+        for field in ordering:
+            name = field.lstrip('-')
+            value = student
+            for attr in name.split('__'):
+                value = getattr(value, attr)
+            lookup = name + (field.startswith('-') and '__lt' or '__gt')
+            condition |= Q(**dict(equal, **{lookup: value}))
+            equal[name] = value
+        return condition
+
+    def iter_students(self, queryset):
+        """
+        Студенты списка частями по stream_chunk, связанные объекты
+        загружаются для каждой части отдельно. Часть начинается после
+        последнего студента предыдущей по ключу сортировки, а не по
+        OFFSET: чтение не дорожает к концу списка, а вставка посреди
+        вывода не сдвигает части
+        """
+        ordering = queryset.query.order_by
+        students = list(queryset[:self.stream_chunk])
+        while students:
+            for student in students:
+                yield student
+            if len(students) < self.stream_chunk:
+                break
+            students = list(queryset.filter(
+                self.after_condition(ordering, students[-1]))[:self.stream_chunk])
+
+    def stream_content(self, context):
+        """
+        Блок content по частям: начало, группы по stream_chunk студентов,
+        конец. Собранный блок попадает в кэш, как у CachedContentMixin
+        """
+        head, tail = render_to_string(self.content_template_name, context, self.request).split(STREAM_MARKER)
+        parts = [head]
+        yield head
+        for group, students, continued in self.iter_groups(
+                self.iter_students(context['object_list']), self.stream_chunk):
+            part = render_to_string('include/student_group.jade', dict(
+                context, group=group, students=students, continued=continued), self.request)
+            parts.append(part)
+            yield part
+        if len(parts) == 1:
+            part = '<p>Пусто.</p>'
+            parts.append(part)
+            yield part
+        parts.append(tail)
+        yield tail
+        if self.cache_key:
+            get_cache().set(self.cache_key, mark_safe(''.join(parts)), settings.PAGE_CACHE_TIMEOUT)
 
-class SuggestListView(ListView):
-    model = FieldValue
-
-    def get_queryset(self):
-        query = self.request.GET.get('query', '')
-        self.query = re_search.findall(query)
-
-        qs = super(SuggestListView, self).get_queryset()
+    def render_to_response(self, context, **response_kwargs):
+        if 'stream_marker' not in context:
+            return super(StudentListView, self).render_to_response(context, **response_kwargs)
+        page_head, page_tail = render_to_string(self.template_name, dict(
+            context, content=STREAM_MARKER), self.request).split(STREAM_MARKER)
+        return StreamingHttpResponse(
+            itertools.chain([page_head], self.stream_content(context), [page_tail]))
 
-        if self.query:
-            qu = [
-                ~Q(status=FieldValue.STATUS_DELETED),
-                ~Q(field_name=FieldValue.FIELD_EMAIL),
-                ~Q(field_name=FieldValue.FIELD_SOCIAL_FB),
-                ~Q(field_name=FieldValue.FIELD_SOCIAL_VK),
-            ]
 
-            for q in self.query:
-                qu.append(Q(field_value__icontains=q))
+class SuggestListView(View):
+    limit = 30
 
-            qu = reduce(operator.and_, qu)
+    def get(self, request, *args, **kwargs):
+        query = re_search.findall(request.GET.get('query', ''))
+        data = []
+        if query:
+            data = suggest.index.suggest(
+                query, self.limit,
+                students=request.GET.get('students') in ('1', 'true'),
+            )
+        return JsonResponse({
+            'data': data,
+        })
 
-            qs = qs.filter(qu) \
-                .values_list('field_value', flat=True) \
-                .distinct()
-        else:
-            qs = qs.none()
 
-        return qs
-
-    def render_to_response(self, context, **response_kwargs):
-        if self.query:
-            data = list(context['object_list'])
-        else:
-            data = []
+# Пометки правок по голосам текущего кода
+USER_VOTE_FLAGS = {
+    Vote.VOTE_ADDED: 'is_owned',
+    Vote.VOTE_UP: 'upvoted',
+    Vote.VOTE_DOWN: 'downvoted',
+    Vote.VOTE_TO_DEL: 'deleted',
+}
+
+
+def add_user_actions(request, facts):
+    """
+    Отмечает правки (или записи ленты), за которые голосовал код сессии
+    """
+    state = Vote.objects.user_state(request.session.get('auth_code'), [f.pk for f in facts])
+    for fact in facts:
+        for value in state.get(fact.pk, ()):
+            setattr(fact, USER_VOTE_FLAGS[value], True)
+
+
+def group_facts(facts):
+    """
+    Правки студента по полям, в поле — сначала проверенные и с большим
+    числом голосов
+    """
+    order = [i[0] for i in FieldValue.STATUS_CHOICES]
+    key = lambda x: (order.index(x.status), -x.votes)
+    return dict(
+        (field_name, sorted(field_values, key=key))
+        for field_name, field_values
+        in itertools.groupby(facts, lambda modification: modification.field_name)
+    )
 
-        if self.query and self.request.GET.get('students') in ('1', 'true'):
-            qu = []
 
-            for q in self.query:
-                qu.append(Q(name__icontains=q))
+def panel_validator(student_ids):
+    data = Student.objects.filter(pk__in=student_ids).aggregate(
+        student_updated_at=Max('updated_at'),
+        import_date=Max('import_date'),
+        fact_updated_at=Max('modifications__updated_at'),
+        grade_updated_at=Max('main_grade__updated_at'),
+        facts=Count('modifications'),
+    )
+    if not data['student_updated_at']:
+        return None
+    return latest(
+        data['student_updated_at'], data['import_date'], data['fact_updated_at'], data['grade_updated_at'],
+    ), data['facts']
 
-            qu = reduce(operator.and_, qu)
 
-            qs = Student.objects.filter(qu) \
-                .values_list('name', flat=True) \
-                .distinct()[:30]
+class PanelCacheMixin(object):
+    """
+    Карточку кэширует только браузер и каждый раз сверяет ETag: после
+    голоса она должна обновиться сразу
+    """
 
-            data = list(qs) + data
-        return JsonResponse({
-            'data': data,
-        })
+    def get(self, request, *args, **kwargs):
+        response = super(PanelCacheMixin, self).get(request, *args, **kwargs)
+        patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+        return response
 
 
-class StudentDetailView(DetailView):
+class StudentDetailView(ConditionalMixin, DetailView):
     template_name = 'core/student_detail.jade'
     model = Student
 
-    def add_user_actions(self, fact):
-        code = self.request.session.get('auth_code')
-        if not code:
-            return fact
-        for vote in fact.vote_set.all():
-            if vote.author_code and vote.author_code.code == code:
-                if vote.value == Vote.VOTE_ADDED:
-                    fact.is_owned = True
-                elif vote.value == Vote.VOTE_UP:
-                    fact.upvoted = True
-                elif vote.value == Vote.VOTE_DOWN:
-                    fact.downvoted = True
-                elif vote.value == Vote.VOTE_TO_DEL:
-                    fact.deleted = True
-        return fact
+    def get_validator(self):
+        return panel_validator([self.kwargs['pk']])
 
     def get_context_data(self, **kwargs):
         context_data = super(StudentDetailView, self).get_context_data(**kwargs)
 
-        grouped_modifications_iterator = itertools.groupby(
-            self.object.modifications
-                .exclude(status=FieldValue.STATUS_DELETED)
-                .prefetch_related('vote_set')
-                .order_by('field_name'),
-            lambda modification: modification.field_name
-        )
-        order = [i[0] for i in FieldValue.STATUS_CHOICES]
-        key = lambda x: (order.index(x.status), -x.votes)
-        modifications = dict(
-            (field_name, sorted(map(self.add_user_actions, field_values), key=key))
-            for field_name, field_values
-            in grouped_modifications_iterator
-        )
-        context_data['grouped_modifications'] = modifications
+        facts = list(self.object.modifications
+                     .exclude(status=FieldValue.STATUS_DELETED)
+                     .order_by('field_name'))
+        add_user_actions(self.request, facts)
+        context_data['grouped_modifications'] = group_facts(facts)
         context_data['grade'] = self.object.main_grade
         context_data['field_types'] = FieldValue.EDITABLE_FIELDS
         return context_data
 
 
+class StudentPanelView(PanelCacheMixin, StudentDetailView):
+    """
+    Только карточка студента, без страницы вокруг: ее подгружает список
+    """
+    template_name = 'include/student_panel.jade'
+
+
+class StudentPanelsView(PanelCacheMixin, ConditionalMixin, ListView):
+    """
+    Карточки нескольких студентов ({id: html}) для подгрузки при
+    наведении: по одному запросу на студентов, правки и голоса
+    """
+    model = Student
+    max_ids = 20
+
+    def get_ids(self):
+        ids = self.request.GET.get('ids', '').split(',')
+        return sorted(set(int(i) for i in ids if i.isdigit()))[:self.max_ids]
+
+    def get_validator(self):
+        return panel_validator(self.get_ids())
+
+    def get_queryset(self):
+        return Student.objects.filter(pk__in=self.get_ids())
+
+    def get_context_data(self, **kwargs):
+        students = list(self.object_list)
+        facts = list(FieldValue.objects
+                     .filter(target__in=[s.pk for s in students])
+                     .exclude(status=FieldValue.STATUS_DELETED)
+                     .order_by('target', 'field_name'))
+        add_user_actions(self.request, facts)
+        by_student = dict(
+            (target_id, list(target_facts))
+            for target_id, target_facts in itertools.groupby(facts, lambda f: f.target_id)
+        )
+        return {'panels': dict(
+            (s.pk, render_to_string('include/student_panel.jade', {
+                'object': s,
+                'student': s,
+                'grouped_modifications': group_facts(by_student.get(s.pk, [])),
+                'field_types': FieldValue.EDITABLE_FIELDS,
+            }, self.request))
+            for s in students
+        )}
+
+    def render_to_response(self, context, **response_kwargs):
+        return JsonResponse(context['panels'])
+
+
 class StudentCreateView(CreateView):
     template_name = 'core/student_form.jade'
     model = Student
@@ -350,13 +521,16 @@ class FieldValueCreateView(CreateView):
 
         # Привязываем правку к выпускнику по id из урла
         student_id = self.kwargs.get('pk')
-        existing = FieldValue.objects.filter(
-            target_id=student_id,
-            field_name=self.object.field_name,
-            field_value__iexact=self.object.field_value,
-        )
+        value_key = canonical.value_key(
+            self.object.field_value, self.object.field_name in FieldValue.URL_FIELDS)
+        # Все правки выпускника одним запросом: по ним ищется повтор
+        # и собирается карточка
+        facts = list(FieldValue.objects.filter(target_id=student_id).order_by('id'))
+        existing = next((
+            f for f in facts
+            if f.field_name == self.object.field_name and f.value_key == value_key
+        ), None)
         if existing:
-            existing = existing.first()
             if existing.status == FieldValue.STATUS_DELETED:
                 # it was deleted either by author or by target
                 # if by author and author adds it back — ok
@@ -368,7 +542,7 @@ class FieldValueCreateView(CreateView):
                 if existing.delete_vote.author_code.owner_id == existing.target_id \
                         and auth_code != existing.delete_vote.author_code:
                     return HttpResponseRedirect(self.get_success_url())
-                existing.delete_vote.delete()
+                rules.remove_vote(existing.delete_vote)
                 # add vote up if necessary:
                 # if adder is not author
                 if not self.object.author_code \
@@ -377,27 +551,24 @@ class FieldValueCreateView(CreateView):
                                 value=Vote.VOTE_UP)
                     if auth_code:
                         vote.author_code = auth_code
-                    vote.save()
-                rules.update_fields(
-                    student_id,
-                    self.object.field_name,
-                )
+                    try:
+                        with transaction.atomic():
+                            rules.add_vote(vote)
+                    except IntegrityError:
+                        pass  # этот код уже голосовал за правку
             return HttpResponseRedirect(self.get_success_url())
         try:
-            self.object.target = Student.objects.get(id=student_id)
+            self.object.target = Student.objects.select_related('main_grade').get(id=student_id)
         except Student.objects.DoesNotExist:
             return Http404()
 
-        self.object.save()
-        vote = Vote(field_value=self.object,
-                    value=Vote.VOTE_ADDED)
+        vote = Vote(value=Vote.VOTE_ADDED)
         if auth_code:
             vote.author_code = auth_code
-        vote.save()
-        rules.update_fields(
-            self.object.target_id,
-            self.object.field_name,
-        )
+        try:
+            rules.add_fact(self.object, vote, facts)
+        except IntegrityError:
+            pass  # такую же правку только что добавил параллельный запрос
         return HttpResponseRedirect(self.get_success_url())
 
     def form_invalid(self, form):
@@ -407,15 +578,41 @@ class FieldValueCreateView(CreateView):
         return reverse('student-detail', args=[self.kwargs['pk']])
 
 
+def student_url(request, student_id):
+    """
+    Куда вернуть после голоса или письма: скрипт списка заменяет карточку
+    ее фрагментом, обычная отправка формы получает страницу выпускника
+    """
+    name = request.is_ajax() and 'student-panel' or 'student-detail'
+    return reverse(name, kwargs={'pk': str(student_id)})
+
+
 def handle_vote(request, pk, vote_type):
     if request.method != 'POST':
         return HttpResponseBadRequest()
+    try:
+        # Голоса за правки выпускника идут по очереди под блокировкой их
+        # строк (cast_vote): так один код не проголосует параллельно и за,
+        # и против даже там, где нет частичного индекса
+        # vote_up_down_unique (MySQL). Это внешняя транзакция запроса:
+        # точка сохранения ей не нужна, ошибка откатывает ее целиком
+        with transaction.atomic(savepoint=False):
+            return cast_vote(request, pk, vote_type)
+    except IntegrityError:
+        # Такой же голос только что добавил параллельный запрос
+        return HttpResponse(status=406)
+
+
+def cast_vote(request, pk, vote_type):
     obj = Vote()
 
-    # Идентификатор значения FieldValue
-    try:
-        obj.field_value = FieldValue.objects.get(id=pk)
-    except FieldValue.objects.DoesNotExist:
+    # Все правки выпускника под блокировкой одним запросом: голоса за его
+    # правки идут по очереди, а карточка пересобирается без перечитывания
+    facts = list(FieldValue.objects.select_for_update().filter(
+        target_id__in=FieldValue.objects.filter(id=pk).values('target_id'),
+    ).order_by('id'))
+    obj.field_value = next((f for f in facts if f.pk == int(pk)), None)
+    if not obj.field_value:
         return Http404()
 
     # Тип голоса FieldValue
@@ -424,56 +621,42 @@ def handle_vote(request, pk, vote_type):
     else:
         return HttpResponseBadRequest()
 
+    # Все голоса за правку: по ним проверяются голоса этого кода, и их же
+    # без перечитывания пересчитывает core.rules
+    votes = list(obj.field_value.vote_set.select_related('author_code').order_by('id'))
+
     # Привязываем код авторизации и создаем для него запись в таблице кодов
     auth_code = request.session.get('auth_code')
     if auth_code:
         author_code = AuthCode.objects.get_by_code(auth_code)
         obj.author_code = author_code
 
+        own_votes = [vote for vote in votes if vote.author_code_id == author_code.pk]
+        own_values = set(vote.value for vote in own_votes)
+
         if obj.value == Vote.VOTE_TO_DEL:
             if author_code.owner_id != obj.field_value.target_id \
-            and not Vote.objects.filter(
-                field_value_id=obj.field_value_id,
-                value=Vote.VOTE_ADDED,
-                author_code_id=obj.author_code_id
-            ).exists():
+            and Vote.VOTE_ADDED not in own_values:
                 return HttpResponse(status=412)
 
-        existing = Vote.objects.filter(
-            field_value_id=obj.field_value_id,
-            value=obj.value,
-            author_code_id=obj.author_code_id
-        )
         if request.GET.get('remove') == 'yes,please':
-            existing.delete()
-            rules.update_fields(
-                obj.field_value.target_id,
-                obj.field_value.field_name,
-            )
-            return HttpResponseRedirect(
-                reverse('student-detail', kwargs={
-                    'pk': str(obj.field_value.target_id)}))
-        elif existing.exists():
+            for vote in own_votes:
+                if vote.value == obj.value:
+                    rules.remove_vote(vote, votes=votes, facts=facts)
+            return HttpResponseRedirect(student_url(request, obj.field_value.target_id))
+        elif obj.value in own_values:
             return HttpResponse(status=406)
 
         if obj.value in (Vote.VOTE_UP, Vote.VOTE_DOWN):
             # Delete the opposite vote if there is
-            Vote.objects.filter(
-                field_value_id=obj.field_value_id,
-                value=obj.value == Vote.VOTE_UP and Vote.VOTE_DOWN or Vote.VOTE_UP,
-                author_code_id=obj.author_code_id
-            ).delete()
+            for vote in own_votes:
+                if vote.value in (Vote.VOTE_UP, Vote.VOTE_DOWN) and vote.value != obj.value:
+                    rules.remove_vote(vote, votes=votes, facts=facts)
     elif obj.value == Vote.VOTE_TO_DEL:
         return HttpResponseBadRequest()
 
-    obj.save()
-    rules.update_fields(
-        obj.field_value.target_id,
-        obj.field_value.field_name,
-    )
-    return HttpResponseRedirect(
-        reverse('student-detail', kwargs={
-            'pk': str(obj.field_value.target_id)}))
+    rules.add_vote(obj, votes=votes, facts=facts)
+    return HttpResponseRedirect(student_url(request, obj.field_value.target_id))
 
 
 class SendMailView(CreateView):
@@ -504,19 +687,44 @@ class SendMailView(CreateView):
         return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
-        return reverse('student-detail', kwargs={
-            'pk': str(self.get_object().target_id)
-        })
+        return student_url(self.request, self.get_object().target_id)
 
 
 class QAView(TemplateView):
     template_name = 'core/qa.jade'
 
 
-class FeedView(ListView):
-    model = FieldValue
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=utc)
+
+
+def encode_feed_key(fact):
+    """
+    Непрозрачный токен ?after= для ключа (status_update_date, id) правки
+    """
+    delta = fact.status_update_date - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return urlsafe_base64_encode(b'%d.%d' % (microseconds, fact.pk))
+
+
+def decode_feed_key(token):
+    try:
+        microseconds, pk = force_text(urlsafe_base64_decode(token)).split('.')
+        return EPOCH + datetime.timedelta(microseconds=int(microseconds)), int(pk)
+    except (ValueError, TypeError, OverflowError):
+        raise Http404()
+
+
+class FeedView(ConditionalMixin, ListView):
+    """
+    Лента правок из FeedEntry. Страницы идут по ключу
+    (status_update_date, id) от последней показанной правки, без OFFSET
+    и COUNT
+    """
+    model = FeedEntry
     template_name = 'core/feed.jade'
-    paginate_by = 20
+    page_size = 20
+    param_after = 'after'
+    date_field = 'status_update_date'
 
     param_year = 'year'
     param_grade = 'grade'
@@ -525,8 +733,20 @@ class FeedView(ListView):
 
     re_grade = re.compile(r'(\d{4})(\w)$', re.U)
 
-    def get_queryset(self):
-        qs = super(FeedView, self).get_queryset()
+    def get_validator(self):
+        # Записи ленты обновляются при каждом голосе и смене статуса
+        qs = self.filter_queryset(FeedEntry.objects.all())
+        if self.request.GET.get(self.param_author):
+            # Из ленты автора запись пропадает, когда он отменяет свой
+            # голос, и дата этого не видит: считаем строки его активности
+            data = qs.aggregate(updated_at=Max('updated_at'), entries=Count('pk'))
+            return data['updated_at'], data['entries']
+        return qs.aggregate(updated_at=Max('updated_at'))['updated_at'], None
+
+    def filter_queryset(self, qs, after=None):
+        """
+        after — ключ (дата, id) последней правки предыдущей страницы
+        """
         GET = self.request.GET
 
         if GET.get(self.param_student):
@@ -536,7 +756,7 @@ class FeedView(ListView):
         elif GET.get(self.param_year):
             year = GET.get(self.param_year)
             qs = qs.filter(
-                target__main_grade__graduation_year=year)
+                graduation_year=year)
 
         elif GET.get(self.param_grade):
             grade = GET.get(self.param_grade)
@@ -544,77 +764,76 @@ class FeedView(ListView):
             if m:
                 y, l = m.group(1), m.group(2)
                 qs = qs.filter(
-                    (
-                        Q(target__main_grade__graduation_year=y) &
-                        Q(target__main_grade__letter=l)
-                    ) |
-                    Q(field_value=grade)
+                    Q(graduation_year=y, grade_letter=l) |
+                    Q(field_name=FieldValue.FIELD_GRADE,
+                      field_value__value_key=canonical.value_key(grade))
                 )
             else:
                 qs = qs.none()
 
         elif GET.get(self.param_author):
-            author = GET.get(self.param_author)
-            vote_ids = Vote.objects.filter(
-                author_code__owner_id=author
-            ).values_list('field_value_id', flat=True)
-            qs = qs.filter(
-                pk__in=list(vote_ids)
+            # Лента автора идет по копии даты в его активности и читается
+            # по индексу (author, status_update_date). Условия в одном
+            # filter(), чтобы не соединять активность дважды
+            self.date_field = 'field_value__activities__status_update_date'
+            return qs.filter(
+                self.after_condition(after),
+                field_value__activities__author_id=GET.get(self.param_author),
             )
+        return qs.filter(self.after_condition(after))
 
-        qs = qs\
-            .prefetch_related(
-                'target__main_grade',
-                'vote_set__author_code__owner__main_grade',
-                'author_code__owner__main_grade',
-            ) \
-            .exclude(
-                status=FieldValue.STATUS_DELETED
-            ) \
-            .exclude(
-                field_name=FieldValue.FIELD_EMAIL,
-            )
-        return qs.order_by('-status_update_date')
-
-    def add_user_actions(self, fact):
-        code = self.request.session.get('auth_code')
-        if not code:
-            return fact
-        for vote in fact.vote_set.all():
-            if vote.author_code and vote.author_code.code == code:
-                if vote.value == Vote.VOTE_ADDED:
-                    fact.is_owned = True
-                elif vote.value == Vote.VOTE_UP:
-                    fact.upvoted = True
-                elif vote.value == Vote.VOTE_DOWN:
-                    fact.downvoted = True
-                elif vote.value == Vote.VOTE_TO_DEL:
-                    fact.deleted = True
-        return fact
+    def after_condition(self, after):
+        if not after:
+            return Q()
+        date, pk = after
+        return Q(**{self.date_field + '__lt': date}) | \
+            Q(**{self.date_field: date, 'pk__lt': pk})
+
+    def get_queryset(self):
+        after = self.request.GET.get(self.param_after)
+        qs = self.filter_queryset(
+            super(FeedView, self).get_queryset(),
+            after and decode_feed_key(after),
+        )
+        qs = qs.exclude(status=FieldValue.STATUS_DELETED)
+        # Лишняя правка показывает, есть ли следующая страница
+        return qs.order_by('-' + self.date_field, '-pk')[:self.page_size + 1]
+
+    def page_url(self, after=None):
+        params = self.request.GET.copy()
+        params.pop(self.param_after, None)
+        if after:
+            params[self.param_after] = after
+        return '?' + params.urlencode()
 
     def get_context_data(self, **kwargs):
         data = super(FeedView, self).get_context_data(**kwargs)
-        ol = data['object_list']
-        ol = list(ol)
+        ol = list(data['object_list'])
+        if len(ol) > self.page_size:
+            ol = ol[:self.page_size]
+            data['next_url'] = self.page_url(encode_feed_key(ol[-1]))
+        if self.request.GET.get(self.param_after):
+            data['first_url'] = self.page_url()
+        add_user_actions(self.request, ol)
+
+        # Авторы и голосовавшие всей страницы одним запросом
+        people = set(i.author_id for i in ol)
+        for i in ol:
+            for ids in i.voter_ids.values():
+                people.update(ids)
+        people = Student.objects.select_related('main_grade').in_bulk(
+            [pk for pk in people if pk])
         for i in ol:
-            self.add_user_actions(i)
-            i.votes_up = []
-            i.votes_down = []
-            for vote in i.vote_set.all():
-                owner = None
-                if vote.author_code_id and vote.author_code.owner_id:
-                    owner = vote.author_code.owner
-                if vote.value == Vote.VOTE_UP:
-                    i.votes_up.append(owner)
-                elif vote.value == Vote.VOTE_DOWN:
-                    i.votes_down.append(owner)
+            i.author = people.get(i.author_id)
+            i.votes_up = [people.get(pk) for pk in i.voter_ids.get(Vote.VOTE_UP, [])]
+            i.votes_down = [people.get(pk) for pk in i.voter_ids.get(Vote.VOTE_DOWN, [])]
         data['object_list'] = ol
 
         if ol and self.request.GET.get(self.param_student):
-            data['student'] = ol[0].target
+            data['student'] = Student.objects.select_related('main_grade').get(pk=ol[0].target_id)
         elif self.request.GET.get(self.param_author):
             author_id = self.request.GET.get(self.param_author)
-            data['author'] = get_object_or_404(Student, pk=author_id)
+            data['author'] = get_object_or_404(Student.objects.select_related('main_grade'), pk=author_id)
         elif self.request.GET.get(self.param_year):
             data['year'] = self.request.GET.get(self.param_year)
         elif self.request.GET.get(self.param_grade):
@@ -39,6 +39,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.profiling.ProfilingMiddleware',
+    'core.query_stats.QueryStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -131,6 +133,85 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static')
 
 
+# Suggest index, seconds between reading changed facts and between full rebuilds,
+# and how long requests wait for the first index of a process before answering empty
+SUGGEST_INDEX_REFRESH = 5
+SUGGEST_INDEX_REBUILD = 60 * 60
+SUGGEST_INDEX_WAIT = 2
+
+# Auth service: (connect, read) timeouts, seconds to cache check_code answers
+# and how many codes to keep, errors in a row before falling back to known
+# codes and seconds until retry
+AUTH_SERVICE_URL = 'http://auth.alumni57.ru/api/v1/check_code'
+AUTH_SERVICE_TIMEOUT = (1, 3)
+AUTH_SERVICE_CACHE_TTL = 5 * 60
+AUTH_SERVICE_CACHE_SIZE = 10000
+AUTH_SERVICE_FAILURES = 3
+AUTH_SERVICE_RETRY = 30
+
+# Per-process LRU cache of AuthCode rows used by votes and new facts: entries
+# and seconds before a code is read again (changes made by other processes)
+AUTH_CODE_CACHE_SIZE = 10000
+AUTH_CODE_CACHE_TTL = 60
+
+# Page cache for grade, alphabet and student list pages. Invalidation bumps
+# version keys in the cache itself, so imports, management commands and other
+# workers only reach the pages through a shared backend (file, memcached).
+# On local memory the page cache stays off unless PAGE_CACHE_LOCAL is set,
+# which is only right for a single process (runserver, tests)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+PAGE_CACHE = 'pages'
+PAGE_CACHE_TIMEOUT = 24 * 60 * 60
+PAGE_CACHE_LOCAL = False
+
+# Query counts and timings per request: X-Query-Stats response header and,
+# for requests slower than QUERY_STATS_LOG_SLOWER seconds, the rolling log.
+# Off by default: every query is kept in memory while a request runs
+QUERY_STATS = False
+QUERY_STATS_LOG_SLOWER = 0.5
+QUERY_STATS_LOG = os.path.join(ROOT, 'query_stats.log')
+
+# Request profiles, see core/profiling.py. Off while PROFILE_DIR is None.
+# PROFILE_ENGINE is `sampler' (collapsed stacks every PROFILE_INTERVAL
+# seconds) or `cprofile' (.prof files)
+PROFILE_DIR = None
+PROFILE_SAMPLE_RATE = 0.001
+PROFILE_ENGINE = 'sampler'
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_BYTES = 100 * 1024 * 1024
+PROFILE_TOKEN_MAX_AGE = 24 * 60 * 60
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'query_stats': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': QUERY_STATS_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'core.query_stats': {
+            'handlers': ['query_stats'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
 # Respect local_settings file
 try:
     from website.local_settings import *